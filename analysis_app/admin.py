@@ -1,8 +1,12 @@
 from django.contrib import admin
-from .models import Conversation , Message , ConversationAnalysis
+from .models import Conversation , Message , ConversationAnalysis, GeminiResponse, AnalysisJob, AnalysisRollup, AnalysisResult
 
 # Register your models here.
 
 admin.site.register(Conversation)
 admin.site.register(Message)
 admin.site.register(ConversationAnalysis)
+admin.site.register(GeminiResponse)
+admin.site.register(AnalysisJob)
+admin.site.register(AnalysisRollup)
+admin.site.register(AnalysisResult)
@@ -0,0 +1,221 @@
+# Async versions of the read, ingest and analysis endpoints, routed instead of the views in views.py
+# when settings.ASYNC_VIEWS is on (the default of the ASGI application). DRF has no async views, so
+# these are plain Django coroutines that reuse the DRF serializers and cursor format.
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Prefetch
+from django.http import HttpResponseNotModified, JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from .exports import EXPORT_FORMATS, stream_analyses
+from .instrumentation import AnalysisTrace
+from .jobs import analyse_and_store, enqueue_analysis
+from .models import Conversation, ConversationAnalysis, Message
+from .result_cache import analysis_etag, conversation_fingerprint, etag_matches
+from .serializers import (
+    AnalysisFilterSerializer, ConversationAnalysisSerializer, ConversationListSerializer, ConversationSerializer,
+    ConversationUploadSerializer, MetricSelectionSerializer,
+)
+from .utils import get_conversation_analysis
+from .views import AnalysisCursorPagination, ConversationCursorPagination, _analysis_headers
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _analysis_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASYNC_ANALYSIS_WORKERS, thread_name_prefix="analysis"
+                )
+    return _executor
+
+
+def _with_connection_cleanup(fn):
+    # executor threads outlive requests, their connections are recycled like a request's would be
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return run
+
+
+async def run_in_executor(fn, *args, **kwargs):
+    """
+    runs CPU-bound fn in the bounded analysis executor (ASYNC_ANALYSIS_WORKERS threads) so that the
+    event loop keeps serving other requests, further calls wait for a free thread
+    """
+    call = sync_to_async(_with_connection_cleanup(fn), thread_sensitive=False, executor=_analysis_executor())
+    return await call(*args, **kwargs)
+
+
+def _response(data, status=200, headers=None):
+    # DRF's encoder, like the sync views, so numpy scalars in analysis results serialize
+    return JsonResponse(data, status=status, headers=headers, encoder=JSONEncoder, safe=False)
+
+
+def _drf_request(request):
+    # query_params and data parsing for the serializers and paginators, no authentication involved
+    return Request(request, parsers=[JSONParser()])
+
+
+class AsyncCursorPaginationMixin:
+    """
+    CursorPagination.paginate_queryset for async views: the same cursors and links, with the page read
+    by the async ORM. Like every paginator in views, the ordering is one unique field.
+    """
+
+    async def apaginate_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, None)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, position = self.cursor or (0, False, None)
+
+        field = self.ordering[0].lstrip("-")
+        descending = self.ordering[0].startswith("-")
+        queryset = queryset.order_by(("-" if descending != reverse else "") + field)
+        if position is not None:
+            queryset = queryset.filter(**{f"{field}__{'lt' if descending != reverse else 'gt'}": position})
+
+        # one extra row tells whether a page follows
+        results = [item async for item in queryset[offset:offset + self.page_size + 1]]
+        self.page = results[:self.page_size]
+        following = self._get_position_from_instance(results[-1], self.ordering) if len(results) > self.page_size else None
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None or offset > 0
+            self.has_previous = following is not None
+            self.next_position, self.previous_position = position, following
+        else:
+            self.has_next = following is not None
+            self.has_previous = position is not None or offset > 0
+            self.next_position, self.previous_position = following, position
+        return self.page
+
+    async def apaginate_or_error(self, queryset, request):
+        """(page, None), or (None, error response) for a cursor DRF rejects, as its exception handler would"""
+        try:
+            return await self.apaginate_queryset(queryset, request), None
+        except APIException as exc:
+            return None, _response({"detail": exc.detail}, status=exc.status_code)
+
+    def get_paginated_json_response(self, data):
+        return _response({"next": self.get_next_link(), "previous": self.get_previous_link(), "results": data})
+
+
+class AsyncAnalysisCursorPagination(AsyncCursorPaginationMixin, AnalysisCursorPagination):
+    pass
+
+
+class AsyncConversationCursorPagination(AsyncCursorPaginationMixin, ConversationCursorPagination):
+    pass
+
+
+@require_GET
+async def get_all_analyses(request):
+    request = _drf_request(request)
+    filters = AnalysisFilterSerializer(data=request.query_params)
+    if not filters.is_valid():
+        return _response(filters.errors, status=400)
+    analyses = filters.filter_queryset(ConversationAnalysis.objects.select_related('conversation'))
+
+    export = request.query_params.get("export")
+    if export:
+        if export not in EXPORT_FORMATS:
+            return _response({"error": f"export must be one of {', '.join(EXPORT_FORMATS)}"}, status=400)
+        return stream_analyses(analyses, export, asynchronous=True)
+
+    paginator = AsyncAnalysisCursorPagination()
+    page, error = await paginator.apaginate_or_error(analyses, request)
+    if error:
+        return error
+    return paginator.get_paginated_json_response(ConversationAnalysisSerializer(page, many=True).data)
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+async def upload_json(req):
+    req = _drf_request(req)
+    if req.method == 'GET':
+        conversations = Conversation.objects.all()
+        include_messages = req.query_params.get("include_messages", "1") not in ("0", "false")
+        if include_messages:
+            conversations = conversations.prefetch_related(
+                Prefetch("messages", queryset=Message.objects.order_by("id").only("conversation_id", "sender", "message", "timestamp"))
+            )
+        paginator = AsyncConversationCursorPagination()
+        page, error = await paginator.apaginate_or_error(conversations, req)
+        if error:
+            return error
+        serializer = ConversationListSerializer(page, many=True, context={"include_messages": include_messages})
+        return paginator.get_paginated_json_response(serializer.data)
+
+    try:
+        serializer = ConversationUploadSerializer(data=req.data)
+    except ParseError as e:
+        return _response({"error": str(e.detail)}, status=400)
+    if not serializer.is_valid():
+        return _response(serializer.errors, status=400)
+    # the conversation and its messages are written in one transaction, which the async ORM cannot open
+    conversation = await sync_to_async(serializer.save)()
+    messages = [m async for m in conversation.messages.order_by("id").values("sender", "message", "timestamp")]
+    res_data = ConversationSerializer(conversation).data
+    res_data["message_count"] = conversation.message_count
+    res_data["messages"] = messages
+    return _response(res_data, status=201)
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+async def analyse_chat(request, conversation_id):
+    request = _drf_request(request)
+    try:
+        conversation = await Conversation.objects.aget(id=conversation_id)
+    except Conversation.DoesNotExist:
+        return _response({"error": "Conversation not found"}, status=404)
+
+    if request.method == 'POST' and request.query_params.get("sync") != "1" and "metrics" not in request.query_params:
+        job = await sync_to_async(enqueue_analysis)(conversation)
+        return _response(
+            {"job_id": job.id, "status": job.status, "status_url": reverse("analysis_job_status", args=[job.id])},
+            status=202,
+        )
+    selection = MetricSelectionSerializer(data=request.query_params)
+    if not selection.is_valid():
+        return _response(selection.errors, status=400)
+    selected = selection.validated_data.get("metrics")
+    etag = None
+    if request.method == 'GET':
+        etag = analysis_etag(await sync_to_async(conversation_fingerprint)(conversation.id), selected)
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return HttpResponseNotModified(headers={"ETag": etag})
+    trace = AnalysisTrace(conversation.id)
+    try:
+        if selected:
+            analytics_data, api_response = await run_in_executor(
+                get_conversation_analysis, conversation, trace=trace, metrics=selected
+            )
+        else:
+            analytics_data, api_response = await run_in_executor(analyse_and_store, conversation, trace=trace)
+    except Exception as e:
+        return _response({"error": str(e)}, status=500)
+    if analytics_data is None:
+        return _response(api_response, status=400)
+    return _response(api_response, headers=_analysis_headers(trace, etag))
@@ -1,18 +1,165 @@
 # All imports at the top
-from .models import Conversation, ConversationAnalysis
-from .utils import get_conversation_analysis
-
-
-def run_daily_analysis():
-    conversations = Conversation.objects.all()
-    for conversation in conversations:
-        analytics_data, _ = get_conversation_analysis(conversation)
-        
-        if analytics_data is None:
-            continue
-        
-        # Store / update the analysis record
-        ConversationAnalysis.objects.update_or_create(
-            conversation=conversation,
-            defaults=analytics_data
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Conversation, ConversationAnalysis, Message
+from .utils import content_fingerprint, get_conversation_analysis, split_messages
+from .features import ensure_message_features
+from .model_registry import get_gemini_model
+from .rollups import AnalysisWriter
+from .result_cache import analysis_version
+from .empathy_utils import EmotionEngine
+from . import workers as analysis_workers
+
+
+# conversations per IN (...) lookup when hashing messages, below SQLite's host parameter limit
+_HASH_BATCH_SIZE = 900
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def conversation_fingerprints(conversations):
+    """
+    {conversation_id: content_hash} for a queryset of conversations, from the hashes ingest stores on them.
+    Only conversations without one (a message was written outside ingest) have their messages streamed
+    and hashed, and the hash is stored for the next run.
+    """
+    fingerprints = dict(conversations.values_list("id", "content_hash"))
+    missing = sorted(cid for cid, content_hash in fingerprints.items() if not content_hash)
+    for chunk_ids in _chunks(missing, _HASH_BATCH_SIZE):
+        rows = Message.objects.filter(conversation_id__in=chunk_ids).order_by("conversation_id", "id") \
+            .values_list("conversation_id", "sender", "message", "timestamp")
+        hashed = dict.fromkeys(chunk_ids, content_fingerprint([]))
+        hashed.update(
+            (conversation_id, content_fingerprint(row[1:] for row in group))
+            for conversation_id, group in groupby(rows.iterator(chunk_size=2000), key=itemgetter(0))
         )
+        with transaction.atomic():
+            for conversation_id, content_hash in hashed.items():
+                # unless a message was written again meanwhile, which cleared the hash the other way round
+                Conversation.objects.filter(id=conversation_id, content_hash="").update(content_hash=content_hash)
+        fingerprints.update(hashed)
+    return fingerprints
+
+
+def pending_conversation_ids(full=False, conversations=None):
+    """
+    ids of conversations that have no analysis yet, whose messages changed since they were analysed or
+    that were analysed by an older analysis version,
+    conversations optionally narrows the run to a queryset of conversations
+    """
+    conversations = Conversation.objects.all() if conversations is None else conversations
+    conversation_ids = list(conversations.order_by("id").values_list("id", flat=True))
+    if full:
+        return conversation_ids
+    fingerprints = conversation_fingerprints(conversations)
+    version = analysis_version()
+    analysed = {
+        row[0]: row[1:]
+        for row in ConversationAnalysis.objects.filter(conversation__in=conversations)
+        .values_list("conversation_id", "content_hash", "analysis_version")
+    }
+    return [cid for cid in conversation_ids if analysed.get(cid) != (fingerprints[cid], version)]
+
+
+def analyse_chunk(chunk_ids, engine, n_process=None, full=False):
+    """
+    analyses one chunk of conversations and returns [(conversation_id, analytics_data)] without writing anything,
+    a full run recomputes rather than answering from the result cache, n_process defaults to SPACY_N_PROCESS
+    """
+    n_process = n_process or getattr(settings, "SPACY_N_PROCESS", 1)
+    # conversations above the streaming threshold are read and scored in bounded pieces by their own
+    # analysis (with a windowed Gemini transcript), they stay out of the chunk-wide passes below
+    threshold = getattr(settings, "ANALYSIS_STREAMING_THRESHOLD", 0)
+    streamed = set()
+    if threshold:
+        streamed = set(
+            Message.objects.filter(conversation_id__in=chunk_ids).values("conversation_id")
+            .annotate(count=Count("id")).filter(count__gt=threshold).values_list("conversation_id", flat=True)
+        )
+    rows = Message.objects.filter(conversation_id__in=[cid for cid in chunk_ids if cid not in streamed]) \
+        .order_by("conversation_id", "id").values("id", "conversation_id", "sender", "message", "timestamp")
+    # features for every message of the chunk that is not in the store yet, computed in one
+    # length-bucketed emotion pass, one embedding batch and one spaCy stream
+    engine.clear()
+    ensure_message_features(rows, engine, n_process=n_process)
+    # concurrent Gemini calls for the whole chunk, the per-conversation analysis then reads them from the cache
+    get_gemini_model().score_many(
+        split_messages(group)[2] for _, group in groupby(rows, key=itemgetter("conversation_id"))
+    )
+
+    results = []
+    for conversation in Conversation.objects.filter(id__in=chunk_ids):
+        analytics_data, _ = get_conversation_analysis(
+            conversation, emotion_engine=engine, streaming=conversation.id in streamed,
+            use_cache=False if full else None,
+        )
+        if analytics_data is not None:
+            results.append((conversation.id, analytics_data))
+    return results
+
+
+def _store(writer, results):
+    # Store / update the analysis records, written in batches by the writer
+    for conversation_id, analytics_data in results:
+        writer.add(conversation_id, analytics_data)
+    return len(results)
+
+
+def _run_parallel(conversation_ids, workers, chunk_size, torch_threads, writer, full=False):
+    analysed = 0
+    chunks = _chunks(conversation_ids, chunk_size)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=analysis_workers.init_worker,
+        initargs=(torch_threads, workers),
+    ) as executor:
+        # keep a bounded number of chunks in flight. Analyses and rollups are written by this process only,
+        # workers write just the caches (message features, Gemini responses, results) as they fill them
+        pending = set()
+        for chunk_ids in chunks:
+            pending.add(executor.submit(analysis_workers.analyse_chunk, chunk_ids, full))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    analysed += _store(writer, future.result())
+        for future in wait(pending).done:
+            analysed += _store(writer, future.result())
+    return analysed
+
+
+def run_daily_analysis(workers=None, chunk_size=None, torch_threads=None, full=False, conversations=None):
+    workers = workers or getattr(settings, "ANALYSIS_WORKERS", 1)
+    chunk_size = chunk_size or getattr(settings, "ANALYSIS_CHUNK_SIZE", 50)
+    conversations = Conversation.objects.all() if conversations is None else conversations
+    total = conversations.count()
+    # unchanged conversations keep their analysis unless a full run is forced
+    conversation_ids = pending_conversation_ids(full=full, conversations=conversations)
+
+    with AnalysisWriter() as writer:
+        if workers > 1:
+            torch_threads = torch_threads or getattr(settings, "ANALYSIS_TORCH_THREADS", None) \
+                or max(1, (os.cpu_count() or 1) // workers)
+            analysed = _run_parallel(conversation_ids, workers, chunk_size, torch_threads, writer, full=full)
+        else:
+            engine = EmotionEngine()
+            analysed = 0
+            for chunk_ids in _chunks(conversation_ids, chunk_size):
+                analysed += _store(writer, analyse_chunk(chunk_ids, engine, full=full))
+
+    return {
+        "conversations": total,
+        "analysed": analysed,
+        "skipped": total - len(conversation_ids),
+    }
@@ -1,53 +1,111 @@
-from typing import List, Tuple
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from contextlib import nullcontext
+from typing import Iterable, List, Optional, Tuple
 import numpy as np
+from django.conf import settings
+from .inference_client import get_inference_client
+from .instrumentation import count_model_call
+from .model_registry import get_emotion_model
+from .onnx_backend import OnnxEmotionClassifier
+from .utils import pair_similarities
 
 
-_EMOTION_MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
+class EmotionEngine:
+    """
+    Batched emotion classifier. Texts are tokenized once, sorted by token length and run through
+    the model in padded batches, so short messages are never padded to the length of long ones.
+    Probabilities are cached per text, which lets the nightly run prime one engine with the
+    messages of many conversations and then score each conversation from the cache.
+    """
 
-_emotion_tokenizer = AutoTokenizer.from_pretrained(_EMOTION_MODEL_NAME)
-_emotion_model = AutoModelForSequenceClassification.from_pretrained(_EMOTION_MODEL_NAME)
+    def __init__(self, batch_size: Optional[int] = None, max_length: int = 512):
+        self.batch_size = batch_size or getattr(settings, "EMOTION_BATCH_SIZE", 32)
+        self.max_length = max_length
+        self._cache = {}
 
+    def prime(self, texts: Iterable[str]) -> None:
+        """runs the model for every text that is not cached yet"""
+        pending = [text for text in dict.fromkeys(texts) if text not in self._cache]
+        if not pending:
+            return
 
-def compute_empathy_score(dialogue_pairs: List[Tuple[str, str]]) -> tuple[float, str]:
+        client = get_inference_client()
+        if client is not None:
+            self._cache.update(zip(pending, client.emotion(pending)))
+            count_model_call("emotion")
+            return
 
-    if not dialogue_pairs:
-        return 0.0, "low"
+        tokenizer, model = get_emotion_model()
+        encodings = tokenizer(pending, truncation=True, max_length=self.max_length)
+        order = sorted(range(len(pending)), key=lambda i: len(encodings["input_ids"][i]))
 
-    empathy_scores = []
-
-    for user_msg, ai_msg in dialogue_pairs:
-        if not user_msg.strip() or not ai_msg.strip():
-            continue
-
-        user_inputs = _emotion_tokenizer(user_msg, return_tensors="pt", truncation=True, max_length=512)
-        with torch.no_grad():
-            user_outputs = _emotion_model(**user_inputs)
-        user_probs = torch.softmax(user_outputs.logits, dim=1)[0]
-        user_emotion_conf = float(torch.max(user_probs).item())
-
-        ai_inputs = _emotion_tokenizer(ai_msg, return_tensors="pt", truncation=True, max_length=512)
-        with torch.no_grad():
-            ai_outputs = _emotion_model(**ai_inputs)
-        ai_probs = torch.softmax(ai_outputs.logits, dim=1)[0]
-        
-        emotion_similarity = float(torch.nn.functional.cosine_similarity(
-            user_probs.unsqueeze(0), ai_probs.unsqueeze(0)
-        ).item())
-        
-        empathy_score = (0.5 * emotion_similarity) + (0.5 * user_emotion_conf)
-        empathy_scores.append(empathy_score)
-
-    if not empathy_scores:
-        return 0.0, "low"
+        if isinstance(model, OnnxEmotionClassifier):
+            run, tensors, context = model.probabilities, "np", nullcontext()
+        else:
+            import torch
+
+            run = lambda batch: torch.softmax(model(**batch).logits, dim=-1).float().numpy()
+            tensors, context = "pt", torch.inference_mode()
+
+        with context:
+            for start in range(0, len(order), self.batch_size):
+                batch_idx = order[start:start + self.batch_size]
+                batch = tokenizer.pad(
+                    {key: [encodings[key][i] for i in batch_idx] for key in encodings.keys()},
+                    return_tensors=tensors,
+                )
+                probs = run(batch)
+                count_model_call("emotion")
+                for i, row in zip(batch_idx, probs):
+                    self._cache[pending[i]] = row
+
+    def probabilities(self, texts: Iterable[str]) -> np.ndarray:
+        """returns an (n_texts, n_emotions) probability matrix in input order"""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        self.prime(texts)
+        return np.stack([self._cache[text] for text in texts])
+
+    def seed(self, probabilities) -> None:
+        """adds precomputed {text: probability vector} entries, e.g. from the feature store"""
+        self._cache.update(probabilities)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+def empathy_values(dialogue_pairs: List[Tuple[str, str]], engine: Optional[EmotionEngine] = None) -> np.ndarray:
+    """per-pair empathy from the emotion similarity of user and AI turns and the user's emotion confidence"""
+    valid_pairs = [(u, a) for u, a in dialogue_pairs if u.strip() and a.strip()]
+    if not valid_pairs:
+        return np.zeros(0)
 
-    avg_score = sum(empathy_scores) / len(empathy_scores)
+    engine = engine or EmotionEngine()
+    probs = engine.probabilities([u for u, _ in valid_pairs] + [a for _, a in valid_pairs])
+    user_probs, ai_probs = probs[:len(valid_pairs)], probs[len(valid_pairs):]
 
+    user_emotion_conf = user_probs.max(axis=1)
+    emotion_similarity = pair_similarities(user_probs, ai_probs)
+    return (0.5 * emotion_similarity) + (0.5 * user_emotion_conf)
+
+
+def _empathy_label(avg_score: float) -> str:
     label = "low"
     if avg_score >= 0.75:
         label = "high"
     elif avg_score >= 0.45:
         label = "medium"
+    return label
+
+
+def compute_empathy_score(dialogue_pairs: List[Tuple[str, str]], engine: Optional[EmotionEngine] = None) -> tuple[float, str]:
+
+    if not dialogue_pairs:
+        return 0.0, "low"
+
+    empathy_scores = empathy_values(dialogue_pairs, engine)
+    if not len(empathy_scores):
+        return 0.0, "low"
 
-    return round(avg_score, 3), label
+    avg_score = float(empathy_scores.mean())
+    return round(avg_score, 3), _empathy_label(avg_score)
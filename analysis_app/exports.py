@@ -0,0 +1,76 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import StreamingHttpResponse
+
+EXPORT_FIELDS = [
+    'id', 'conversation_id', 'conversation_title', 'clarity', 'relevance', 'accuracy', 'completeness',
+    'sentiment', 'empathy', 'fallback_count', 'resolution', 'escalation', 'response_time', 'overall_score', 'created_at'
+]
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """file-like object whose write() hands the line back to the csv writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+def _export_queryset(queryset):
+    return queryset.order_by("id").annotate(conversation_title=F("conversation__title"))
+
+
+def _rows(queryset):
+    # plain tuples in id order, read in chunks so memory stays constant however many rows match
+    return _export_queryset(queryset).values_list(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+async def _arows(queryset):
+    # values(), not values_list(): aiterator() over values_list runs its query inside the event loop
+    async for row in _export_queryset(queryset).values(*EXPORT_FIELDS).aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield tuple(row[field] for field in EXPORT_FIELDS)
+
+
+def iter_ndjson(queryset):
+    for row in _rows(queryset):
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def iter_csv(queryset):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in _rows(queryset):
+        yield writer.writerow(row)
+
+
+async def aiter_ndjson(queryset):
+    async for row in _arows(queryset):
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+async def aiter_csv(queryset):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    async for row in _arows(queryset):
+        yield writer.writerow(row)
+
+
+# ASGI only streams async iterators without buffering the whole body, async views use these
+ASYNC_EXPORT_ROWS = {"ndjson": aiter_ndjson, "csv": aiter_csv}
+
+EXPORT_FORMATS = {
+    "ndjson": (iter_ndjson, "application/x-ndjson", "analyses.ndjson"),
+    "csv": (iter_csv, "text/csv", "analyses.csv"),
+}
+
+
+def stream_analyses(queryset, export_format, asynchronous=False):
+    rows, content_type, filename = EXPORT_FORMATS[export_format]
+    if asynchronous:
+        rows = ASYNC_EXPORT_ROWS[export_format]
+    response = StreamingHttpResponse(rows(queryset), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
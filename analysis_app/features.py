@@ -0,0 +1,206 @@
+import hashlib
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+
+from .empathy_utils import EmotionEngine
+from .lexical_utils import LexicalFeatures
+from .models import MessageFeatures
+from .utils import encode_messages, pair_similarities, parse_texts
+
+# bump whenever a model or the definition of a stored feature changes, older rows are recomputed
+FEATURE_VERSION = "1"
+
+
+def feature_version():
+    """
+    the version stored rows are matched against: FEATURE_VERSION, the inference backend and for ONNX
+    whether the int8 models run, since each of them produces different embeddings and emotion vectors
+    """
+    backend = settings.INFERENCE_BACKEND
+    if backend == "onnx":
+        backend += "-int8" if settings.ONNX_QUANTIZED else "-fp32"
+    return f"{FEATURE_VERSION}-{backend}"
+
+
+# ids per IN (...) lookup, below SQLite's host parameter limit
+_LOOKUP_BATCH_SIZE = 900
+
+
+class MessageFeatureRow(NamedTuple):
+    embedding: np.ndarray
+    emotion: np.ndarray
+    vader: float
+    polarity: float
+    flesch: float
+    keyphrases: frozenset
+    sentence_count: int
+
+
+def _message_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _from_model(features):
+    return MessageFeatureRow(
+        embedding=np.frombuffer(features.embedding, dtype=np.float32),
+        emotion=np.frombuffer(features.emotion, dtype=np.float32),
+        vader=features.vader,
+        polarity=features.polarity,
+        flesch=np.nan if features.flesch is None else features.flesch,
+        keyphrases=frozenset(features.keyphrases),
+        sentence_count=features.sentence_count,
+    )
+
+
+def compute_features(texts, emotion_engine=None, n_process=1):
+    """
+    runs every model once over the unique texts and returns {text: MessageFeatureRow}
+    """
+    texts = list(dict.fromkeys(texts))
+    if not texts:
+        return {}
+    embeddings = encode_messages(texts).astype(np.float32)
+    emotions = (emotion_engine or EmotionEngine()).probabilities(texts).astype(np.float32)
+    lexical = LexicalFeatures(texts)
+    parsed = parse_texts(texts, n_process=n_process)
+    features = {}
+    for text, embedding, emotion in zip(texts, embeddings, emotions):
+        vader, polarity, flesch = lexical.scores(text)
+        keyphrases, sentence_count = parsed[text]
+        features[text] = MessageFeatureRow(
+            embedding, emotion, vader, polarity, flesch, frozenset(keyphrases), sentence_count
+        )
+    return features
+
+
+def load_message_features(messages):
+    """
+    returns ({message_id: MessageFeatureRow}, missing) for message dicts with "id" and "message" keys,
+    missing lists the non-empty messages without current stored features; nothing is computed
+    """
+    messages = [m for m in messages if m["message"].strip()]
+    ids = [m["id"] for m in messages]
+    stored = {}
+    for start in range(0, len(ids), _LOOKUP_BATCH_SIZE):
+        batch = MessageFeatures.objects.filter(message_id__in=ids[start:start + _LOOKUP_BATCH_SIZE], version=feature_version())
+        stored.update((features.message_id, features) for features in batch)
+
+    result = {}
+    missing = []
+    for message in messages:
+        features = stored.get(message["id"])
+        if features is not None and features.message_hash == _message_hash(message["message"]):
+            result[message["id"]] = _from_model(features)
+        else:
+            missing.append(message)
+    return result, missing
+
+
+def ensure_message_features(messages, emotion_engine=None, n_process=1):
+    """
+    Returns {message_id: MessageFeatureRow} for message dicts with "id" and "message" keys.
+    Stored features are reused; models only run, in one batch, for messages that have no
+    current features yet, and the results are written back to the store.
+    """
+    result, missing = load_message_features(messages)
+    if missing:
+        computed = compute_features([m["message"] for m in missing], emotion_engine, n_process)
+        rows = []
+        for message in missing:
+            row = computed[message["message"]]
+            result[message["id"]] = row
+            rows.append(MessageFeatures(
+                message_id=message["id"],
+                version=feature_version(),
+                message_hash=_message_hash(message["message"]),
+                embedding=row.embedding.tobytes(),
+                emotion=row.emotion.tobytes(),
+                vader=row.vader,
+                polarity=row.polarity,
+                flesch=None if np.isnan(row.flesch) else row.flesch,
+                keyphrases=sorted(row.keyphrases),
+                sentence_count=row.sentence_count,
+            ))
+        MessageFeatures.objects.bulk_create(
+            rows,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["message"],
+            update_fields=[
+                "version", "message_hash", "embedding", "emotion", "vader", "polarity", "flesch",
+                "keyphrases", "sentence_count", "updated_at",
+            ],
+        )
+    return result
+
+
+class ConversationFeatures:
+    """
+    The per-text inputs of the conversation metrics, built from stored message features. Texts
+    without stored features are computed on first use, only for the input that is asked for, and
+    are not written to the store.
+    """
+
+    def __init__(self, messages, features, emotion_engine=None):
+        self.by_text = {m["message"]: features[m["id"]] for m in messages if m["id"] in features}
+        self.missing = list(dict.fromkeys(
+            m["message"] for m in messages if m["message"].strip() and m["id"] not in features
+        ))
+        self._emotion_engine = emotion_engine
+        self._embeddings = None
+
+    def _embedding(self, text):
+        if text in self.by_text:
+            return self.by_text[text].embedding
+        if self._embeddings is None:
+            self._embeddings = dict(zip(self.missing, encode_messages(self.missing)))
+        return self._embeddings[text]
+
+    def similarities(self, pairs):
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        return pair_similarities(
+            np.stack([self._embedding(u) for u, _ in pairs]),
+            np.stack([self._embedding(a) for _, a in pairs]),
+        )
+
+    def lexical(self):
+        scores = {text: (row.vader, row.polarity, row.flesch) for text, row in self.by_text.items()}
+        if self.missing:
+            computed = LexicalFeatures(self.missing)
+            scores.update((text, computed.scores(text)) for text in self.missing)
+        return LexicalFeatures(scores=scores)
+
+    def parsed(self):
+        parsed = {text: (set(row.keyphrases), row.sentence_count) for text, row in self.by_text.items()}
+        if self.missing:
+            parsed.update(parse_texts(self.missing))
+        return parsed
+
+    def emotion_engine(self):
+        # missing texts are classified by the engine itself when the empathy metric asks for them
+        engine = EmotionEngine() if self._emotion_engine is None else self._emotion_engine
+        engine.seed({text: row.emotion for text, row in self.by_text.items()})
+        return engine
+
+
+def backfill_message_features(messages, batch_size=500, emotion_engine=None):
+    """
+    fills the store for a queryset of messages in batches, returns how many messages were processed
+    """
+    engine = emotion_engine or EmotionEngine()
+    processed = 0
+    batch = []
+    for message in messages.order_by("id").values("id", "message").iterator(chunk_size=batch_size):
+        batch.append(message)
+        if len(batch) >= batch_size:
+            ensure_message_features(batch, engine)
+            processed += len(batch)
+            engine.clear()
+            batch = []
+    if batch:
+        ensure_message_features(batch, engine)
+        processed += len(batch)
+    return processed
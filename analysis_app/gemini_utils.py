@@ -1,35 +1,248 @@
-import google.generativeai as genai
-import os
+import asyncio
+import hashlib
 import json
+import logging
+import random
 import re
+import threading
+import time
+from collections import deque
 
-api_key = os.getenv("GOOGLE_GEMINI_API_KEY")
-if api_key:
-    genai.configure(api_key=api_key)
+import requests
+from django.conf import settings
 
-model = genai.GenerativeModel("gemini-2.0-flash")
+from .instrumentation import count_model_call, record_failure
+from .model_registry import get_gemini_model
+
+logger = logging.getLogger(__name__)
+
+# responses worth retrying, anything else in the 4xx range is a bad request and fails immediately
+_RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class _RequestError(Exception):
+    """a failed request, its message only holds the HTTP status, never the URL or headers"""
+
+
+class _RetryableError(_RequestError):
+    pass
+
+
+def _describe(error):
+    # requests' exception texts include the request URL, only our own errors are safe to log as they are
+    return str(error) if isinstance(error, _RequestError) else type(error).__name__
+
+
+class TokenBucket:
+    """
+    token-bucket rate limiter shared by every event loop and thread of the process
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """takes a token and returns 0, or returns how long to wait for the next one"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class TranscriptWindow:
+    """
+    The turns of a conversation that are sent to Gemini: every pair up to limit pairs, otherwise the
+    first and the last limit // 2 pairs. Filled in one pass, so long conversations never have to be
+    held in memory. The default limit of 0 keeps every pair, the streaming analysis passes
+    settings.GEMINI_MAX_TRANSCRIPT_PAIRS.
+    """
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.head = []
+        self.tail = deque(maxlen=self.limit // 2) if self.limit else None
+        self.omitted = 0
+
+    @classmethod
+    def of(cls, pairs, limit=0):
+        window = cls(limit)
+        for pair in pairs:
+            window.add(pair)
+        return window
+
+    def add(self, pair):
+        if not self.limit or len(self.head) < self.limit - self.limit // 2:
+            self.head.append(pair)
+            return
+        if len(self.tail) == self.tail.maxlen:
+            self.omitted += 1
+        self.tail.append(pair)
+
+    def __iter__(self):
+        yield from self.head
+        if self.tail:
+            yield from self.tail
+
+    def __len__(self):
+        return len(self.head) + len(self.tail or ())
+
+
+def _build_prompt(window):
+    turns = [f"User: {u}\nAI: {a}" for u, a in window.head]
+    if window.omitted:
+        turns.append(f"[{window.omitted} turns omitted]")
+    turns += [f"User: {u}\nAI: {a}" for u, a in window.tail or ()]
+    conversation = "\n\n".join(turns)
+    return f"""Rate AI accuracy (0-1) in this conversation:\n\n{conversation}\n\nRespond as JSON: {{"score": 0.8, "label": "accurate"}}"""
+
+
+def _parse_accuracy(text):
+    json_match = re.search(r'\{.*?\}', text or "", re.DOTALL)
+    if not json_match:
+        return 0.0, "inaccurate"
+    try:
+        data = json.loads(json_match.group())
+        score = max(0.0, min(1.0, float(data.get("score", 0))))
+        label = str(data.get("label", "inaccurate")).lower()
+    except (ValueError, TypeError, AttributeError):
+        return 0.0, "inaccurate"
+    return round(score, 3), label
+
+
+class GeminiAccuracyClient:
+    """
+    Accuracy scoring against the Gemini generateContent REST endpoint. Requests run concurrently
+    up to max_concurrency, are rate limited by a token bucket, time out and are retried with
+    exponential backoff. Parsed results are cached in the database by a hash of model and prompt,
+    so a conversation that is re-analysed never pays for the same call twice.
+    """
+
+    def __init__(self, api_key=None, model_name="gemini-2.0-flash", api_base="https://generativelanguage.googleapis.com",
+                 max_concurrency=4, rate_per_second=2.0, burst=4, timeout=30.0, max_retries=3, backoff=1.0):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.api_base = api_base.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self._session = requests.Session()
+
+    @classmethod
+    def from_settings(cls, processes=1):
+        """
+        processes: how many processes share the configured limits, each client gets its share of the
+        rate, burst and concurrency
+        """
+        return cls(
+            api_key=settings.GEMINI_API_KEY,
+            model_name=settings.GEMINI_MODEL,
+            api_base=settings.GEMINI_API_BASE,
+            max_concurrency=max(1, settings.GEMINI_MAX_CONCURRENCY // processes),
+            rate_per_second=settings.GEMINI_RATE_PER_SECOND / processes,
+            burst=max(1, settings.GEMINI_BURST // processes),
+            timeout=settings.GEMINI_TIMEOUT,
+            max_retries=settings.GEMINI_MAX_RETRIES,
+        )
+
+    def prompt_hash(self, prompt):
+        return hashlib.sha256(f"{self.model_name}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _post(self, prompt):
+        count_model_call("gemini")
+        response = self._session.post(
+            f"{self.api_base}/v1beta/models/{self.model_name}:generateContent",
+            # in a header rather than ?key=, which would end up in exception texts and logs
+            headers={"x-goog-api-key": self.api_key} if self.api_key else None,
+            json={"contents": [{"parts": [{"text": prompt}]}]},
+            timeout=self.timeout,
+        )
+        if response.status_code in _RETRY_STATUS_CODES:
+            raise _RetryableError(f"HTTP {response.status_code}")
+        if not response.ok:
+            raise _RequestError(f"HTTP {response.status_code}")
+        data = response.json()
+        return data["candidates"][0]["content"]["parts"][0]["text"]
+
+    async def _generate(self, prompt):
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                return await asyncio.to_thread(self._post, prompt)
+            except (_RetryableError, requests.Timeout, requests.ConnectionError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                logger.warning("Gemini request failed (%s), retry %d in %.1fs", _describe(e), attempt + 1, delay)
+                await asyncio.sleep(delay)
+
+    async def _generate_guarded(self, prompt, semaphore):
+        async with semaphore:
+            try:
+                return await self._generate(prompt)
+            except Exception as e:
+                logger.error("Gemini accuracy request failed: %s", _describe(e))
+                return None
+
+    async def agenerate_many(self, prompts):
+        """runs the prompts concurrently, returns the response texts in input order with None for failures"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(*(self._generate_guarded(prompt, semaphore) for prompt in prompts))
+
+    def score_many(self, pairs_lists):
+        """
+        scores many conversations, each a list of (user, ai) pairs (sent whole) or a TranscriptWindow, concurrently
+        and returns [(score, label)] in input order, only prompts missing from the cache are sent to the API
+        """
+        from .models import GeminiResponse
+
+        windows = [pairs if isinstance(pairs, TranscriptWindow) else TranscriptWindow.of(pairs) for pairs in pairs_lists]
+        prompts = [_build_prompt(window) if len(window) else None for window in windows]
+        keys = [self.prompt_hash(prompt) if prompt else None for prompt in prompts]
+        results = {
+            key: (score, label)
+            for key, score, label in GeminiResponse.objects.filter(prompt_hash__in={k for k in keys if k})
+            .values_list("prompt_hash", "score", "label")
+        }
+
+        missing = {key: prompt for key, prompt in zip(keys, prompts) if key and key not in results}
+        if missing:
+            texts = asyncio.run(self.agenerate_many(list(missing.values())))
+            for key, text in zip(missing, texts):
+                # failures are not cached, the next analysis will try again
+                if text is None:
+                    record_failure("gemini")
+                    continue
+                results[key] = _parse_accuracy(text)
+                GeminiResponse.objects.update_or_create(
+                    prompt_hash=key,
+                    defaults={"model_name": self.model_name, "score": results[key][0], "label": results[key][1]},
+                )
+
+        return [results.get(key, (0.0, "inaccurate")) for key in keys]
+
+    def score(self, pairs):
+        return self.score_many([pairs])[0]
 
 
 def compute_accuracy_score(pairs):
     pairs_list = list(pairs) if not isinstance(pairs, list) else pairs
     if not pairs_list:
         return 0.0, "inaccurate"
-    
-    conversation = "\n\n".join([f"User: {u}\nAI: {a}" for u, a in pairs_list])
-    prompt = f"""Rate AI accuracy (0-1) in this conversation:\n\n{conversation}\n\nRespond as JSON: {{"score": 0.8, "label": "accurate"}}"""
-    
-    try:
-        response = model.generate_content(prompt)
-        json_match = re.search(r'\{.*?\}', response.text, re.DOTALL)
-        
-        if json_match:
-            data = json.loads(json_match.group())
-            score = max(0.0, min(1.0, float(data.get("score", 0))))
-            label = data.get("label", "inaccurate").lower()
-            return round(score, 3), label
-        
-        return 0.0, "inaccurate"
-    
-    except Exception as e:
-        print(f"Gemini error: {e}")
-        return 0.0, "inaccurate"
\ No newline at end of file
+    return get_gemini_model().score(pairs_list)
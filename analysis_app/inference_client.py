@@ -0,0 +1,133 @@
+# Client side of the local inference daemon (manage.py inference_server). When
+# settings.INFERENCE_SOCKET is set, encode_messages, EmotionEngine and parse_texts send their texts to
+# the daemon instead of loading the models into this process.
+import json
+import socket
+import struct
+import threading
+
+import numpy as np
+from django.conf import settings
+
+_HEADER = struct.Struct(">I")
+_client = None
+_client_lock = threading.Lock()
+_disabled = False
+
+
+class InferenceError(Exception):
+    pass
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("inference socket closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_message(sock, header, payload=b""):
+    """one frame: 4-byte length, JSON header (with the payload size), raw payload"""
+    data = json.dumps({**header, "nbytes": len(payload)}).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data + payload)
+
+
+def recv_message(sock):
+    """returns (header, payload), None when the peer closed the connection between frames"""
+    first = sock.recv(_HEADER.size)
+    if not first:
+        return None
+    if len(first) < _HEADER.size:
+        first += _recv_exact(sock, _HEADER.size - len(first))
+    header = json.loads(_recv_exact(sock, _HEADER.unpack(first)[0]))
+    return header, _recv_exact(sock, header["nbytes"]) if header["nbytes"] else b""
+
+
+def array_message(array):
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"shape": list(array.shape)}, array.tobytes()
+
+
+class InferenceClient:
+    """
+    Talks to the inference daemon over its Unix socket, one connection per thread. Requests from all
+    clients are merged into batches on the daemon side.
+    """
+
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def request(self, op, texts=()):
+        try:
+            sock = self._connection()
+            send_message(sock, {"op": op, "texts": list(texts)})
+            reply = recv_message(sock)
+            if reply is None:
+                raise ConnectionError("inference daemon closed the connection")
+        except OSError:
+            # a broken connection is not reused, the next request reconnects
+            self.close()
+            raise
+        header, payload = reply
+        if "error" in header:
+            raise InferenceError(header["error"])
+        return header, payload
+
+    def _array(self, op, texts):
+        header, payload = self.request(op, texts)
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+
+    def embed(self, texts):
+        return self._array("embed", texts)
+
+    def emotion(self, texts):
+        return self._array("emotion", texts)
+
+    def parse(self, texts):
+        """{text: (keyphrases, sentence_count)} like parse_texts"""
+        texts = list(dict.fromkeys(texts))
+        header, _ = self.request("parse", texts)
+        return {text: (set(keyphrases), count) for text, (keyphrases, count) in zip(texts, header["parsed"])}
+
+    def stats(self):
+        return self.request("stats")[0]
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+
+def get_inference_client():
+    """the process-wide client when INFERENCE_SOCKET is configured, otherwise None (models run in-process)"""
+    global _client
+    path = getattr(settings, "INFERENCE_SOCKET", "")
+    if _disabled or not path:
+        return None
+    if _client is None or _client.path != path:
+        with _client_lock:
+            if _client is None or _client.path != path:
+                _client = InferenceClient(path, getattr(settings, "INFERENCE_TIMEOUT", 60.0))
+    return _client
+
+
+def disable():
+    """used by the daemon itself, which must run the models rather than call itself"""
+    global _disabled
+    _disabled = True
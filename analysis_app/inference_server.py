@@ -0,0 +1,159 @@
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+
+from . import inference_client
+from .inference_client import array_message, recv_message, send_message
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    def __init__(self, texts):
+        self.texts = texts
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class Batcher(threading.Thread):
+    """
+    Runs fn(texts) for the requests of many connections at once. The first waiting request opens a
+    batch, requests arriving within max_wait seconds join it until it holds max_texts texts, then
+    fn runs once over all of them and every request gets its slice of the result.
+    """
+
+    def __init__(self, fn, max_texts=256, max_wait=0.005):
+        super().__init__(daemon=True)
+        self.fn = fn
+        self.max_texts = max_texts
+        self.max_wait = max_wait
+        self.requests = 0
+        self.batches = 0
+        self._queue = queue.Queue()
+
+    def submit(self, texts):
+        pending = _Pending(list(texts))
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_texts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending.texts)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.fn([text for pending in batch for text in pending.texts])
+                offset = 0
+                for pending in batch:
+                    pending.result = results[offset:offset + len(pending.texts)]
+                    offset += len(pending.texts)
+            except Exception as e:
+                logger.exception("Inference batch of %d requests failed", len(batch))
+                for pending in batch:
+                    pending.error = e
+            finally:
+                self.requests += len(batch)
+                self.batches += 1
+                for pending in batch:
+                    pending.done.set()
+
+
+def _embed(texts):
+    from .utils import encode_messages
+    return encode_messages(texts)
+
+
+def _emotion(texts):
+    from .empathy_utils import EmotionEngine
+    return EmotionEngine().probabilities(texts)
+
+
+def _parse(texts):
+    from .utils import parse_texts
+    parsed = parse_texts(texts, n_process=1)
+    return [(sorted(parsed[text][0]), parsed[text][1]) for text in texts]
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        batchers = self.server.batchers
+        while True:
+            message = recv_message(self.request)
+            if message is None:
+                return
+            op = message[0].get("op")
+            texts = message[0].get("texts", [])
+            try:
+                if op == "stats":
+                    send_message(self.request, {
+                        name: {"requests": b.requests, "batches": b.batches} for name, b in batchers.items()
+                    })
+                elif op == "parse":
+                    send_message(self.request, {"parsed": batchers["parse"].submit(texts)})
+                elif op in batchers:
+                    send_message(self.request, *array_message(batchers[op].submit(texts)))
+                else:
+                    send_message(self.request, {"error": f"unknown op {op!r}"})
+            except Exception as e:
+                send_message(self.request, {"error": str(e)})
+
+
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Serves embedding, emotion and spaCy requests from one copy of the models over a Unix socket,
+    one thread per connection and one Batcher per model.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, ops=None, max_texts=256, max_wait=0.005):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o660)
+        self.path = path
+        ops = ops or {"embed": _embed, "emotion": _emotion, "parse": _parse}
+        self.batchers = {name: Batcher(fn, max_texts, max_wait) for name, fn in ops.items()}
+        for batcher in self.batchers.values():
+            batcher.start()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(path, max_texts=256, max_wait=0.005, warmup=True):
+    # this process runs the models itself, the metric functions must not call back into the socket
+    inference_client.disable()
+    if warmup:
+        from .model_registry import registry
+        for name in ("sentence", "emotion", "spacy"):
+            registry.get(name)
+    server = InferenceServer(path, max_texts=max_texts, max_wait=max_wait)
+    logger.info("Inference daemon listening on %s", path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
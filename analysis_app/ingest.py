@@ -0,0 +1,115 @@
+import json
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Conversation, Message
+from .serializers import ConversationUploadSerializer
+
+# conversations written per transaction and messages per INSERT statement
+DEFAULT_BATCH_SIZE = 500
+MESSAGE_INSERT_BATCH_SIZE = 1000
+
+
+def _flush(pending):
+    """
+    writes [(line_no, validated_data)] in one transaction and returns their report entries
+    """
+    with transaction.atomic():
+        conversations = Conversation.objects.bulk_create([
+            Conversation(title=data.get('title', '').strip()) for _, data in pending
+        ])
+        messages = [
+            message
+            for conversation, (_, data) in zip(conversations, pending)
+            for message in ConversationUploadSerializer.build_messages(conversation, data.get('messages', []))
+        ]
+        Message.objects.bulk_create(messages, batch_size=MESSAGE_INSERT_BATCH_SIZE)
+        # counters from the saved messages, whose timestamps bulk_create has just set
+        by_conversation = {}
+        for message in messages:
+            by_conversation.setdefault(message.conversation_id, []).append(message)
+        for conversation in conversations:
+            conversation.count_messages(by_conversation.get(conversation.id, []))
+        Conversation.objects.bulk_update(conversations, Conversation.COUNTER_FIELDS)
+    return [
+        {"line": line_no, "status": "ok", "conversation_id": conversation.id, "message_count": len(data.get('messages', []))}
+        for conversation, (line_no, data) in zip(conversations, pending)
+    ]
+
+
+def refresh_conversation_counters(conversations=None):
+    """
+    recomputes the message counters of a queryset of conversations (default: all) in one UPDATE, for
+    messages written outside the ingest paths, and clears their content hash, which the next nightly run
+    computes again
+    """
+    def count(**filters):
+        messages = Message.objects.filter(conversation=OuterRef("pk"), **filters).order_by()
+        return Coalesce(Subquery(messages.values("conversation").annotate(n=Count("id")).values("n")), 0)
+
+    conversations = Conversation.objects.all() if conversations is None else conversations
+    return conversations.update(
+        message_count=count(),
+        user_message_count=count(sender="user"),
+        ai_message_count=count(sender="ai"),
+        last_message_at=Subquery(
+            Message.objects.filter(conversation=OuterRef("pk")).order_by("-timestamp").values("timestamp")[:1]
+        ),
+        content_hash="",
+    )
+
+
+def _parse_line(line):
+    """(record, None), (None, errors) for a line that is not UTF-8 JSON, or (None, None) for a blank line"""
+    if isinstance(line, bytes):
+        try:
+            line = line.decode("utf-8")
+        except UnicodeDecodeError as e:
+            return None, {"encoding": [str(e)]}
+    if not line.strip():
+        return None, None
+    try:
+        return json.loads(line), None
+    except json.JSONDecodeError as e:
+        return None, {"json": [str(e)]}
+
+
+def ingest_jsonl(lines, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Streams JSONL conversations (one {"title", "messages"} object per line) into the database.
+    Each record is validated with the ConversationUploadSerializer rules, valid records are written
+    batch_size conversations per transaction. Yields one report entry per non-blank line, in order.
+    """
+    pending = []
+    buffered_errors = []
+    for line_no, line in enumerate(lines, start=1):
+        record, errors = _parse_line(line)
+        if errors:
+            entry = {"line": line_no, "status": "error", "errors": errors}
+        elif record is None:
+            continue
+        else:
+            serializer = ConversationUploadSerializer(data=record)
+            if serializer.is_valid():
+                pending.append((line_no, serializer.validated_data))
+                entry = None
+            else:
+                entry = {"line": line_no, "status": "error", "errors": serializer.errors}
+
+        if entry is not None:
+            # keep the report in line order, errors wait for the batch they fall into
+            if pending:
+                buffered_errors.append(entry)
+            else:
+                yield entry
+
+        if len(pending) >= batch_size:
+            yield from sorted(_flush(pending) + buffered_errors, key=lambda e: e["line"])
+            pending, buffered_errors = [], []
+
+    if pending:
+        yield from sorted(_flush(pending) + buffered_errors, key=lambda e: e["line"])
+    else:
+        yield from buffered_errors
@@ -0,0 +1,248 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .model_registry import _rss_bytes
+
+logger = logging.getLogger(__name__)
+
+# the trace of the analysis running in the current thread or task, model call sites report to it
+_current_trace = contextvars.ContextVar("analysis_trace", default=None)
+# the stage record model calls are attributed to, per thread or task so that concurrent stages stay apart
+_current_stage = contextvars.ContextVar("analysis_stage", default=None)
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120)
+
+
+def reset_peak_rss():
+    """
+    resets the kernel's peak RSS counter (Linux only), returns whether it worked. The counter belongs to
+    the whole process, so only single-threaded callers like bench_analysis may reset it; traces sample instead
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """peak resident memory in bytes since the last reset_peak_rss, or since process start where it cannot be reset"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return None
+
+
+class _Metrics:
+    """process-wide aggregates of every finished trace, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.analyses = 0
+            self.slow = 0
+            self.duration_sum = 0.0
+            self.duration_buckets = [0] * len(DURATION_BUCKETS)
+            self.stage_seconds = {}
+            self.stage_cpu_seconds = {}
+            self.stage_count = {}
+            self.model_calls = {}
+            self.peak_rss_bytes = None
+
+    def observe(self, trace):
+        with self._lock:
+            self.analyses += 1
+            self.slow += int(trace.is_slow)
+            self.duration_sum += trace.wall_seconds
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if trace.wall_seconds <= bound:
+                    self.duration_buckets[i] += 1
+            for name, stage in trace.stages.items():
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + stage["wall_seconds"]
+                self.stage_cpu_seconds[name] = self.stage_cpu_seconds.get(name, 0.0) + stage["cpu_seconds"]
+                self.stage_count[name] = self.stage_count.get(name, 0) + 1
+                for model, calls in stage["model_calls"].items():
+                    self.model_calls[model] = self.model_calls.get(model, 0) + calls
+            if trace.peak_rss_bytes is not None:
+                self.peak_rss_bytes = trace.peak_rss_bytes
+
+    def render(self):
+        with self._lock:
+            lines = [
+                "# HELP analysis_total Conversation analyses run by this process.",
+                "# TYPE analysis_total counter",
+                f"analysis_total {self.analyses}",
+                "# HELP analysis_slow_total Analyses slower than ANALYSIS_SLOW_THRESHOLD_SECONDS.",
+                "# TYPE analysis_slow_total counter",
+                f"analysis_slow_total {self.slow}",
+                "# HELP analysis_duration_seconds Wall time of a whole analysis.",
+                "# TYPE analysis_duration_seconds histogram",
+            ]
+            for bound, count in zip(DURATION_BUCKETS, self.duration_buckets):
+                lines.append(f'analysis_duration_seconds_bucket{{le="{bound}"}} {count}')
+            lines += [
+                f'analysis_duration_seconds_bucket{{le="+Inf"}} {self.analyses}',
+                f"analysis_duration_seconds_sum {self.duration_sum:.6f}",
+                f"analysis_duration_seconds_count {self.analyses}",
+                "# HELP analysis_stage_seconds Wall time per metric stage.",
+                "# TYPE analysis_stage_seconds summary",
+            ]
+            for name in sorted(self.stage_seconds):
+                lines.append(f'analysis_stage_seconds_sum{{stage="{name}"}} {self.stage_seconds[name]:.6f}')
+                lines.append(f'analysis_stage_seconds_count{{stage="{name}"}} {self.stage_count[name]}')
+            lines += [
+                "# HELP analysis_stage_cpu_seconds_total CPU time of the thread running each metric stage.",
+                "# TYPE analysis_stage_cpu_seconds_total counter",
+            ]
+            for name in sorted(self.stage_cpu_seconds):
+                lines.append(f'analysis_stage_cpu_seconds_total{{stage="{name}"}} {self.stage_cpu_seconds[name]:.6f}')
+            lines += [
+                "# HELP analysis_model_calls_total Model invocations (batches, pipes, API requests).",
+                "# TYPE analysis_model_calls_total counter",
+            ]
+            for model in sorted(self.model_calls):
+                lines.append(f'analysis_model_calls_total{{model="{model}"}} {self.model_calls[model]}')
+            if self.peak_rss_bytes is not None:
+                lines += [
+                    "# HELP analysis_peak_rss_bytes Highest process resident memory sampled during the last analysis.",
+                    "# TYPE analysis_peak_rss_bytes gauge",
+                    f"analysis_peak_rss_bytes {self.peak_rss_bytes}",
+                ]
+            return "\n".join(lines) + "\n"
+
+
+metrics = _Metrics()
+
+
+class AnalysisTrace:
+    """
+    Wall time, CPU time and model calls per metric stage of one analysis, plus the highest process RSS
+    sampled when it starts and ends and around every stage. RSS is process-wide, so analyses running at
+    the same time in other threads add to it, but no trace resets a counter another one reads.
+    Used as a context manager around the analysis; on exit the trace is added to the process
+    metrics and logged as one JSON line when it took longer than ANALYSIS_SLOW_THRESHOLD_SECONDS.
+    A stage's CPU time is that of the thread it ran in, so stages running at the same time do not
+    count each other's work (nor that of torch's intra-op threads); the trace's total is the CPU time
+    of the whole process while the analysis ran.
+    """
+
+    def __init__(self, conversation_id=None):
+        self.conversation_id = conversation_id
+        self.stages = {}
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_bytes = None
+        self.is_slow = False
+        # models or services that failed and were replaced by a fallback value during the analysis
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._token = _current_trace.set(self)
+        self._sample_rss()
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall_seconds = time.perf_counter() - self._started
+        self.cpu_seconds = time.process_time() - self._cpu_started
+        self._sample_rss()
+        _current_trace.reset(self._token)
+        if exc_type is None:
+            self.is_slow = self.wall_seconds >= getattr(settings, "ANALYSIS_SLOW_THRESHOLD_SECONDS", 5.0)
+            metrics.observe(self)
+            if self.is_slow:
+                logger.warning(json.dumps({"event": "slow_analysis", **self.as_dict()}))
+        return False
+
+    def call(self, stage, fn, *args, **kwargs):
+        """runs fn as the named stage, stages may run concurrently in other threads"""
+        with self._lock:
+            record = self.stages.setdefault(stage, {"wall_seconds": 0.0, "cpu_seconds": 0.0, "model_calls": {}})
+        token = _current_stage.set(record)
+        self._sample_rss()
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                record["wall_seconds"] += time.perf_counter() - started
+                record["cpu_seconds"] += time.thread_time() - cpu_started
+            self._sample_rss()
+            _current_stage.reset(token)
+
+    def _sample_rss(self):
+        rss = _rss_bytes()
+        if rss is not None:
+            with self._lock:
+                self.peak_rss_bytes = max(self.peak_rss_bytes or 0, rss)
+
+    def count_model_call(self, model, calls=1):
+        record = _current_stage.get()
+        if record is not None:
+            with self._lock:
+                record["model_calls"][model] = record["model_calls"].get(model, 0) + calls
+
+    def record_failure(self, source):
+        with self._lock:
+            self.failures.append(source)
+
+    def as_dict(self):
+        return {
+            "conversation_id": self.conversation_id,
+            "failures": list(self.failures),
+            "wall_ms": round(self.wall_seconds * 1000, 1),
+            "cpu_ms": round(self.cpu_seconds * 1000, 1),
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "stages": {
+                name: {
+                    "wall_ms": round(stage["wall_seconds"] * 1000, 1),
+                    "cpu_ms": round(stage["cpu_seconds"] * 1000, 1),
+                    "model_calls": stage["model_calls"],
+                }
+                for name, stage in self.stages.items()
+            },
+        }
+
+    def server_timing(self):
+        """value of a Server-Timing header, one entry per stage plus the total"""
+        entries = []
+        for name, stage in self.stages.items():
+            calls = sum(stage["model_calls"].values())
+            entries.append(
+                f'{name};dur={stage["wall_seconds"] * 1000:.1f};desc="cpu {stage["cpu_seconds"] * 1000:.1f}ms, {calls} model calls"'
+            )
+        entries.append(f'total;dur={self.wall_seconds * 1000:.1f};desc="cpu {self.cpu_seconds * 1000:.1f}ms"')
+        return ", ".join(entries)
+
+
+def count_model_call(model, calls=1):
+    """called wherever a model runs, attributes the call to the current analysis stage if there is one"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count_model_call(model, calls)
+
+
+def record_failure(source):
+    """called where a failed model or API call is replaced by a fallback value, marks the current analysis as degraded"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record_failure(source)
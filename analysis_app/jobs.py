@@ -0,0 +1,112 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AnalysisJob, ConversationAnalysis
+from .rollups import store_analysis
+from .utils import get_conversation_analysis
+
+logger = logging.getLogger(__name__)
+
+
+def analyse_and_store(conversation, progress=None, trace=None):
+    """
+    runs the full analysis and stores it, returns (analytics_data, api_response) like get_conversation_analysis
+    """
+    analytics_data, api_response = get_conversation_analysis(conversation, progress=progress, trace=trace)
+    if analytics_data is not None and not _is_stored(conversation.id, analytics_data):
+        store_analysis(conversation.id, analytics_data, title=conversation.title)
+    return analytics_data, api_response
+
+
+def _is_stored(conversation_id, analytics_data):
+    # an unchanged conversation keeps its analysis row (and created_at, and its rollup day) as it is
+    return ConversationAnalysis.objects.filter(
+        conversation_id=conversation_id, content_hash=analytics_data["content_hash"],
+        analysis_version=analytics_data["analysis_version"],
+    ).exists()
+
+
+def enqueue_analysis(conversation):
+    return AnalysisJob.objects.create(conversation=conversation)
+
+
+def requeue_stale_jobs(timeout=None, max_attempts=None):
+    """
+    puts running jobs whose worker sent no heartbeat for timeout seconds (default: ANALYSIS_JOB_TIMEOUT_SECONDS),
+    e.g. because it crashed, back in the queue, and fails those already claimed max_attempts times
+    (default: ANALYSIS_JOB_MAX_ATTEMPTS), returns the number of requeued jobs
+    """
+    timeout = getattr(settings, "ANALYSIS_JOB_TIMEOUT_SECONDS", 900) if timeout is None else timeout
+    max_attempts = max_attempts or getattr(settings, "ANALYSIS_JOB_MAX_ATTEMPTS", 3)
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=timeout)
+    stale = AnalysisJob.objects.filter(status=AnalysisJob.RUNNING).filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=AnalysisJob.FAILED, error="The analysis worker stopped responding", finished_at=now
+    )
+    if failed:
+        logger.warning("Failed %s analysis jobs whose workers stopped responding", failed)
+    return stale.filter(attempts__lt=max_attempts).update(status=AnalysisJob.QUEUED, stage="", progress=0)
+
+
+def claim_next_job():
+    """
+    atomically moves the oldest queued job to running, safe with several workers polling the same table,
+    stale running jobs are requeued first
+    """
+    requeue_stale_jobs()
+    while True:
+        job_id = AnalysisJob.objects.filter(status=AnalysisJob.QUEUED).order_by("id").values_list("id", flat=True).first()
+        if job_id is None:
+            return None
+        now = timezone.now()
+        claimed = AnalysisJob.objects.filter(id=job_id, status=AnalysisJob.QUEUED).update(
+            status=AnalysisJob.RUNNING, started_at=now, heartbeat_at=now, attempts=F("attempts") + 1
+        )
+        if claimed:
+            return AnalysisJob.objects.select_related("conversation").get(id=job_id)
+
+
+def run_job(job):
+    def progress(stage, fraction):
+        AnalysisJob.objects.filter(id=job.id).update(stage=stage, progress=fraction, heartbeat_at=timezone.now())
+
+    try:
+        analytics_data, api_response = analyse_and_store(job.conversation, progress=progress)
+    except Exception as e:
+        logger.exception("Analysis job %s failed", job.id)
+        job.status, job.error = AnalysisJob.FAILED, str(e)
+    else:
+        if analytics_data is None:
+            job.status, job.error = AnalysisJob.FAILED, api_response.get("error", "")
+        else:
+            job.status, job.progress, job.stage = AnalysisJob.DONE, 1.0, "done"
+        job.result = api_response
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "stage", "progress", "result", "error", "finished_at"])
+    return job
+
+
+def work(poll_interval=1.0, once=False):
+    """
+    processes queued jobs until interrupted, or until the queue is empty when once is set
+    """
+    processed = 0
+    while True:
+        close_old_connections()
+        job = claim_next_job()
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
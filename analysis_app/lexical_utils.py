@@ -0,0 +1,58 @@
+from typing import Iterable
+import numpy as np
+from .model_registry import get_vader
+
+
+class LexicalFeatures:
+    """
+    VADER compound, TextBlob polarity and Flesch reading ease for a set of messages, computed in
+    one pass with a single shared VADER analyzer. Every lexical metric reads its columns from here
+    instead of re-scoring the same message.
+    """
+
+    COLUMNS = ("vader", "polarity", "flesch")
+
+    def __init__(self, texts: Iterable[str] = (), scores=None):
+        """scores, when given, is a precomputed {text: (vader, polarity, flesch)} mapping and texts is ignored"""
+        if scores is None:
+            scores = self._score(texts)
+        self._index = {text: i for i, text in enumerate(scores)}
+        self._values = np.array(list(scores.values()), dtype=np.float64).reshape(-1, len(self.COLUMNS))
+
+    @staticmethod
+    def _score(texts):
+        from textblob import TextBlob
+        import textstat
+
+        analyzer = get_vader()
+        scores = {}
+        for text in dict.fromkeys(texts):
+            if not text or not text.strip():
+                scores[text] = (0.0, 0.0, np.nan)
+                continue
+            scores[text] = (
+                analyzer.polarity_scores(text)['compound'],
+                TextBlob(text).sentiment.polarity,
+                textstat.flesch_reading_ease(text),
+            )
+        return scores
+
+    def scores(self, text):
+        """(vader, polarity, flesch) of one text"""
+        return tuple(float(v) for v in self._values[self._index[text]])
+
+    def __contains__(self, text):
+        return text in self._index
+
+    def column(self, name: str, texts: Iterable[str]) -> np.ndarray:
+        """returns the named column for texts, in order"""
+        rows = [self._index[text] for text in texts]
+        return self._values[rows, self.COLUMNS.index(name)]
+
+
+def lexical_features_for(texts, lexical=None):
+    """reuses lexical when it already covers every text, otherwise scores the texts in one pass"""
+    texts = list(texts)
+    if lexical is not None and all(text in lexical for text in texts):
+        return lexical
+    return LexicalFeatures(texts)
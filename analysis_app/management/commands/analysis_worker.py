@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+
+from django.core.management.base import BaseCommand
+
+from analysis_app import workers
+from analysis_app.jobs import work
+
+
+class Command(BaseCommand):
+    help = "Processes queued analysis jobs created by POST /api/analysis/<id>/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1, help="Worker processes polling the job queue")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--torch-threads", type=int, default=None, help="Torch intra-op threads per process")
+        parser.add_argument("--once", action="store_true", help="Drain the queue in this process and exit")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            processed = work(poll_interval=options["poll_interval"], once=True)
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs"))
+            return
+
+        processes = max(1, options["processes"])
+        torch_threads = options["torch_threads"] or max(1, (os.cpu_count() or 1) // processes)
+        context = multiprocessing.get_context("spawn")
+        children = [
+            context.Process(target=workers.job_worker, args=(torch_threads, options["poll_interval"], processes), daemon=True)
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        self.stdout.write(f"Started {processes} analysis workers")
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
@@ -0,0 +1,264 @@
+import json
+import os
+import platform
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from analysis_app.cron import run_daily_analysis
+from analysis_app.ingest import ingest_jsonl
+from analysis_app.instrumentation import AnalysisTrace, metrics, peak_rss_bytes, reset_peak_rss
+from analysis_app.management.commands.bench_lexical import synthetic_pairs
+from analysis_app.empathy_utils import EmotionEngine
+from analysis_app.model_registry import _load_emotion_model, _load_sentence_model, _rss_bytes, registry
+from analysis_app.models import Conversation, Message, MessageFeatures
+from analysis_app.utils import encode_messages, get_conversation_analysis
+
+# models loaded before the timed phases, Gemini is replaced by StubGeminiClient
+_LOCAL_MODELS = ("sentence", "spacy", "emotion", "vader")
+
+
+class StubGeminiClient:
+    """offline stand-in for GeminiAccuracyClient, scores without network calls or cache rows"""
+
+    model_name = "stub"
+
+    def score_many(self, pairs_lists):
+        return [(0.8, "accurate") if list(pairs) else (0.0, "inaccurate") for pairs in pairs_lists]
+
+    def score(self, pairs):
+        return self.score_many([pairs])[0]
+
+
+def synthetic_conversations(count, turns, min_words, max_words, seed=0):
+    """JSONL lines in the ingest format, user/ai turns a few seconds apart with varying message lengths"""
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        pairs = synthetic_pairs(turns, rng.randint(min_words, max_words), seed=seed + i)
+        messages = []
+        for turn, (user_text, ai_text) in enumerate(pairs):
+            at = started + timedelta(minutes=i, seconds=turn * 10)
+            messages.append({"sender": "user", "message": user_text, "timestamp": at.isoformat()})
+            messages.append({
+                "sender": "ai", "message": ai_text,
+                "timestamp": (at + timedelta(seconds=rng.uniform(0.5, 6))).isoformat(),
+            })
+        yield json.dumps({"title": f"bench {i % 10}", "messages": messages})
+
+
+class _RssSampler(threading.Thread):
+    """samples the process RSS while a phase runs, catches peaks between the traces' stage samples"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self._finished = threading.Event()
+
+    def run(self):
+        while not self._finished.is_set():
+            self.peak = max(self.peak, _rss_bytes() or 0)
+            self._finished.wait(self.interval)
+
+    def stop(self):
+        self._finished.set()
+        self.join()
+        return self.peak
+
+
+def _latency_ms(seconds):
+    if not seconds:
+        return None
+    values = np.asarray(seconds) * 1000
+    return {
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+def _stage_report():
+    return {
+        name: {
+            "mean_ms": round(metrics.stage_seconds[name] / metrics.stage_count[name] * 1000, 3),
+            "cpu_mean_ms": round(metrics.stage_cpu_seconds[name] / metrics.stage_count[name] * 1000, 3),
+            "total_seconds": round(metrics.stage_seconds[name], 4),
+        }
+        for name in sorted(metrics.stage_seconds)
+    }
+
+
+def _run_phase(fn, conversations):
+    """runs fn() with fresh process metrics and returns its timings, per-stage means, model calls and peak RSS"""
+    metrics.reset()
+    reset_peak_rss()
+    sampler = _RssSampler()
+    sampler.start()
+    started = time.perf_counter()
+    latencies = fn()
+    seconds = time.perf_counter() - started
+    peak = max(sampler.stop(), peak_rss_bytes() or 0)
+    return {
+        "conversations": conversations,
+        "seconds": round(seconds, 4),
+        "conversations_per_second": round(conversations / seconds, 3) if seconds else None,
+        "latency_ms": _latency_ms(latencies),
+        "stages": _stage_report(),
+        "model_calls": dict(sorted(metrics.model_calls.items())),
+        "peak_rss_bytes": peak or None,
+    }
+
+
+def _backend_throughput(backend, texts):
+    """texts per second of the sentence and emotion models on one inference backend"""
+    rss_before = _rss_bytes()
+    sentence, emotion = _load_sentence_model(backend), _load_emotion_model(backend)
+    rss_after = _rss_bytes()
+    result = {"texts": len(texts)}
+    with registry.override("sentence", sentence), registry.override("emotion", emotion):
+        for name, run in (("sentence", encode_messages), ("emotion", lambda t: EmotionEngine().probabilities(t))):
+            run(texts[:8])
+            started = time.perf_counter()
+            run(texts)
+            result[f"{name}_texts_per_second"] = round(len(texts) / (time.perf_counter() - started), 1)
+    result["models_rss_delta_bytes"] = rss_after - rss_before if rss_before and rss_after else None
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks get_conversation_analysis and run_daily_analysis on synthetic or replayed conversations "
+        "with Gemini stubbed out. Runs inside a transaction that is rolled back, nothing is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversations", type=int, default=50, help="Synthetic conversations to generate")
+        parser.add_argument("--turns", type=int, default=6, help="User/AI pairs per synthetic conversation")
+        parser.add_argument("--min-words", type=int, default=8, help="Shortest synthetic message in words")
+        parser.add_argument("--max-words", type=int, default=40, help="Longest synthetic message in words")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--replay", help="Benchmark the conversations of this JSONL file (ingest format) instead")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Nightly run chunk size")
+        parser.add_argument("--skip-daily", action="store_true", help="Only benchmark get_conversation_analysis")
+        parser.add_argument(
+            "--backends", nargs="+", choices=("torch", "onnx"), default=[],
+            help="Also measure sentence and emotion model throughput on these inference backends",
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--compare", help="Earlier --output file to compare conversations/s against")
+
+    def handle(self, *args, **options):
+        if options["min_words"] < 1 or options["max_words"] < options["min_words"]:
+            raise CommandError("--min-words must be at least 1 and not above --max-words")
+
+        started = time.perf_counter()
+        for name in _LOCAL_MODELS:
+            registry.get(name)
+        models_seconds = time.perf_counter() - started
+
+        results = {
+            "config": {
+                key: options[key]
+                for key in ("conversations", "turns", "min_words", "max_words", "seed", "replay", "chunk_size", "backends")
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "models_load_seconds": round(models_seconds, 3),
+            },
+        }
+        # every phase must compute its analyses, not read the results of the previous one from the result cache
+        with registry.override("gemini", StubGeminiClient()), override_settings(ANALYSIS_RESULT_CACHE=False), \
+                transaction.atomic():
+            self._run(options, results)
+            transaction.set_rollback(True)
+
+        if options["compare"]:
+            results["compare"] = self._compare(results["phases"], options["compare"])
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        self._print(results)
+
+    def _run(self, options, results):
+        if options["replay"]:
+            with open(options["replay"], encoding="utf-8") as f:
+                report = list(ingest_jsonl(f))
+        else:
+            report = list(ingest_jsonl(synthetic_conversations(
+                options["conversations"], options["turns"], options["min_words"], options["max_words"], options["seed"]
+            )))
+        ids = [entry["conversation_id"] for entry in report if entry["status"] == "ok"]
+        if not ids:
+            raise CommandError("No valid conversations to benchmark")
+        conversations = Conversation.objects.filter(id__in=ids)
+
+        def analyse_all():
+            latencies = []
+            for conversation in conversations.order_by("id"):
+                trace = AnalysisTrace(conversation.id)
+                get_conversation_analysis(conversation, trace=trace)
+                latencies.append(trace.wall_seconds)
+            return latencies
+
+        def forget_features():
+            MessageFeatures.objects.filter(message__conversation_id__in=ids).delete()
+
+        def daily_run():
+            # serial, spawned workers would not see the uncommitted benchmark rows
+            run_daily_analysis(workers=1, chunk_size=options["chunk_size"], full=True, conversations=conversations)
+
+        phases = {}
+        forget_features()
+        # cold: every model runs for every message, warm: features come from the store
+        phases["analysis_cold"] = _run_phase(analyse_all, len(ids))
+        phases["analysis_warm"] = _run_phase(analyse_all, len(ids))
+        if not options["skip_daily"]:
+            forget_features()
+            phases["daily_cold"] = _run_phase(daily_run, len(ids))
+        if options["backends"]:
+            texts = list(dict.fromkeys(
+                Message.objects.filter(conversation_id__in=ids).values_list("message", flat=True)[:2000]
+            ))
+            results["backends"] = {backend: _backend_throughput(backend, texts) for backend in options["backends"]}
+        results["phases"] = phases
+
+    def _compare(self, phases, path):
+        with open(path, encoding="utf-8") as f:
+            baseline = json.load(f).get("phases", {})
+        comparison = {}
+        for name, phase in phases.items():
+            before = (baseline.get(name) or {}).get("conversations_per_second")
+            if before and phase["conversations_per_second"]:
+                comparison[name] = {
+                    "baseline_conversations_per_second": before,
+                    "speedup": round(phase["conversations_per_second"] / before, 2),
+                }
+        return comparison
+
+    def _print(self, results):
+        for backend, throughput in results.get("backends", {}).items():
+            self.stdout.write(
+                f"{backend:<14} sentence {throughput['sentence_texts_per_second']} texts/s  "
+                f"emotion {throughput['emotion_texts_per_second']} texts/s"
+            )
+        for name, phase in results["phases"].items():
+            latency = phase["latency_ms"]
+            self.stdout.write(
+                f"{name:<14} {phase['conversations_per_second']} conv/s  "
+                + (f"p50={latency['p50']}ms p95={latency['p95']}ms  " if latency else "")
+                + f"peak_rss={(phase['peak_rss_bytes'] or 0) / 2 ** 20:.0f}MiB"
+            )
+            for stage, timing in phase["stages"].items():
+                self.stdout.write(f"    {stage:<14} {timing['mean_ms']}ms (cpu {timing['cpu_mean_ms']}ms)")
+        for name, comparison in results.get("compare", {}).items():
+            self.stdout.write(f"{name:<14} {comparison['speedup']}x vs baseline")
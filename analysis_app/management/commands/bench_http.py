@@ -0,0 +1,122 @@
+import json
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis_app.management.commands.bench_analysis import _latency_ms
+
+_DEFAULT_PATHS = ["/api/analyses/?page_size=100", "/api/conversation/?page_size=50&include_messages=0"]
+
+
+class _SlowClient(threading.Thread):
+    """
+    sends a request's headers one byte at a time, the way a client on a bad connection does, and so holds
+    a sync worker (or a thread of a threaded one) until the deadline
+    """
+
+    def __init__(self, url, deadline, interval=0.5):
+        super().__init__(daemon=True)
+        self.url = urlsplit(url)
+        self.deadline = deadline
+        self.interval = interval
+
+    def run(self):
+        request = f"GET / HTTP/1.1\r\nHost: {self.url.hostname}\r\nX-Padding: {'x' * 4096}\r\n\r\n".encode()
+        try:
+            with socket.create_connection((self.url.hostname, self.url.port or 80), timeout=5) as sock:
+                for byte in request:
+                    if time.monotonic() >= self.deadline:
+                        return
+                    sock.sendall(bytes([byte]))
+                    time.sleep(self.interval)
+        except OSError:
+            return
+
+
+def _load(base_url, paths, concurrency, duration):
+    """concurrency threads request the paths round-robin for duration seconds, returns latencies and errors"""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        session = requests.Session()
+        i = offset
+        while time.monotonic() < deadline:
+            url = base_url.rstrip("/") + paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                response = session.get(url, timeout=30)
+                failed = response.status_code >= 400
+            except requests.RequestException:
+                failed = True
+            elapsed = time.perf_counter() - started
+            with lock:
+                (errors if failed else latencies).append(elapsed)
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests running deployments of the API, e.g. the WSGI and the ASGI application side by side, "
+        "and reports requests/s and latency percentiles per target"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target", action="append", required=True, metavar="NAME=URL",
+            help="Deployment to test, repeat for each, e.g. wsgi=http://127.0.0.1:8000",
+        )
+        parser.add_argument("--path", action="append", help=f"Request path, repeatable (default: {', '.join(_DEFAULT_PATHS)})")
+        parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+        parser.add_argument("--duration", type=float, default=15, help="Seconds per target")
+        parser.add_argument(
+            "--slow-clients", type=int, default=0,
+            help="Connections that trickle their headers during the run and hold workers",
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options["target"]:
+            name, sep, url = target.partition("=")
+            if not sep or not url.startswith(("http://", "https://")):
+                raise CommandError(f"--target must look like NAME=http://host:port, got {target!r}")
+            targets.append((name, url))
+        paths = options["path"] or _DEFAULT_PATHS
+
+        results = {"config": {key: options[key] for key in ("concurrency", "duration", "slow_clients")}, "targets": {}}
+        results["config"]["paths"] = paths
+        for name, url in targets:
+            deadline = time.monotonic() + options["duration"]
+            for _ in range(options["slow_clients"]):
+                _SlowClient(url, deadline).start()
+            latencies, errors = _load(url, paths, options["concurrency"], options["duration"])
+            results["targets"][name] = {
+                "url": url,
+                "requests": len(latencies),
+                "errors": len(errors),
+                "requests_per_second": round(len(latencies) / options["duration"], 1),
+                "latency_ms": _latency_ms(latencies),
+            }
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        for name, target in results["targets"].items():
+            latency = target["latency_ms"]
+            self.stdout.write(
+                f"{name:<10} {target['requests_per_second']} req/s  errors={target['errors']}  "
+                + (f"p50={latency['p50']}ms p95={latency['p95']}ms max={latency['max']}ms" if latency else "")
+            )
@@ -0,0 +1,73 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# each snippet runs in a fresh interpreter and prints the seconds it took
+_BOOT_SNIPPET = """
+import os, time
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "post_analysis_main.settings")
+import django
+django.setup()
+import post_analysis_main.urls
+print(time.perf_counter() - started)
+"""
+
+_EAGER_SNIPPET = """
+import os, time
+started = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "post_analysis_main.settings")
+import django
+django.setup()
+import post_analysis_main.urls
+from analysis_app.model_registry import registry
+for name in {models!r}:
+    registry.get(name)
+print(time.perf_counter() - started)
+"""
+
+
+class Command(BaseCommand):
+    help = "Measures cold boot time of the Django app with lazy model loading against preloading every model"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--models", nargs="+", default=["sentence", "spacy", "emotion"],
+            help="Models loaded in the eager scenario",
+        )
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def _run(self, snippet):
+        result = subprocess.run(
+            [sys.executable, "-c", snippet], cwd=settings.BASE_DIR,
+            capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            return None
+        return float(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        scenarios = {
+            "lazy_boot": _BOOT_SNIPPET,
+            "eager_boot": _EAGER_SNIPPET.format(models=options["models"]),
+        }
+        results = {}
+        for name, snippet in scenarios.items():
+            timings = [self._run(snippet) for _ in range(options["repeat"])]
+            timings = [t for t in timings if t is not None]
+            results[name] = {
+                "runs": len(timings),
+                "median_seconds": round(statistics.median(timings), 3) if timings else None,
+            }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            median = result["median_seconds"]
+            self.stdout.write(f"{name:<12} {median if median is not None else 'failed'}")
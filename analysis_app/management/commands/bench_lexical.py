@@ -0,0 +1,86 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from analysis_app.lexical_utils import LexicalFeatures
+from analysis_app.utils import _normalize, analyze_sentiment, compute_clarity, compute_user_satisfaction
+
+_WORDS = (
+    "thanks order refund account password please help broken great terrible quickly sorry "
+    "delivery invoice problem happy angry update payment card issue resolved waiting support"
+).split()
+
+
+def synthetic_pairs(count, words_per_message, seed=0):
+    rng = random.Random(seed)
+    sentence = lambda: " ".join(rng.choice(_WORDS) for _ in range(words_per_message)).capitalize() + "."
+    return [(sentence(), sentence()) for _ in range(count)]
+
+
+def per_message_scores(pairs):
+    """the lexical metrics as they were computed before LexicalFeatures, one analyzer and one pass per call"""
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    from textblob import TextBlob
+    import textstat
+
+    sentiments = [
+        (0.7 * SentimentIntensityAnalyzer().polarity_scores(u)['compound']) + (0.3 * TextBlob(u).sentiment.polarity)
+        for u, _ in pairs
+    ]
+    clarities = [_normalize(textstat.flesch_reading_ease(a), -100, 121) for _, a in pairs]
+    analyzer = SentimentIntensityAnalyzer()
+    satisfaction = []
+    for u, a in pairs:
+        user_sentiment = analyzer.polarity_scores(u)['compound']
+        ai_sentiment = analyzer.polarity_scores(a)['compound']
+        satisfaction.append((0.6 * (ai_sentiment + 1) / 2) + (0.4 * (1 - abs(user_sentiment - ai_sentiment))))
+    return (
+        sum(sentiments) / len(sentiments),
+        sum(clarities) / len(clarities),
+        round(sum(satisfaction) / len(satisfaction), 3),
+    )
+
+
+def engine_scores(pairs):
+    user_messages = [{"message": u} for u, _ in pairs]
+    ai_messages = [{"message": a} for _, a in pairs]
+    lexical = LexicalFeatures([u for u, _ in pairs] + [a for _, a in pairs])
+    return (
+        analyze_sentiment(user_messages, lexical)[0],
+        compute_clarity(ai_messages, lexical)[0],
+        compute_user_satisfaction(pairs, lexical)[0],
+    )
+
+
+class Command(BaseCommand):
+    help = "Compares the shared lexical feature engine with the previous per-message sentiment and readability path"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pairs", type=int, default=200, help="User/AI pairs per conversation")
+        parser.add_argument("--words", type=int, default=20, help="Words per message")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        pairs = synthetic_pairs(options["pairs"], options["words"])
+        # load the shared analyzer and the lexicons outside the timed runs
+        engine_scores(pairs[:1])
+
+        results = {}
+        for name, scorer in (("per_message", per_message_scores), ("engine", engine_scores)):
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                scores = scorer(pairs)
+                timings.append(time.perf_counter() - started)
+            results[name] = {"best_seconds": round(min(timings), 4), "scores": [round(float(v), 4) for v in scores]}
+        results["speedup"] = round(results["per_message"]["best_seconds"] / results["engine"]["best_seconds"], 2)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name in ("per_message", "engine"):
+            self.stdout.write(f"{name:<12} {results[name]['best_seconds']}s  scores={results[name]['scores']}")
+        self.stdout.write(f"speedup      {results['speedup']}x")
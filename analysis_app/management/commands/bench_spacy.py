@@ -0,0 +1,47 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis_app.models import Message
+from analysis_app.model_registry import get_nlp
+from analysis_app.utils import parse_texts
+
+
+class Command(BaseCommand):
+    help = "Measures spaCy parsing throughput of stored messages for different nlp.pipe worker counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--n-process", type=int, nargs="+", default=[1, 2, 4])
+        parser.add_argument("--batch-size", type=int, default=64)
+        parser.add_argument("--limit", type=int, default=5000, help="Number of messages to parse")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        texts = list(
+            Message.objects.exclude(message="").values_list("message", flat=True)[:options["limit"]]
+        )
+        if not texts:
+            raise CommandError("No messages to parse, upload some conversations first")
+
+        get_nlp()
+        results = []
+        for n_process in options["n_process"]:
+            started = time.perf_counter()
+            parsed = parse_texts(texts, n_process=n_process, batch_size=options["batch_size"])
+            elapsed = time.perf_counter() - started
+            results.append({
+                "n_process": n_process,
+                "docs": len(parsed),
+                "seconds": round(elapsed, 3),
+                "docs_per_second": round(len(parsed) / elapsed, 1) if elapsed else None,
+            })
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.stdout.write(
+                f"n_process={result['n_process']:<3} {result['docs']} docs in {result['seconds']}s "
+                f"({result['docs_per_second']} docs/s)"
+            )
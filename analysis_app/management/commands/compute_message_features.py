@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from analysis_app.features import backfill_message_features, feature_version
+from analysis_app.models import Message
+
+
+class Command(BaseCommand):
+    help = "Fills the per-message feature store for messages that have no current features"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversation-ids", type=int, nargs="+", help="Only these conversations")
+        parser.add_argument("--batch-size", type=int, default=500, help="Messages per model batch")
+
+    def handle(self, *args, **options):
+        messages = Message.objects.exclude(features__version=feature_version())
+        if options["conversation_ids"]:
+            messages = messages.filter(conversation_id__in=options["conversation_ids"])
+        processed = backfill_message_features(messages, batch_size=max(1, options["batch_size"]))
+        self.stdout.write(self.style.SUCCESS(f"Computed features for {processed} messages"))
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis_app.onnx_backend import EXPORTED_MODELS, compare_backends, export_models
+
+# texts for --check, a mix of lengths and emotions
+_CHECK_TEXTS = [
+    "Thanks, that fixed it!",
+    "I have been waiting three weeks for my refund and nobody answers my emails.",
+    "Can you tell me how to change the delivery address on an order that already shipped?",
+    "This is the worst support I have ever had.",
+    "ok",
+    "I'm sorry to hear that. I have escalated your case and a specialist will contact you within 24 hours.",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the sentence and emotion models from the local Hugging Face cache to ONNX, with an "
+        "int8-quantized copy, for INFERENCE_BACKEND = \"onnx\""
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--models", nargs="+", choices=EXPORTED_MODELS, default=list(EXPORTED_MODELS))
+        parser.add_argument("--output-dir", default=None, help="Default: settings.ONNX_MODEL_DIR")
+        parser.add_argument("--no-quantize", action="store_true", help="Only write the fp32 models")
+        parser.add_argument("--download", action="store_true", help="Fetch models missing from the local cache")
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Compare the models in settings.ONNX_MODEL_DIR with the PyTorch backend afterwards",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            report = export_models(
+                options["models"], base_dir=options["output_dir"],
+                quantize=not options["no_quantize"], local_files_only=not options["download"],
+            )
+        except ImportError as e:
+            raise CommandError(f"Exporting needs torch, transformers and onnxruntime: {e}")
+        except OSError as e:
+            raise CommandError(f"{e}\nRun once with --download or load the models with warmup_models first")
+
+        for name, files in report.items():
+            for filename, size in files.items():
+                self.stdout.write(f"{name:<10} {filename:<16} {size / 2**20:.1f} MiB")
+        if options["check"]:
+            self.stdout.write(json.dumps(compare_backends(_CHECK_TEXTS, quantized=not options["no_quantize"]), indent=2))
+        self.stdout.write(self.style.SUCCESS("ONNX models exported"))
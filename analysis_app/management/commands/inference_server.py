@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis_app.inference_server import serve
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads the sentence, emotion and spaCy models once and serves batched inference to every web, "
+        "job and cron process of this node over a Unix socket (settings.INFERENCE_SOCKET)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=None, help="Socket path (default: settings.INFERENCE_SOCKET)")
+        parser.add_argument("--max-batch", type=int, default=None, help="Texts per merged batch")
+        parser.add_argument("--max-wait-ms", type=float, default=None, help="How long a batch waits for more requests")
+        parser.add_argument("--torch-threads", type=int, default=None, help="Torch intra-op threads")
+
+    def handle(self, *args, **options):
+        path = options["socket"] or settings.INFERENCE_SOCKET
+        if not path:
+            raise CommandError("Pass --socket or set INFERENCE_SOCKET")
+        if options["torch_threads"]:
+            import torch
+            torch.set_num_threads(options["torch_threads"])
+
+        self.stdout.write(f"Loading models and listening on {path}")
+        try:
+            serve(
+                path,
+                max_texts=options["max_batch"] or settings.INFERENCE_MAX_BATCH,
+                max_wait=(options["max_wait_ms"] if options["max_wait_ms"] is not None else settings.INFERENCE_MAX_WAIT_MS) / 1000,
+            )
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
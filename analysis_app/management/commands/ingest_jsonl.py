@@ -0,0 +1,50 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from analysis_app.features import backfill_message_features
+from analysis_app.ingest import DEFAULT_BATCH_SIZE, ingest_jsonl
+from analysis_app.models import Message
+
+
+class Command(BaseCommand):
+    help = "Streams conversations from a JSONL file (one conversation per line) into the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSONL file to ingest, '-' reads from stdin")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Conversations per transaction")
+        parser.add_argument("--report", help="Write the per-line report as JSONL to this file")
+        parser.add_argument(
+            "--with-features", action="store_true",
+            help="Fill the message feature store for every ingested conversation (loads the models)",
+        )
+
+    def handle(self, *args, **options):
+        source = sys.stdin if options["path"] == "-" else open(options["path"], encoding="utf-8")
+        report_file = open(options["report"], "w", encoding="utf-8") if options["report"] else None
+        created = failed = 0
+        created_ids = []
+        try:
+            for entry in ingest_jsonl(source, batch_size=max(1, options["batch_size"])):
+                if entry["status"] == "ok":
+                    created += 1
+                    created_ids.append(entry["conversation_id"])
+                else:
+                    failed += 1
+                    self.stderr.write(f"line {entry['line']}: {json.dumps(entry['errors'])}")
+                if report_file:
+                    report_file.write(json.dumps(entry) + "\n")
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if report_file:
+                report_file.close()
+        self.stdout.write(self.style.SUCCESS(f"Created {created} conversations, {failed} lines failed"))
+
+        if options["with_features"] and created_ids:
+            processed = 0
+            for start in range(0, len(created_ids), options["batch_size"]):
+                chunk = created_ids[start:start + options["batch_size"]]
+                processed += backfill_message_features(Message.objects.filter(conversation_id__in=chunk))
+            self.stdout.write(self.style.SUCCESS(f"Computed features for {processed} messages"))
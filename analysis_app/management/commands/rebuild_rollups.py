@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from analysis_app.models import AnalysisRollup
+from analysis_app.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recomputes the daily analysis rollups from every ConversationAnalysis row"
+
+    def handle(self, *args, **options):
+        rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {AnalysisRollup.objects.count()} rollup rows"))
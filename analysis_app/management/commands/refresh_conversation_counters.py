@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from analysis_app.ingest import refresh_conversation_counters
+from analysis_app.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the stored message counters of conversations and clears their content hash, after messages "
+        "were added or removed outside the upload endpoints (bulk_create, queryset updates, raw SQL)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversation-ids", type=int, nargs="+", help="Only these conversations")
+
+    def handle(self, *args, **options):
+        conversations = Conversation.objects.all()
+        if options["conversation_ids"]:
+            conversations = conversations.filter(id__in=options["conversation_ids"])
+        updated = refresh_conversation_counters(conversations)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed the counters of {updated} conversations"))
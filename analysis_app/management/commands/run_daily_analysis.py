@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from analysis_app.cron import run_daily_analysis
+
+
+class Command(BaseCommand):
+    help = "Runs the nightly analysis over all conversations, optionally in parallel worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: settings.ANALYSIS_WORKERS)")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Conversations per chunk (default: settings.ANALYSIS_CHUNK_SIZE)")
+        parser.add_argument("--torch-threads", type=int, default=None, help="Torch intra-op threads per worker")
+        parser.add_argument("--full", action="store_true", help="Re-analyse every conversation, including unchanged ones")
+
+    def handle(self, *args, **options):
+        summary = run_daily_analysis(
+            workers=options["workers"],
+            chunk_size=options["chunk_size"],
+            torch_threads=options["torch_threads"],
+            full=options["full"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Analysed {summary['analysed']} of {summary['conversations']} conversations, "
+            f"skipped {summary['skipped']} unchanged"
+        ))
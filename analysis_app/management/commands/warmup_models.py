@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis_app.model_registry import registry, load_report
+
+
+class Command(BaseCommand):
+    help = "Preloads the analysis models into this process and prints a load-time and memory report"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--models", nargs="+", choices=registry.names(), default=None,
+            help="Models to load (default: all registered models)",
+        )
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        names = options["models"] or registry.names()
+        for name in names:
+            try:
+                registry.get(name)
+            except Exception as e:
+                raise CommandError(f"Failed to load '{name}': {e}")
+
+        report = load_report()
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        for model in report["models"]:
+            if not model["loaded"]:
+                continue
+            rss = model["rss_delta_bytes"]
+            rss_text = f"{rss / 2**20:.1f} MiB" if rss is not None else "n/a"
+            self.stdout.write(f"{model['name']:<10} {model['load_seconds']:>8.3f}s  {rss_text}")
+        if report["process_rss_bytes"] is not None:
+            self.stdout.write(f"process rss: {report['process_rss_bytes'] / 2**20:.1f} MiB")
+        self.stdout.write(self.style.SUCCESS("Models warmed up"))
@@ -0,0 +1,222 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Callable, NamedTuple, Tuple
+
+from django.db import connection
+
+from .empathy_utils import compute_empathy_score
+from .features import ConversationFeatures, ensure_message_features, load_message_features
+from .gemini_utils import compute_accuracy_score
+from .utils import (
+    analyze_sentiment, compute_clarity, compute_completeness, compute_escalation_need, compute_fallback_frequency,
+    compute_relavance_score, compute_resolution_rate, compute_response_time, compute_user_satisfaction,
+)
+
+# bump whenever a metric, label threshold or api_response field changes, cached results are recomputed
+METRICS_VERSION = "2"
+# inputs that come from the models, when a selection needs all of them the feature store is filled
+MODEL_INPUTS = {"embeddings", "emotion", "parse", "lexical"}
+
+
+class Metric(NamedTuple):
+    inputs: Tuple[str, ...]
+    # compute(context) returns a tuple with one value per field
+    compute: Callable
+    # api_response keys of the values compute returns
+    fields: Tuple[str, ...]
+    # metrics whose results this one reads
+    requires: Tuple[str, ...] = ()
+    # waits on the network rather than the CPU, runs next to the local metrics
+    remote: bool = False
+
+
+def _escalation(context):
+    results = context.results
+    _, escalation_need = compute_escalation_need(
+        results["sentiment"]["sentiment_score"], results["completeness"]["completeness_score"],
+        results["accuracy"]["accuracy_score"], results["fallback"]["fallback_frequency"],
+        results["resolution"]["resolution_rate"],
+    )
+    return (escalation_need,)
+
+
+# in api_response order
+METRICS = {
+    "sentiment": Metric(
+        ("lexical",), lambda c: analyze_sentiment(c.user_messages, c.lexical), ("sentiment_score", "sentiment_label"),
+    ),
+    "relevance": Metric(
+        ("embeddings",), lambda c: compute_relavance_score(c.pairs, c.similarities), ("relevance_score", "relevance_label"),
+    ),
+    "clarity": Metric(
+        ("lexical",), lambda c: compute_clarity(c.ai_messages, c.lexical), ("clarity_score", "clarity_label"),
+    ),
+    "completeness": Metric(
+        ("embeddings", "parse"), lambda c: compute_completeness(c.pairs, c.similarities, c.parsed),
+        ("completeness_score", "completeness_label"),
+    ),
+    "accuracy": Metric(
+        (), lambda c: compute_accuracy_score(c.pairs), ("accuracy_score", "accuracy_label"), remote=True,
+    ),
+    "empathy": Metric(
+        ("emotion",), lambda c: compute_empathy_score(c.pairs, c.emotion_engine), ("empathy_score", "empathy_label"),
+    ),
+    "fallback": Metric(
+        (), lambda c: compute_fallback_frequency(c.ai_messages), ("fallback_frequency", "fallback_label"),
+    ),
+    "resolution": Metric(
+        ("embeddings",), lambda c: (compute_resolution_rate(c.pairs, c.similarities),), ("resolution_rate",),
+    ),
+    "escalation": Metric(
+        (), _escalation, ("escalation_need",), requires=("sentiment", "completeness", "accuracy", "fallback", "resolution"),
+    ),
+    "response_time": Metric(
+        (), lambda c: compute_response_time(zip(c.user_messages, c.ai_messages)), ("response_time", "response_label"),
+    ),
+    "satisfaction": Metric(
+        ("lexical",), lambda c: compute_user_satisfaction(c.pairs, c.lexical),
+        ("user_satisfaction_score", "user_satisfaction_label"),
+    ),
+}
+
+# (metric, analytics_data key, value from the metric's api_response fields)
+ANALYTICS_FIELDS = [
+    ("clarity", "clarity", lambda r: r["clarity_score"]),
+    ("relevance", "relevance", lambda r: r["relevance_score"]),
+    ("accuracy", "accuracy", lambda r: r["accuracy_score"]),
+    ("completeness", "completeness", lambda r: r["completeness_score"]),
+    ("sentiment", "sentiment", lambda r: r["sentiment_label"]),
+    ("empathy", "empathy", lambda r: r["empathy_score"]),
+    ("fallback", "fallback_count", lambda r: r["fallback_frequency"]),
+    ("resolution", "resolution", lambda r: bool(r["resolution_rate"])),
+    ("escalation", "escalation", lambda r: bool(r["escalation_need"])),
+    ("response_time", "response_time", lambda r: r["response_time"]),
+    ("satisfaction", "overall_score", lambda r: r["user_satisfaction_score"]),
+]
+
+
+def resolve(names=None):
+    """the requested metrics plus every metric they require, in METRICS order"""
+    if names is None:
+        return list(METRICS)
+    unknown = set(names) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(sorted(unknown))}")
+    selected = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(METRICS[name].requires)
+    return [name for name in METRICS if name in selected]
+
+
+class MetricContext:
+    """
+    the inputs of one conversation's metrics, each computed on first use so that a selection of
+    metrics only pays for the inputs it declares
+    """
+
+    def __init__(self, messages, user_messages, ai_messages, pairs, inputs, trace, emotion_engine=None):
+        self.messages = messages
+        self.user_messages = user_messages
+        self.ai_messages = ai_messages
+        self.pairs = pairs
+        self.inputs = inputs
+        self.trace = trace
+        self.emotion_engine_override = emotion_engine
+        self.results = {}
+
+    @cached_property
+    def features(self):
+        scored = self.user_messages + self.ai_messages
+        if MODEL_INPUTS <= self.inputs:
+            # everything is needed anyway, so compute what is missing in one pass and store it
+            rows = self.trace.call("features", ensure_message_features, scored, self.emotion_engine_override)
+        else:
+            rows, _ = self.trace.call("features", load_message_features, scored)
+        return ConversationFeatures(self.messages, rows, self.emotion_engine_override)
+
+    @cached_property
+    def similarities(self):
+        return self.trace.call("embeddings", self.features.similarities, self.pairs)
+
+    @cached_property
+    def lexical(self):
+        return self.trace.call("lexical", self.features.lexical)
+
+    @cached_property
+    def parsed(self):
+        return self.trace.call("parse", self.features.parsed)
+
+    @cached_property
+    def emotion_engine(self):
+        return self.features.emotion_engine()
+
+
+def _compute(trace, name, context):
+    metric = METRICS[name]
+    return dict(zip(metric.fields, trace.call(name, metric.compute, context)))
+
+
+def _run_remote(trace, name, context):
+    try:
+        return _compute(trace, name, context)
+    finally:
+        # the worker thread opened its own database connection (Gemini response cache)
+        connection.close()
+
+
+def run_metrics(messages, user_messages, ai_messages, pairs, trace, names=None, emotion_engine=None, progress=None):
+    """
+    Runs the selected metrics (default: all) and returns their api_response fields by metric name.
+    Only the inputs the selection declares are computed, on first use. Remote metrics (the Gemini
+    accuracy call) start first in a worker thread and overlap with the local models.
+    """
+    report = progress or (lambda stage, fraction: None)
+    order = resolve(names)
+    inputs = {name for metric in order for name in METRICS[metric].inputs}
+    context = MetricContext(messages, user_messages, ai_messages, pairs, inputs, trace, emotion_engine)
+
+    remote = [name for name in order if METRICS[name].remote]
+    with ThreadPoolExecutor(max_workers=max(1, len(remote))) as pool:
+        futures = {
+            name: pool.submit(contextvars.copy_context().run, _run_remote, trace, name, context)
+            for name in remote
+        }
+        local = [name for name in order if name not in futures]
+        for i, name in enumerate(local):
+            report(name, 0.1 + 0.8 * i / len(local))
+            for required in METRICS[name].requires:
+                if required in futures:
+                    context.results[required] = futures[required].result()
+            context.results[name] = _compute(trace, name, context)
+        for name, future in futures.items():
+            context.results[name] = future.result()
+    report("summary", 0.9)
+    return {name: context.results[name] for name in order}
+
+
+def assemble(results, content_hash=None):
+    """(analytics_data, api_response) from run_metrics results, both limited to the metrics that ran"""
+    analytics_data = {
+        key: value(results[metric]) for metric, key, value in ANALYTICS_FIELDS if metric in results
+    }
+    if content_hash is not None:
+        analytics_data["content_hash"] = content_hash
+    api_response = {"analytics": analytics_data}
+    for fields in results.values():
+        api_response.update(fields)
+    return analytics_data, api_response
+
+
+def select(api_response, names):
+    """narrows a complete api_response to the fields of the given metrics"""
+    order = resolve(names)
+    fields = {key for name in order for key in METRICS[name].fields}
+    # analytics keys that belong to no metric (content_hash, analysis_version) are kept
+    dropped = {key for metric, key, _ in ANALYTICS_FIELDS if metric not in order}
+    analytics = {key: value for key, value in api_response["analytics"].items() if key not in dropped}
+    return {"analytics": analytics, **{key: value for key, value in api_response.items() if key in fields}}
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis_app', '0003_conversationanalysis_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeminiResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prompt_hash', models.CharField(max_length=64, unique=True)),
+                ('model_name', models.CharField(max_length=100)),
+                ('score', models.FloatField(default=0)),
+                ('label', models.CharField(default='inaccurate', max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
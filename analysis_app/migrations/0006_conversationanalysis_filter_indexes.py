@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis_app', '0005_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['created_at'], name='analysis_ap_created_ee8b2f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['escalation', 'id'], name='analysis_ap_escalat_0906a3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['sentiment', 'id'], name='analysis_ap_sentime_a61f70_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['overall_score'], name='analysis_ap_overall_e903d2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['clarity'], name='analysis_ap_clarity_d4cdfb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['relevance'], name='analysis_ap_relevan_6f4cda_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['accuracy'], name='analysis_ap_accurac_9d1a0d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['completeness'], name='analysis_ap_complet_8b6394_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['empathy'], name='analysis_ap_empathy_cc81a8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationanalysis',
+            index=models.Index(fields=['response_time'], name='analysis_ap_respons_e73b5e_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis_app', '0006_conversationanalysis_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('title', models.CharField(blank=True, default='', max_length=255)),
+                ('count', models.IntegerField(default=0)),
+                ('sum_clarity', models.FloatField(default=0)),
+                ('sum_relevance', models.FloatField(default=0)),
+                ('sum_empathy', models.FloatField(default=0)),
+                ('sum_overall_score', models.FloatField(default=0)),
+                ('escalations', models.IntegerField(default=0)),
+                ('fallbacks', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'title'), name='unique_rollup_day_title')],
+            },
+        ),
+    ]
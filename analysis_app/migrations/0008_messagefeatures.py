@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis_app', '0007_analysisrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageFeatures',
+            fields=[
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='features', serialize=False, to='analysis_app.message')),
+                ('version', models.CharField(max_length=20)),
+                ('message_hash', models.CharField(max_length=40)),
+                ('embedding', models.BinaryField()),
+                ('emotion', models.BinaryField()),
+                ('vader', models.FloatField()),
+                ('polarity', models.FloatField()),
+                ('flesch', models.FloatField(null=True)),
+                ('keyphrases', models.JSONField(default=list)),
+                ('sentence_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    # one UPDATE with correlated subqueries, the same as ingest.refresh_conversation_counters
+    Conversation = apps.get_model('analysis_app', 'Conversation')
+    Message = apps.get_model('analysis_app', 'Message')
+
+    def count(**filters):
+        messages = Message.objects.filter(conversation=OuterRef('pk'), **filters).order_by()
+        return Coalesce(Subquery(messages.values('conversation').annotate(n=Count('id')).values('n')), 0)
+
+    Conversation.objects.update(
+        message_count=count(),
+        user_message_count=count(sender='user'),
+        ai_message_count=count(sender='ai'),
+        last_message_at=Subquery(
+            Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp').values('timestamp')[:1]
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis_app', '0009_analysis_result_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='ai_message_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='user_message_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'timestamp'], name='analysis_ap_convers_d906c5_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis_app', '0011_analysisjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversationanalysis',
+            name='fallback_count',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis_app', '0012_conversationanalysis_fallback_frequency_float'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+SENTENCE_MODEL_NAME = "all-MiniLM-L6-v2"
+SPACY_MODEL_NAME = "en_core_web_sm"
+# none of the metrics read entities or lemmas, so these components are never loaded
+SPACY_EXCLUDED_PIPES = ["ner", "lemmatizer"]
+EMOTION_MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
+
+
+def _rss_bytes():
+    """
+    resident memory of the current process in bytes, None when it cannot be read
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class ModelRegistry:
+    """
+    hands out process-wide model singletons, each loaded lazily and exactly once even under concurrent access
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._instances = {}
+        self._stats = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        if name in self._instances:
+            return self._instances[name]
+        if name not in self._loaders:
+            raise KeyError(f"No model registered under '{name}'")
+        with self._locks[name]:
+            if name not in self._instances:
+                rss_before = _rss_bytes()
+                started = time.perf_counter()
+                instance = self._loaders[name]()
+                load_seconds = time.perf_counter() - started
+                rss_after = _rss_bytes()
+                self._stats[name] = {
+                    "load_seconds": round(load_seconds, 3),
+                    "rss_delta_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+                }
+                self._instances[name] = instance
+        return self._instances[name]
+
+    @contextmanager
+    def override(self, name, instance):
+        """serves instance for name inside the block, e.g. a stub client for offline benchmarks"""
+        with self._locks[name]:
+            previous = self._instances.get(name)
+            self._instances[name] = instance
+        try:
+            yield instance
+        finally:
+            with self._locks[name]:
+                if previous is None:
+                    self._instances.pop(name, None)
+                else:
+                    self._instances[name] = previous
+
+    def is_loaded(self, name):
+        return name in self._instances
+
+    def names(self):
+        return list(self._loaders)
+
+    def report(self):
+        models = []
+        for name in self._loaders:
+            stats = self._stats.get(name, {})
+            models.append({
+                "name": name,
+                "loaded": name in self._instances,
+                "load_seconds": stats.get("load_seconds"),
+                "rss_delta_bytes": stats.get("rss_delta_bytes"),
+            })
+        return {"process_rss_bytes": _rss_bytes(), "models": models}
+
+
+def _backend(backend=None):
+    from django.conf import settings
+    return backend or getattr(settings, "INFERENCE_BACKEND", "torch")
+
+
+def _load_sentence_model(backend=None):
+    if _backend(backend) == "onnx":
+        from .onnx_backend import OnnxSentenceEncoder
+        return OnnxSentenceEncoder()
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(SENTENCE_MODEL_NAME)
+
+
+def _load_nlp():
+    import spacy
+    return spacy.load(SPACY_MODEL_NAME, exclude=SPACY_EXCLUDED_PIPES)
+
+
+def _load_emotion_model(backend=None):
+    if _backend(backend) == "onnx":
+        from .onnx_backend import load_emotion_model
+        return load_emotion_model()
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    tokenizer = AutoTokenizer.from_pretrained(EMOTION_MODEL_NAME)
+    model = AutoModelForSequenceClassification.from_pretrained(EMOTION_MODEL_NAME)
+    model.eval()
+    return tokenizer, model
+
+
+def _load_vader():
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
+
+
+def _load_gemini_model():
+    from .gemini_utils import GeminiAccuracyClient
+    return GeminiAccuracyClient.from_settings()
+
+
+registry = ModelRegistry()
+registry.register("sentence", _load_sentence_model)
+registry.register("spacy", _load_nlp)
+registry.register("emotion", _load_emotion_model)
+registry.register("vader", _load_vader)
+registry.register("gemini", _load_gemini_model)
+
+
+def get_sentence_model():
+    return registry.get("sentence")
+
+
+def get_nlp():
+    return registry.get("spacy")
+
+
+def get_emotion_model():
+    """
+    returns the (tokenizer, model) pair of the emotion classifier, model is an OnnxEmotionClassifier
+    when settings.INFERENCE_BACKEND is "onnx"
+    """
+    return registry.get("emotion")
+
+
+def get_vader():
+    return registry.get("vader")
+
+
+def get_gemini_model():
+    """
+    returns the process-wide GeminiAccuracyClient
+    """
+    return registry.get("gemini")
+
+
+def load_report():
+    return registry.report()
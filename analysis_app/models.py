@@ -1,8 +1,31 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 class Conversation(models.Model):
+    # fields kept in step with the conversation's messages, set at ingest by count_messages
+    COUNTER_FIELDS = ["message_count", "user_message_count", "ai_message_count", "last_message_at", "content_hash"]
+
     title = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    message_count = models.IntegerField(default=0)
+    user_message_count = models.IntegerField(default=0)
+    ai_message_count = models.IntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # utils.content_fingerprint of the messages, empty when a message was written outside ingest and
+    # the nightly run has not hashed the conversation again yet
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+
+    def count_messages(self, messages):
+        """sets the counters and the content hash from the conversation's saved Message instances, in id order"""
+        from .utils import content_fingerprint
+
+        messages = list(messages)
+        self.content_hash = content_fingerprint((m.sender, m.message, m.timestamp) for m in messages)
+        self.message_count = len(messages)
+        self.user_message_count = sum(1 for m in messages if m.sender == "user")
+        self.ai_message_count = sum(1 for m in messages if m.sender == "ai")
+        self.last_message_at = max((m.timestamp for m in messages), default=None)
 
     def __str__(self):
         return self.title or f"Conversation {self.id}"
@@ -16,9 +39,44 @@ class Message(models.Model):
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # a conversation's messages in time order, SQLite appends the rowid so ties come back in id order
+        indexes = [
+            models.Index(fields=["conversation", "timestamp"]),
+        ]
+
     def __str__(self):
         return f"{self.sender}: {self.message[:40]}"
 
+@receiver([post_save, post_delete], sender=Message)
+def _clear_content_hash(sender, instance, origin=None, **kwargs):
+    # a message saved or deleted one at a time (admin, shell): the nightly run hashes the conversation again
+    if isinstance(origin, Conversation) or getattr(origin, "model", None) is Conversation:
+        return
+    Conversation.objects.filter(id=instance.conversation_id).exclude(content_hash="").update(content_hash="")
+
+class MessageFeatures(models.Model):
+    """
+    model outputs of a single message, see features.ensure_message_features. Vectors are stored as raw
+    float32 bytes, version and message_hash mark rows that are stale after a model or text change
+    """
+    message = models.OneToOneField(
+        Message, on_delete=models.CASCADE, primary_key=True, related_name="features"
+    )
+    version = models.CharField(max_length=20)
+    message_hash = models.CharField(max_length=40)
+    embedding = models.BinaryField()
+    emotion = models.BinaryField()
+    vader = models.FloatField()
+    polarity = models.FloatField()
+    flesch = models.FloatField(null=True)
+    keyphrases = models.JSONField(default=list)
+    sentence_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Features for message {self.message_id}"
+
 class ConversationAnalysis(models.Model):
     conversation = models.OneToOneField(
         Conversation, on_delete=models.CASCADE, related_name="analysis"
@@ -30,13 +88,114 @@ class ConversationAnalysis(models.Model):
     completeness = models.FloatField(default=0)
     sentiment = models.CharField(max_length=20, default="neutral")
     empathy = models.FloatField(default=0)
-    fallback_count = models.IntegerField(default=0)
+    # share of AI messages that were fallbacks (the fallback metric's frequency), not a count
+    fallback_count = models.FloatField(default=0)
     resolution = models.BooleanField(default=False)
     escalation = models.BooleanField(default=False)
     response_time = models.FloatField(default=0)
     overall_score = models.FloatField(default=0)
+    # fingerprint of the messages this analysis was computed from, see utils.content_fingerprint
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    # metric, feature and model versions it was computed with, see result_cache.analysis_version
+    analysis_version = models.CharField(max_length=100, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # back the /api/analyses/ filters, the (flag, id) pairs also serve the keyset pagination on id
+        indexes = [
+            models.Index(fields=["created_at"]),
+            models.Index(fields=["escalation", "id"]),
+            models.Index(fields=["sentiment", "id"]),
+            models.Index(fields=["overall_score"]),
+            models.Index(fields=["clarity"]),
+            models.Index(fields=["relevance"]),
+            models.Index(fields=["accuracy"]),
+            models.Index(fields=["completeness"]),
+            models.Index(fields=["empathy"]),
+            models.Index(fields=["response_time"]),
+        ]
+
     def __str__(self):
         return f"Analysis for {self.conversation}"
-    
+
+
+class GeminiResponse(models.Model):
+    """
+    parsed Gemini accuracy result cached by a hash of the model name and prompt
+    """
+    prompt_hash = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=100)
+    score = models.FloatField(default=0)
+    label = models.CharField(max_length=50, default="inaccurate")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.model_name}: {self.label} ({self.score})"
+
+
+class AnalysisResult(models.Model):
+    """
+    complete analysis response cached by a hash of the conversation content and the analysis version,
+    shared by every conversation with the same messages
+    """
+    result_key = models.CharField(max_length=64, unique=True)
+    content_hash = models.CharField(max_length=64)
+    analysis_version = models.CharField(max_length=100)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Result {self.result_key[:12]} ({self.analysis_version})"
+
+
+class AnalysisJob(models.Model):
+    """
+    queued analysis request, picked up by `manage.py analysis_worker`
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="analysis_jobs"
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    stage = models.CharField(max_length=50, blank=True)
+    progress = models.FloatField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # refreshed by the worker on every progress report, a running job without one for too long is requeued
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    def __str__(self):
+        return f"Job {self.id} for {self.conversation} ({self.status})"
+
+
+class AnalysisRollup(models.Model):
+    """
+    running per-day sums of ConversationAnalysis rows, one row per (day, title) plus title="" for all
+    conversations of the day, kept up to date by rollups.store_analysis
+    """
+    day = models.DateField()
+    title = models.CharField(max_length=255, blank=True, default="")
+    count = models.IntegerField(default=0)
+    sum_clarity = models.FloatField(default=0)
+    sum_relevance = models.FloatField(default=0)
+    sum_empathy = models.FloatField(default=0)
+    sum_overall_score = models.FloatField(default=0)
+    escalations = models.IntegerField(default=0)
+    fallbacks = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day", "title"], name="unique_rollup_day_title"),
+        ]
+
+    def __str__(self):
+        return f"Rollup {self.day} {self.title or '(all)'}"
@@ -0,0 +1,167 @@
+# ONNX Runtime inference for the sentence and emotion models, selected with
+# settings.INFERENCE_BACKEND = "onnx". onnxruntime and the tokenizers are imported when a model is
+# loaded, torch is only needed by export_models.
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .model_registry import EMOTION_MODEL_NAME, SENTENCE_MODEL_NAME
+
+# the hub id behind the sentence-transformers short name
+SENTENCE_HUB_NAME = f"sentence-transformers/{SENTENCE_MODEL_NAME}"
+# longest input of all-MiniLM-L6-v2, SentenceTransformer truncates to the same length
+SENTENCE_MAX_LENGTH = 256
+FP32_FILENAME = "model.onnx"
+INT8_FILENAME = "model_int8.onnx"
+EXPORTED_MODELS = ("sentence", "emotion")
+
+
+def model_dir(name, base_dir=None):
+    return Path(base_dir or settings.ONNX_MODEL_DIR) / name
+
+
+def _session(path):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    threads = getattr(settings, "ONNX_THREADS", 0)
+    if threads:
+        options.intra_op_num_threads = threads
+    return onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+
+def _model_path(name, quantized=None):
+    quantized = getattr(settings, "ONNX_QUANTIZED", True) if quantized is None else quantized
+    directory = model_dir(name)
+    path = directory / (INT8_FILENAME if quantized else FP32_FILENAME)
+    if not path.exists():
+        raise FileNotFoundError(f"{path} not found, run `python manage.py export_onnx_models` first")
+    return path
+
+
+def _feed(session, encodings):
+    """the encodings the graph takes, as int64 arrays"""
+    names = {i.name for i in session.get_inputs()}
+    return {key: np.asarray(value, dtype=np.int64) for key, value in encodings.items() if key in names}
+
+
+class OnnxSentenceEncoder:
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime with the SentenceTransformer pipeline around it (mean pooling
+    over the attention mask, then L2 normalisation). Implements the part of the SentenceTransformer
+    API that encode_messages uses.
+    """
+
+    def __init__(self, quantized=None):
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir("sentence"))
+        self.session = _session(_model_path("sentence", quantized))
+
+    def get_sentence_embedding_dimension(self):
+        return self.session.get_outputs()[0].shape[-1]
+
+    def encode(self, texts, batch_size=64, convert_to_numpy=True):
+        texts = list(texts)
+        embeddings = np.zeros((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        # length-sorted batches keep padding short, like EmotionEngine
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            encodings = self.tokenizer(
+                [texts[i] for i in batch_idx], padding=True, truncation=True,
+                max_length=SENTENCE_MAX_LENGTH, return_tensors="np",
+            )
+            hidden = self.session.run(None, _feed(self.session, encodings))[0]
+            mask = encodings["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            embeddings[batch_idx] = pooled / np.clip(norms, 1e-12, None)
+        return embeddings
+
+
+class OnnxEmotionClassifier:
+    """the DistilRoBERTa emotion classifier on ONNX Runtime, takes padded numpy batches"""
+
+    def __init__(self, quantized=None):
+        self.session = _session(_model_path("emotion", quantized))
+
+    def probabilities(self, batch):
+        logits = self.session.run(None, _feed(self.session, batch))[0]
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return (exp / exp.sum(axis=-1, keepdims=True)).astype(np.float32)
+
+
+def load_emotion_model(quantized=None):
+    """(tokenizer, OnnxEmotionClassifier), the ONNX counterpart of get_emotion_model"""
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_dir("emotion")), OnnxEmotionClassifier(quantized)
+
+
+def export_models(names=EXPORTED_MODELS, base_dir=None, quantize=True, local_files_only=True):
+    """
+    exports the PyTorch models to ONNX next to their tokenizers, plus a dynamically int8-quantized
+    copy, and returns {name: {filename: size_in_bytes}}
+    """
+    import torch
+    from transformers import AutoModel, AutoModelForSequenceClassification, AutoTokenizer
+
+    sources = {
+        "sentence": (SENTENCE_HUB_NAME, AutoModel, "last_hidden_state"),
+        "emotion": (EMOTION_MODEL_NAME, AutoModelForSequenceClassification, "logits"),
+    }
+    report = {}
+    for name in names:
+        hub_name, model_class, output_name = sources[name]
+        directory = model_dir(name, base_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(hub_name, local_files_only=local_files_only)
+        model = model_class.from_pretrained(hub_name, local_files_only=local_files_only)
+        model.eval()
+        tokenizer.save_pretrained(directory)
+        model.config.save_pretrained(directory)
+
+        sample = dict(tokenizer(["an example message to trace the graph"], return_tensors="pt"))
+        axes = {key: {0: "batch", 1: "sequence"} for key in sample}
+        with torch.inference_mode():
+            torch.onnx.export(
+                model, (sample,), str(directory / FP32_FILENAME),
+                input_names=list(sample), output_names=[output_name],
+                dynamic_axes={**axes, output_name: {0: "batch"}}, opset_version=14,
+            )
+        files = [FP32_FILENAME]
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(directory / FP32_FILENAME, directory / INT8_FILENAME, weight_type=QuantType.QInt8)
+            files.append(INT8_FILENAME)
+        report[name] = {filename: (directory / filename).stat().st_size for filename in files}
+    return report
+
+
+def compare_backends(texts, quantized=None):
+    """
+    runs both models on the PyTorch and the ONNX backend and returns the smallest embedding cosine
+    similarity and the largest emotion probability difference between them
+    """
+    from .empathy_utils import EmotionEngine
+    from .model_registry import _load_emotion_model, _load_sentence_model, registry
+
+    texts = list(texts)
+    torch_embeddings = _load_sentence_model("torch").encode(texts, convert_to_numpy=True)
+    onnx_embeddings = OnnxSentenceEncoder(quantized).encode(texts)
+    cosine = (torch_embeddings * onnx_embeddings).sum(axis=1) / (
+        np.linalg.norm(torch_embeddings, axis=1) * np.linalg.norm(onnx_embeddings, axis=1)
+    )
+    emotions = {}
+    for backend, model in (("torch", _load_emotion_model("torch")), ("onnx", load_emotion_model(quantized))):
+        with registry.override("emotion", model):
+            emotions[backend] = EmotionEngine().probabilities(texts)
+    return {
+        "sentence_min_cosine": float(cosine.min()),
+        "emotion_max_abs_diff": float(np.abs(emotions["torch"] - emotions["onnx"]).max()),
+    }
@@ -0,0 +1,56 @@
+# Content-addressed cache of complete analysis results. A result is keyed by the fingerprint of the
+# conversation's messages and the analysis version, so an unchanged conversation is answered from
+# the stored response without running any model, and the key doubles as the HTTP ETag.
+import hashlib
+
+from django.conf import settings
+from django.utils.http import parse_etags, quote_etag
+
+from .features import feature_version
+from .metric_registry import METRICS_VERSION
+from .models import AnalysisResult, Message
+from .utils import content_fingerprint
+
+
+def analysis_version():
+    """everything besides the messages that decides a result: metrics, stored features (with backend) and Gemini model"""
+    return f"m{METRICS_VERSION}-f{feature_version()}-{settings.GEMINI_MODEL}"
+
+
+def result_key(content_hash, version=None):
+    return hashlib.sha256(f"{version or analysis_version()}\n{content_hash}".encode("utf-8")).hexdigest()
+
+
+def conversation_fingerprint(conversation_id, chunk_size=2000):
+    """content_hash of a conversation's messages, streamed so that it costs one query and no memory"""
+    return content_fingerprint(
+        Message.objects.filter(conversation_id=conversation_id).order_by("id")
+        .values_list("sender", "message", "timestamp").iterator(chunk_size=chunk_size)
+    )
+
+
+def cached_result(content_hash):
+    """the stored api_response for this content and the current analysis version, or None"""
+    return AnalysisResult.objects.filter(result_key=result_key(content_hash)).values_list("result", flat=True).first()
+
+
+def store_result(content_hash, api_response):
+    version = analysis_version()
+    # get_or_create, a concurrent analysis of the same content may have stored it first
+    AnalysisResult.objects.get_or_create(
+        result_key=result_key(content_hash, version),
+        defaults={"content_hash": content_hash, "analysis_version": version, "result": api_response},
+    )
+
+
+def analysis_etag(content_hash, metrics=None):
+    """strong ETag of the analysis response for this content, per metric selection"""
+    key = result_key(content_hash)
+    return quote_etag(f"{key}-{'+'.join(metrics)}" if metrics else key)
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag in etags
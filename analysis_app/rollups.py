@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import AnalysisRollup, Conversation, ConversationAnalysis
+
+# ConversationAnalysis fields whose daily sums are kept
+ROLLUP_SCORES = ["clarity", "relevance", "empathy", "overall_score"]
+_SOURCE_FIELDS = ROLLUP_SCORES + ["escalation", "fallback_count", "created_at"]
+
+
+def _contribution(values):
+    contribution = {"count": 1, "escalations": int(bool(values["escalation"])), "fallbacks": int(values["fallback_count"] > 0)}
+    for name in ROLLUP_SCORES:
+        contribution[f"sum_{name}"] = values[name]
+    return contribution
+
+
+def _add(buckets, values, title, sign):
+    """adds (sign=1) or removes (sign=-1) one analysis to the deltas of its day's overall and per-title buckets"""
+    day = timezone.localtime(values["created_at"]).date()
+    for bucket_title in dict.fromkeys(["", title]):
+        deltas = buckets.setdefault((day, bucket_title), {})
+        for field, amount in _contribution(values).items():
+            deltas[field] = deltas.get(field, 0) + sign * amount
+
+
+def _write_buckets(buckets):
+    """one UPDATE per touched (day, title) bucket, creating the buckets that do not exist yet"""
+    for (day, title), deltas in buckets.items():
+        increments = {field: F(field) + amount for field, amount in deltas.items()}
+        rollup = AnalysisRollup.objects.filter(day=day, title=title)
+        if not rollup.update(**increments):
+            try:
+                with transaction.atomic():
+                    AnalysisRollup.objects.create(day=day, title=title)
+            except IntegrityError:
+                # another writer created the bucket first
+                pass
+            rollup.update(**increments)
+
+
+def _write_analyses(pending):
+    """
+    writes {conversation_id: (analytics_data, title)} in one transaction, returns the ConversationAnalysis instances
+    """
+    untitled = [conversation_id for conversation_id, (_, title) in pending.items() if title is None]
+    titles = dict(Conversation.objects.filter(id__in=untitled).values_list("id", "title")) if untitled else {}
+
+    with transaction.atomic():
+        previous = {
+            row["conversation_id"]: row
+            for row in ConversationAnalysis.objects.select_for_update().filter(conversation_id__in=list(pending))
+            .values("conversation_id", *_SOURCE_FIELDS)
+        }
+        analyses = [ConversationAnalysis(conversation_id=cid, **data) for cid, (data, _) in pending.items()]
+        # one statement per set of analysed fields, an update only overwrites the fields that were analysed
+        by_fields = {}
+        for analysis, (data, _) in zip(analyses, pending.values()):
+            by_fields.setdefault(tuple(sorted(data)), []).append(analysis)
+        for fields, group in by_fields.items():
+            ConversationAnalysis.objects.bulk_create(
+                group, update_conflicts=True, unique_fields=["conversation"], update_fields=list(fields),
+            )
+
+        buckets = {}
+        for analysis, (data, title) in zip(analyses, pending.values()):
+            title = titles.get(analysis.conversation_id, "") if title is None else title
+            old = previous.get(analysis.conversation_id)
+            if old is None:
+                current = {field: getattr(analysis, field) for field in _SOURCE_FIELDS}
+            else:
+                # an updated row keeps its created_at and the fields this analysis did not produce
+                _add(buckets, old, title, -1)
+                current = {**old, **{field: value for field, value in data.items() if field in _SOURCE_FIELDS}}
+            _add(buckets, current, title, 1)
+        _write_buckets(buckets)
+    return analyses
+
+
+class AnalysisWriter:
+    """
+    Buffers analyses and writes them batch_size (default: ANALYSIS_WRITE_BATCH_SIZE) at a time, each
+    batch in one transaction: one SELECT of the rows they replace, one bulk upsert (INSERT ... ON
+    CONFLICT (conversation_id) DO UPDATE on SQLite and PostgreSQL) and one UPDATE per touched rollup
+    bucket. Used as a context manager, whatever is still buffered is written on exit.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or getattr(settings, "ANALYSIS_WRITE_BATCH_SIZE", 500)
+        self.written = 0
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+    def add(self, conversation_id, analytics_data, title=None):
+        # a later analysis of the same conversation replaces the buffered one, an upsert cannot touch a row twice
+        self._pending[conversation_id] = (analytics_data, title)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """writes the buffered analyses, returns their ConversationAnalysis instances"""
+        if not self._pending:
+            return []
+        pending, self._pending = self._pending, {}
+        analyses = _write_analyses(pending)
+        self.written += len(analyses)
+        return analyses
+
+
+def store_analysis(conversation_id, analytics_data, title=None):
+    """
+    creates or updates the ConversationAnalysis of a conversation and moves the rollups by the difference
+    """
+    return _write_analyses({conversation_id: (analytics_data, title)})[0]
+
+
+@transaction.atomic
+def rebuild_rollups():
+    """recomputes every rollup from the ConversationAnalysis table, for backfills and repairs"""
+    AnalysisRollup.objects.all().delete()
+    buckets = {}
+    rows = ConversationAnalysis.objects.annotate(title=F("conversation__title")).values(*_SOURCE_FIELDS, "title")
+    for values in rows.iterator(chunk_size=2000):
+        _add(buckets, values, values["title"], 1)
+    _write_buckets(buckets)
+
+
+def _summarise(count, sums):
+    summary = {"count": count}
+    for name in ROLLUP_SCORES:
+        summary[f"avg_{name}"] = round(sums[f"sum_{name}"] / count, 3) if count else None
+    summary["escalation_rate"] = round(sums["escalations"] / count, 3) if count else None
+    summary["fallback_rate"] = round(sums["fallbacks"] / count, 3) if count else None
+    return summary
+
+
+def rollup_summary(start, end, title=""):
+    """
+    daily averages and rates between start and end (inclusive) read only from the rollup table,
+    so the cost depends on the number of days and not on the number of analyses
+    """
+    fields = ["count", "escalations", "fallbacks"] + [f"sum_{name}" for name in ROLLUP_SCORES]
+    rollups = AnalysisRollup.objects.filter(day__gte=start, day__lte=end, title=title).order_by("day")
+    days = [{"day": row["day"], **_summarise(row["count"], row)} for row in rollups.values("day", *fields)]
+    totals = rollups.aggregate(**{field: Sum(field) for field in fields})
+    return {"days": days, "totals": _summarise(totals["count"] or 0, totals)}
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.db import transaction
-from .models import Conversation, Message, ConversationAnalysis
+from .metric_registry import METRICS
+from .models import AnalysisJob, Conversation, Message, ConversationAnalysis
 
 # Serializer for ConversationAnalysis
 class ConversationAnalysisSerializer(serializers.ModelSerializer):
@@ -14,6 +15,70 @@ class ConversationAnalysisSerializer(serializers.ModelSerializer):
             'sentiment', 'empathy', 'fallback_count', 'resolution', 'escalation', 'response_time', 'overall_score', 'created_at'
         ]
 
+class AnalysisFilterSerializer(serializers.Serializer):
+    """
+    validates the query parameters of GET /api/analyses/ and applies them to a queryset
+    """
+    SCORE_FIELDS = ['clarity', 'relevance', 'accuracy', 'completeness', 'empathy', 'overall_score', 'response_time']
+
+    escalation = serializers.BooleanField(required=False, allow_null=True, default=None)
+    sentiment = serializers.CharField(max_length=20, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in self.SCORE_FIELDS:
+            fields[f'min_{name}'] = serializers.FloatField(required=False)
+            fields[f'max_{name}'] = serializers.FloatField(required=False)
+        return fields
+
+    def filter_queryset(self, queryset):
+        data = self.validated_data
+        lookups = {}
+        for name in self.SCORE_FIELDS:
+            if f'min_{name}' in data:
+                lookups[f'{name}__gte'] = data[f'min_{name}']
+            if f'max_{name}' in data:
+                lookups[f'{name}__lte'] = data[f'max_{name}']
+        if data.get('escalation') is not None:
+            lookups['escalation'] = data['escalation']
+        if 'sentiment' in data:
+            lookups['sentiment'] = data['sentiment'].lower()
+        if 'created_after' in data:
+            lookups['created_at__gte'] = data['created_after']
+        if 'created_before' in data:
+            lookups['created_at__lt'] = data['created_before']
+        return queryset.filter(**lookups)
+
+class RollupSummaryQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    title = serializers.CharField(max_length=255, required=False, allow_blank=True, default="")
+
+    def validate(self, attrs):
+        if attrs.get('start') and attrs.get('end') and attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("start must not be after end.")
+        return attrs
+
+class MetricSelectionSerializer(serializers.Serializer):
+    """
+    validates ?metrics=sentiment,clarity on the analysis endpoint, a comma-separated subset of the
+    metric_registry names
+    """
+    metrics = serializers.CharField(required=False)
+
+    def validate_metrics(self, value):
+        names = list(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        if not names:
+            raise serializers.ValidationError("Select at least one metric.")
+        unknown = [name for name in names if name not in METRICS]
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown metrics: {', '.join(unknown)}. Available: {', '.join(METRICS)}."
+            )
+        return names
+
 class MessageSerializer(serializers.Serializer):
     sender = serializers.ChoiceField(choices=['user', 'ai'])
     message = serializers.CharField(max_length=500)
@@ -40,8 +105,15 @@ class ConversationUploadSerializer(serializers.Serializer):
         # create Conversation 
         conversation = Conversation.objects.create(title=title)
 
+        messages = Message.objects.bulk_create(self.build_messages(conversation, messages_data))
+        conversation.count_messages(messages)
+        conversation.save(update_fields=Conversation.COUNTER_FIELDS)
+        return conversation
+
+    @staticmethod
+    def build_messages(conversation, messages_data):
         # preapre message objects
-        message_objects = [
+        return [
             Message(
                 conversation=conversation,
                 sender=message['sender'].lower(),
@@ -51,11 +123,39 @@ class ConversationUploadSerializer(serializers.Serializer):
             for message in messages_data
         ]
 
-        Message.objects.bulk_create(message_objects)
-        return conversation
-
 class ConversationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Conversation
         fields = ['id', 'title', 'created_at']
 
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    conversation_id = serializers.IntegerField(source='conversation.id', read_only=True)
+
+    class Meta:
+        model = AnalysisJob
+        fields = [
+            'id', 'conversation_id', 'status', 'stage', 'progress', 'result', 'error',
+            'created_at', 'started_at', 'finished_at'
+        ]
+
+class ConversationMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Message
+        fields = ['sender', 'message', 'timestamp']
+
+class ConversationListSerializer(serializers.ModelSerializer):
+    # the counters are stored on the conversation, messages come from a per-page prefetch
+    messages = ConversationMessageSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Conversation
+        fields = [
+            'id', 'title', 'created_at', 'message_count', 'user_message_count', 'ai_message_count',
+            'last_message_at', 'messages',
+        ]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.context.get('include_messages', True):
+            fields.pop('messages')
+        return fields
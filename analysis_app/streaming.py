@@ -0,0 +1,174 @@
+from collections import deque
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+
+from .empathy_utils import EmotionEngine, _empathy_label, empathy_values
+from .features import ConversationFeatures, ensure_message_features
+from .gemini_utils import TranscriptWindow
+from .model_registry import get_gemini_model
+from .models import Message
+from .utils import (
+    _clarity_label, _completeness_label, _fallback_label, _relevance_label, _response_label, _satisfaction_label,
+    _sentiment_label, clarity_values, completeness_values, compute_escalation_need, content_fingerprint,
+    is_fallback, response_seconds, satisfaction_values, sentiment_values,
+)
+
+
+class _Mean:
+    """running mean over any number of value batches"""
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.total += float(values.sum())
+        self.count += len(values)
+
+    def mean(self, default=0.0):
+        return self.total / self.count if self.count else default
+
+
+def _message_chunks(conversation, chunk_size):
+    rows = Message.objects.filter(conversation=conversation).order_by("timestamp", "id") \
+        .values("id", "sender", "message", "timestamp").iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def stream_conversation_analysis(conversation, trace, chunk_size=None, emotion_engine=None, progress=None):
+    """
+    Same result as get_conversation_analysis, computed over messages read from the database in
+    timestamp order, chunk_size at a time. User and AI turns are paired in one pass (the n-th user
+    message with the n-th AI message, like split_messages) and every metric keeps a running
+    accumulator, so memory depends on the chunk size rather than on the length of the conversation.
+    Gemini scores a TranscriptWindow of the first and last turns. The emotion engine is cleared
+    after every chunk. Runs inside the AnalysisTrace opened by get_conversation_analysis.
+    """
+    chunk_size = chunk_size or getattr(settings, "ANALYSIS_STREAM_CHUNK_SIZE", 500)
+    report = progress or (lambda stage, fraction: None)
+    total = Message.objects.filter(conversation=conversation).count()
+    engine = emotion_engine or EmotionEngine()
+
+    sentiment, clarity, relevance, completeness = _Mean(), _Mean(), _Mean(), _Mean()
+    empathy, satisfaction, response_time = _Mean(), _Mean(), _Mean()
+    ai_count = fallback_count = seen = 0
+    window = TranscriptWindow(getattr(settings, "GEMINI_MAX_TRANSCRIPT_PAIRS", 0))
+    # unpaired turns with their features, only grows while one side runs ahead of the other
+    waiting_users, waiting_ais, waiting_features = deque(), deque(), {}
+
+    for chunk in _message_chunks(conversation, chunk_size):
+        seen += len(chunk)
+        report("streaming", 0.9 * seen / max(total, 1))
+        messages = [m for m in chunk if m["message"].strip() != ""]
+        user_messages = [m for m in messages if m["sender"] == "user"]
+        ai_messages = [m for m in messages if m["sender"] == "ai"]
+        features = trace.call("features", ensure_message_features, user_messages + ai_messages, engine)
+        lexical = ConversationFeatures(messages, features).lexical()
+
+        user_texts = [m["message"] for m in user_messages]
+        ai_texts = [m["message"] for m in ai_messages]
+        if user_texts:
+            sentiment.add(trace.call("sentiment", sentiment_values, user_texts, lexical))
+        clarity.add(trace.call("clarity", clarity_values, ai_texts, lexical))
+        ai_count += len(ai_messages)
+        fallback_count += trace.call("fallback", lambda: sum(1 for text in ai_texts if is_fallback(text)))
+
+        waiting_users.extend(user_messages)
+        waiting_ais.extend(ai_messages)
+        waiting_features.update(features)
+        pair_messages = []
+        while waiting_users and waiting_ais:
+            pair_messages.append((waiting_users.popleft(), waiting_ais.popleft()))
+        if pair_messages:
+            paired = [m for pair in pair_messages for m in pair]
+            pair_features = ConversationFeatures(paired, {m["id"]: waiting_features.pop(m["id"]) for m in paired})
+            pairs = [(u["message"], a["message"]) for u, a in pair_messages]
+            similarities = trace.call("relevance", pair_features.similarities, pairs)
+            relevance.add(similarities)
+            completeness.add(trace.call("completeness", completeness_values, pairs, similarities, pair_features.parsed()))
+            empathy.add(trace.call("empathy", empathy_values, pairs, pair_features.emotion_engine()))
+            satisfaction.add(trace.call("satisfaction", satisfaction_values, pairs, pair_features.lexical()))
+            response_time.add([
+                diff for diff in (response_seconds(u, a) for u, a in pair_messages) if diff is not None
+            ])
+            for pair in pairs:
+                window.add(pair)
+        engine.clear()
+
+    if not sentiment.count or not ai_count:
+        return None, {"error": "Insufficient data for analysis"}
+
+    report("accuracy", 0.9)
+    # at least one user and one AI message, so the window holds at least one pair
+    accuracy_score, accuracy_label = trace.call("accuracy", get_gemini_model().score, window)
+    content_hash = content_fingerprint(
+        Message.objects.filter(conversation=conversation).order_by("id")
+        .values_list("sender", "message", "timestamp").iterator(chunk_size=chunk_size)
+    )
+
+    sentement_count = sentiment.mean()
+    relevance_score = relevance.mean()
+    clarity_score = clarity.mean(default=0)
+    completeness_score = completeness.mean()
+    empathy_score = round(empathy.mean(), 3)
+    fallback_freq = round(fallback_count / ai_count, 3)
+    resolution_rate = round(relevance.mean(), 3)
+    _, escalation_need = compute_escalation_need(sentement_count, completeness_score, accuracy_score, fallback_freq, resolution_rate)
+    response_seconds_avg = response_time.mean()
+    user_satisfaction_score = round(satisfaction.mean(), 3)
+
+    labels = {
+        "sentiment": _sentiment_label(sentement_count),
+        "relevance": _relevance_label(relevance_score) if relevance.count else "low",
+        "clarity": _clarity_label(clarity_score),
+        "completeness": _completeness_label(completeness_score) if completeness.count else "incomplete",
+        "empathy": _empathy_label(empathy.mean()) if empathy.count else "low",
+        "fallback": _fallback_label(fallback_count / ai_count),
+        "response": _response_label(response_seconds_avg),
+        "satisfaction": _satisfaction_label(satisfaction.mean()) if satisfaction.count else "low",
+    }
+    analytics_data = {
+        "clarity": clarity_score,
+        "relevance": relevance_score,
+        "accuracy": accuracy_score,
+        "completeness": completeness_score,
+        "sentiment": labels["sentiment"],
+        "empathy": empathy_score,
+        "fallback_count": fallback_freq,
+        "resolution": bool(resolution_rate),
+        "escalation": bool(escalation_need),
+        "response_time": round(response_seconds_avg, 2),
+        "overall_score": user_satisfaction_score,
+        "content_hash": content_hash,
+    }
+    api_response = {
+        "analytics": analytics_data,
+        "sentiment_score": sentement_count,
+        "sentiment_label": labels["sentiment"],
+        "relevance_score": relevance_score,
+        "relevance_label": labels["relevance"],
+        "clarity_score": clarity_score,
+        "clarity_label": labels["clarity"],
+        "completeness_score": completeness_score,
+        "completeness_label": labels["completeness"],
+        "accuracy_score": accuracy_score,
+        "accuracy_label": accuracy_label,
+        "empathy_score": empathy_score,
+        "empathy_label": labels["empathy"],
+        "fallback_frequency": fallback_freq,
+        "fallback_label": labels["fallback"],
+        "resolution_rate": resolution_rate,
+        "escalation_need": escalation_need,
+        "response_time": round(response_seconds_avg, 2),
+        "response_label": labels["response"],
+        "user_satisfaction_score": user_satisfaction_score,
+        "user_satisfaction_label": labels["satisfaction"],
+    }
+    return analytics_data, api_response
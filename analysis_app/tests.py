@@ -1,3 +1,1236 @@
-from django.test import TestCase
+import importlib.util
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.test import AsyncClient, AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import async_views
+from .cron import pending_conversation_ids, run_daily_analysis
+from .gemini_utils import GeminiAccuracyClient, TranscriptWindow
+from .instrumentation import AnalysisTrace, count_model_call, metrics, record_failure
+from .ingest import ingest_jsonl, refresh_conversation_counters
+from .jobs import claim_next_job, run_job
+from .features import MessageFeatureRow, ensure_message_features
+from .models import AnalysisJob, AnalysisResult, AnalysisRollup, Conversation, ConversationAnalysis, GeminiResponse, Message, MessageFeatures
+from .result_cache import analysis_version, conversation_fingerprint
+from .rollups import AnalysisWriter, rebuild_rollups, store_analysis
+from .lexical_utils import LexicalFeatures
+from .utils import (
+    analyze_sentiment, compute_clarity, compute_user_satisfaction, content_fingerprint, get_conversation_analysis,
+    pair_similarities,
+)
+
+
+class PairSimilaritiesTests(SimpleTestCase):
+    def test_matches_rowwise_cosine(self):
+        rng = np.random.default_rng(0)
+        user_embs = rng.normal(size=(5, 8)).astype(np.float32)
+        ai_embs = rng.normal(size=(5, 8)).astype(np.float32)
+        expected = [
+            float(np.dot(u, a) / (np.linalg.norm(u) * np.linalg.norm(a)))
+            for u, a in zip(user_embs, ai_embs)
+        ]
+        np.testing.assert_allclose(pair_similarities(user_embs, ai_embs), expected, rtol=1e-5)
+
+    def test_zero_vectors_and_empty_input(self):
+        sims = pair_similarities(np.zeros((1, 4)), np.ones((1, 4)))
+        self.assertEqual(sims.tolist(), [0.0])
+        self.assertEqual(len(pair_similarities(np.zeros((0, 4)), np.zeros((0, 4)))), 0)
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def test_loader_runs_once_under_concurrent_access(self):
+        import threading
+        from .model_registry import ModelRegistry
+
+        calls = []
+        registry = ModelRegistry()
+        registry.register("dummy", lambda: calls.append(1) or object())
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get("dummy"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({id(result) for result in results}), 1)
+        report = registry.report()["models"][0]
+        self.assertTrue(report["loaded"])
+        self.assertIsNotNone(report["load_seconds"])
+
+    def test_override_restores_previous_state(self):
+        from .model_registry import ModelRegistry
+
+        registry = ModelRegistry()
+        registry.register("dummy", object)
+        stub = object()
+        with registry.override("dummy", stub):
+            self.assertIs(registry.get("dummy"), stub)
+        self.assertFalse(registry.is_loaded("dummy"))
+        self.assertIsNot(registry.get("dummy"), stub)
+
+
+class _StubTokenizer:
+    """one token per word, padded with zeros"""
+
+    def __call__(self, texts, truncation=True, max_length=512):
+        ids = [list(range(1, len(text.split()) + 1))[:max_length] for text in texts]
+        return {"input_ids": ids, "attention_mask": [[1] * len(row) for row in ids]}
+
+    def pad(self, encodings, return_tensors="np"):
+        width = max(len(row) for row in encodings["input_ids"])
+        return {key: np.array([row + [0] * (width - len(row)) for row in rows]) for key, rows in encodings.items()}
+
+
+class EmotionEngineTests(SimpleTestCase):
+    def setUp(self):
+        from .model_registry import registry
+        from .onnx_backend import OnnxEmotionClassifier
+
+        self.batches = []
+
+        class StubClassifier(OnnxEmotionClassifier):
+            # the probability of the first class is the token count, so rows can be traced to their text
+            def __init__(stub):
+                pass
+
+            def probabilities(stub, batch):
+                lengths = batch["attention_mask"].sum(axis=1)
+                self.batches.append(list(lengths))
+                return np.stack([lengths, np.full(len(lengths), batch["input_ids"].shape[1])], axis=1).astype(np.float32)
+
+        override = registry.override("emotion", (_StubTokenizer(), StubClassifier()))
+        override.__enter__()
+        self.addCleanup(override.__exit__, None, None, None)
+
+    def test_length_sorted_batches_return_rows_in_input_order(self):
+        from .empathy_utils import EmotionEngine
+
+        texts = ["a b c d e", "a", "a b c", "a b", "a b c d", "a b c d e f"]
+        probs = EmotionEngine(batch_size=2).probabilities(texts)
+
+        self.assertEqual(list(probs[:, 0]), [5, 1, 3, 2, 4, 6])
+        # sorted by length, so every batch is padded to its own longest text only
+        self.assertEqual(self.batches, [[1, 2], [3, 4], [5, 6]])
+        self.assertEqual(list(probs[:, 1]), [6, 2, 4, 2, 4, 6])
+
+    def test_repeated_texts_run_through_the_model_once(self):
+        from .empathy_utils import EmotionEngine
+
+        engine = EmotionEngine(batch_size=8)
+        first = engine.probabilities(["a b", "a", "a b"])
+        second = engine.probabilities(["a", "a b c", "a b"])
+
+        self.assertEqual(self.batches, [[1, 2], [3]])
+        np.testing.assert_array_equal(first[0], first[2])
+        np.testing.assert_array_equal(second[2], first[0])
+
+
+class LexicalFeaturesTests(SimpleTestCase):
+    def test_shared_engine_matches_the_per_message_scores(self):
+        import textstat
+        from .management.commands.bench_lexical import engine_scores, per_message_scores, synthetic_pairs
+
+        try:
+            textstat.flesch_reading_ease("A short sentence.")
+        except LookupError:
+            self.skipTest("needs the NLTK cmudict corpus, run nltk.download('cmudict')")
+        pairs = synthetic_pairs(20, 12) + [
+            ("This is terrible, my card was charged twice!", "I'm sorry about that. The refund is on its way."),
+            ("Thanks, great help", "You're welcome! Happy to help."),
+            ("Thanks, great help", "Is there anything else I can do?"),
+        ]
+        for expected, actual in zip(per_message_scores(pairs), engine_scores(pairs)):
+            self.assertAlmostEqual(expected, actual, places=9)
+
+        # without a shared engine each metric scores its own texts, with the same result
+        user_messages = [{"message": u} for u, _ in pairs]
+        ai_messages = [{"message": a} for _, a in pairs]
+        self.assertEqual(
+            (analyze_sentiment(user_messages), compute_clarity(ai_messages), compute_user_satisfaction(pairs)),
+            (
+                analyze_sentiment(user_messages, LexicalFeatures(u for u, _ in pairs)),
+                compute_clarity(ai_messages, LexicalFeatures(a for _, a in pairs)),
+                compute_user_satisfaction(pairs, LexicalFeatures([t for pair in pairs for t in pair])),
+            ),
+        )
+
+
+class _StubDoc:
+    """a spaCy Doc stand-in: words longer than four letters are nouns, capitalised ones root a noun chunk"""
+
+    def __init__(self, text):
+        self.tokens = [
+            SimpleNamespace(text=word, pos_="NOUN" if len(word) > 4 else "DET", is_stop=word.lower() in ("there", "about"))
+            for word in text.replace(".", " . ").split()
+        ]
+        self.noun_chunks = [SimpleNamespace(root=token) for token in self.tokens if token.text[:1].isupper()]
+        self.sents = [sentence for sentence in text.split(".") if sentence.strip()]
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+
+class _StubNlp:
+    def __init__(self):
+        self.piped = []
+        self.pipe_kwargs = []
+
+    def __call__(self, text):
+        return _StubDoc(text)
+
+    def pipe(self, texts, batch_size=64, n_process=1):
+        self.pipe_kwargs.append({"n_process": n_process})
+        for text in texts:
+            self.piped.append(text)
+            yield _StubDoc(text)
+
+
+class ParseTextsTests(SimpleTestCase):
+    def test_each_unique_text_is_parsed_once_like_the_two_parse_path(self):
+        from .model_registry import registry
+        from .utils import parse_texts
+
+        def old_keyphrases(text):
+            # compute_completeness before parse_texts: one nlp() call for the keyphrases, one for the sentences
+            doc = nlp(text)
+            keyphrases = {chunk.root.text.lower() for chunk in doc.noun_chunks}
+            keyphrases |= {token.text.lower() for token in doc if token.pos_ in ["VERB", "NOUN"] and not token.is_stop}
+            return keyphrases, len(list(nlp(text).sents))
+
+        nlp = _StubNlp()
+        texts = ["Where is my parcel. It left Monday", "Refunds take about five days", "Where is my parcel. It left Monday"]
+        with registry.override("spacy", nlp), self.settings(SPACY_N_PROCESS=4):
+            parsed = parse_texts(texts)
+
+        self.assertEqual(nlp.piped, texts[:2])
+        # the nightly setting does not start a process pool on the request path
+        self.assertEqual(nlp.pipe_kwargs, [{"n_process": 1}])
+        self.assertEqual(parsed, {text: old_keyphrases(text) for text in texts})
+        self.assertEqual(parsed[texts[0]][1], 2)
+
+
+class LazyImportTests(SimpleTestCase):
+    def test_views_import_does_not_load_ml_libraries(self):
+        import subprocess
+        import sys
+        from django.conf import settings
+
+        snippet = (
+            "import os, sys\n"
+            "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'post_analysis_main.settings')\n"
+            "import django\n"
+            "django.setup()\n"
+            "import analysis_app.views, analysis_app.cron\n"
+            "heavy = {'torch', 'spacy', 'transformers', 'sentence_transformers', 'textblob'}\n"
+            "print(sorted(heavy & set(sys.modules)))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", snippet], cwd=settings.BASE_DIR, capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+class IncrementalAnalysisTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title="billing")
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender="user", message="My invoice is wrong"),
+            Message(conversation=self.conversation, sender="ai", message="Let me check that for you"),
+        ])
+
+    def _store_current_fingerprint(self):
+        rows = Message.objects.filter(conversation=self.conversation).order_by("id").values_list("sender", "message", "timestamp")
+        ConversationAnalysis.objects.create(
+            conversation=self.conversation, content_hash=content_fingerprint(rows), analysis_version=analysis_version()
+        )
+
+    def test_unanalysed_conversation_is_pending(self):
+        self.assertEqual(pending_conversation_ids(), [self.conversation.id])
+
+    def test_unchanged_conversation_is_skipped(self):
+        self._store_current_fingerprint()
+        self.assertEqual(pending_conversation_ids(), [])
+        self.assertEqual(pending_conversation_ids(full=True), [self.conversation.id])
+        summary = run_daily_analysis()
+        self.assertEqual(summary, {"conversations": 1, "analysed": 0, "skipped": 1})
+
+    def test_new_message_marks_conversation_changed(self):
+        self._store_current_fingerprint()
+        Message.objects.create(conversation=self.conversation, sender="user", message="Any update?")
+        self.assertEqual(pending_conversation_ids(), [self.conversation.id])
+
+    def test_stored_fingerprints_skip_the_message_scan(self):
+        self._store_current_fingerprint()
+        # the first run hashes the bulk-created messages once and stores the hash on the conversation
+        self.assertEqual(pending_conversation_ids(), [])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.content_hash, ConversationAnalysis.objects.get().content_hash)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(pending_conversation_ids(), [])
+        self.assertFalse([q for q in queries.captured_queries if '"analysis_app_message"' in q["sql"]])
+
+        Message.objects.create(conversation=self.conversation, sender="user", message="Any update?")
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.content_hash, "")
+        self.assertEqual(pending_conversation_ids(), [self.conversation.id])
+
+    def test_new_analysis_version_marks_conversation_changed(self):
+        self._store_current_fingerprint()
+        with self.settings(GEMINI_MODEL="gemini-next"):
+            self.assertEqual(pending_conversation_ids(), [self.conversation.id])
+
+
+class _StubGeminiHandler(BaseHTTPRequestHandler):
+    """answers generateContent requests with the statuses queued on the server, then with a fixed score"""
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers["Content-Length"]))
+        with server.lock:
+            server.requests += 1
+            server.seen.append((self.path, self.headers.get("x-goog-api-key")))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(server.delay)
+        body = {"candidates": [{"content": {"parts": [{"text": '{"score": 0.9, "label": "Accurate"}'}]}}]}
+        payload = json.dumps(body if status == 200 else {"error": status}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        with server.lock:
+            server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+class GeminiAccuracyClientTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StubGeminiHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = self.server.in_flight = self.server.max_in_flight = 0
+        self.server.statuses = []
+        self.server.seen = []
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = GeminiAccuracyClient(
+            api_base=f"http://127.0.0.1:{self.server.server_port}",
+            max_concurrency=2, rate_per_second=1000, burst=1000, timeout=5, max_retries=2, backoff=0,
+        )
+        self.pairs = [("What is my balance?", "Your balance is 10 dollars.")]
+
+    @override_settings(GEMINI_RATE_PER_SECOND=2.0, GEMINI_BURST=4, GEMINI_MAX_CONCURRENCY=4)
+    def test_worker_processes_share_the_limits(self):
+        from .model_registry import _load_gemini_model, registry
+        from .workers import share_gemini_limits
+        self.addCleanup(registry.register, "gemini", _load_gemini_model)
+        share_gemini_limits(3)
+        client = registry.get("gemini")
+        self.addCleanup(registry._instances.pop, "gemini", None)
+        self.assertAlmostEqual(client.bucket.rate * 3, 2.0)
+        self.assertEqual((client.bucket.capacity, client.max_concurrency), (1, 1))
+        single = GeminiAccuracyClient.from_settings()
+        self.assertEqual((single.bucket.rate, single.bucket.capacity, single.max_concurrency), (2.0, 4, 4))
+
+    def test_responses_are_cached_by_prompt(self):
+        self.assertEqual(self.client.score(self.pairs), (0.9, "accurate"))
+        self.assertEqual(self.client.score(self.pairs), (0.9, "accurate"))
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(GeminiResponse.objects.count(), 1)
+
+    def test_retryable_errors_are_retried(self):
+        self.server.statuses = [503, 429]
+        self.assertEqual(self.client.score(self.pairs), (0.9, "accurate"))
+        self.assertEqual(self.server.requests, 3)
+
+    def test_failures_are_not_cached(self):
+        self.server.statuses = [400]
+        self.assertEqual(self.client.score(self.pairs), (0.0, "inaccurate"))
+        self.assertFalse(GeminiResponse.objects.exists())
+
+    def test_api_key_is_sent_in_a_header_and_never_logged(self):
+        self.client.api_key = "SECRET-KEY-123"
+        self.server.statuses = [503, 400]
+        with self.assertLogs("analysis_app.gemini_utils", level="WARNING") as logs:
+            self.assertEqual(self.client.score(self.pairs), (0.0, "inaccurate"))
+            unreachable = GeminiAccuracyClient(
+                api_key="SECRET-KEY-123", api_base="http://127.0.0.1:1", max_retries=0, timeout=1,
+            )
+            self.assertEqual(unreachable.score([("other", "pair")]), (0.0, "inaccurate"))
+
+        self.assertEqual(self.server.seen[0][1], "SECRET-KEY-123")
+        self.assertNotIn("SECRET", self.server.seen[0][0])
+        output = "\n".join(logs.output)
+        self.assertIn("HTTP 400", output)
+        self.assertIn("ConnectionError", output)
+        self.assertNotIn("SECRET-KEY-123", output)
+        self.assertNotIn("127.0.0.1", output)
+
+    def test_concurrency_is_bounded(self):
+        self.server.delay = 0.05
+        conversations = [[(f"question {i}", f"answer {i}")] for i in range(6)]
+        self.assertEqual(self.client.score_many(conversations), [(0.9, "accurate")] * 6)
+        self.assertEqual(self.server.requests, 6)
+        self.assertLessEqual(self.server.max_in_flight, 2)
+
+
+class AnalysisJobTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.conversation = Conversation.objects.create(title="shipping")
+
+    def test_post_enqueues_job(self):
+        response = self.client.post(f"/api/analysis/{self.conversation.id}/")
+        self.assertEqual(response.status_code, 202)
+        job = AnalysisJob.objects.get(id=response.data["job_id"])
+        self.assertEqual(job.status, AnalysisJob.QUEUED)
+
+        status_response = self.client.get(response.data["status_url"])
+        self.assertEqual(status_response.status_code, 200)
+        self.assertEqual(status_response.data["status"], "queued")
+        self.assertEqual(status_response.data["conversation_id"], self.conversation.id)
+
+    def test_unknown_job_returns_404(self):
+        self.assertEqual(self.client.get("/api/analysis/jobs/999/").status_code, 404)
+
+    def test_job_is_claimed_once(self):
+        AnalysisJob.objects.create(conversation=self.conversation)
+        self.assertEqual(claim_next_job().status, AnalysisJob.RUNNING)
+        self.assertIsNone(claim_next_job())
+
+    def test_jobs_of_crashed_workers_are_requeued_then_failed(self):
+        job = AnalysisJob.objects.create(conversation=self.conversation)
+        for attempt in range(1, 4):
+            self.assertEqual(claim_next_job().id, job.id)
+            # the worker dies without reporting back, a live job is left alone until its heartbeat is stale
+            self.assertIsNone(claim_next_job())
+            AnalysisJob.objects.filter(id=job.id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (AnalysisJob.RUNNING, attempt))
+
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_run_job_stores_result(self):
+        job = AnalysisJob.objects.create(conversation=self.conversation)
+        analytics = {"clarity": 0.5, "content_hash": "abc", "analysis_version": "v"}
+
+        def fake_analysis(conversation, progress=None, trace=None):
+            progress("embeddings", 0.1)
+            return analytics, {"analytics": analytics}
+
+        with mock.patch("analysis_app.jobs.get_conversation_analysis", side_effect=fake_analysis):
+            run_job(claim_next_job())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.DONE)
+        self.assertEqual(job.progress, 1.0)
+        self.assertEqual(job.result, {"analytics": analytics})
+        self.assertEqual(ConversationAnalysis.objects.get(conversation=self.conversation).clarity, 0.5)
+
+
+class BulkIngestTests(TestCase):
+    def _line(self, title, messages):
+        return json.dumps({"title": title, "messages": messages})
+
+    def test_bulk_upload_reports_each_line(self):
+        message = {"sender": "user", "message": "Hello", "timestamp": "2025-01-01T10:00:00Z"}
+        reply = {"sender": "ai", "message": " Hi there ", "timestamp": "2025-01-01T10:00:02Z"}
+        body = "\n".join([
+            self._line("first", [message, reply]),
+            "{not json",
+            self._line("bad sender", [{**message, "sender": "bot"}]),
+            "",
+            self._line("second", [message]),
+        ])
+        response = APIClient().post(
+            "/api/conversation/bulk/?batch_size=1", data=body, content_type="application/x-ndjson"
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual(response.data["failed"], 2)
+        self.assertEqual([entry["line"] for entry in response.data["lines"]], [1, 2, 3, 5])
+        self.assertEqual([entry["status"] for entry in response.data["lines"]], ["ok", "error", "error", "ok"])
+        first = Conversation.objects.get(title="first")
+        self.assertEqual(
+            list(first.messages.order_by("id").values_list("sender", "message")),
+            [("user", "Hello"), ("ai", "Hi there")],
+        )
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_invalid_utf8_line_is_reported_and_ingest_continues(self):
+        message = {"sender": "user", "message": "Hello", "timestamp": "2025-01-01T10:00:00Z"}
+        body = b"\n".join([
+            self._line("first", [message]).encode(),
+            b'{"title": "caf\xe9", "messages": []}',
+            self._line("second", [message]).encode(),
+        ])
+        response = APIClient().post("/api/conversation/bulk/", data=body, content_type="application/x-ndjson")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual([entry["status"] for entry in response.data["lines"]], ["ok", "error", "ok"])
+        self.assertIn("encoding", response.data["lines"][1]["errors"])
+
+
+class ConversationListingTests(TestCase):
+    def setUp(self):
+        # through the ingest path, which keeps the stored message counters
+        list(ingest_jsonl(
+            json.dumps({"title": f"conversation {i}", "messages": [
+                {"sender": "user", "message": f"question {i}", "timestamp": "2024-01-01T00:00:00Z"},
+                {"sender": "ai", "message": f"answer {i}", "timestamp": "2024-01-01T00:00:05Z"},
+            ]})
+            for i in range(5)
+        ))
+        self.client = APIClient()
+
+    def test_listing_query_count_does_not_grow_with_page_size(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/conversation/?page_size=5")
+        self.assertEqual(len(response.data["results"]), 5)
+        first = response.data["results"][0]
+        self.assertEqual((first["message_count"], first["user_message_count"], first["ai_message_count"]), (2, 1, 1))
+        self.assertIsNotNone(first["last_message_at"])
+        self.assertEqual([m["sender"] for m in first["messages"]], ["user", "ai"])
+
+    def test_listing_without_messages_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/conversation/?include_messages=0")
+        self.assertNotIn("messages", response.data["results"][0])
+        self.assertEqual(response.data["results"][0]["message_count"], 2)
+
+    def test_cursor_pagination_walks_every_conversation(self):
+        seen = []
+        url = "/api/conversation/?page_size=2&include_messages=0"
+        while url:
+            response = self.client.get(url)
+            seen.extend(item["id"] for item in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(seen, list(Conversation.objects.order_by("id").values_list("id", flat=True)))
+
+
+class MessageIndexTests(TestCase):
+    def test_conversation_counters_follow_ingest_and_refresh(self):
+        response = APIClient().post("/api/conversation/", {"title": "t", "messages": [
+            {"sender": "user", "message": "hi", "timestamp": "2024-01-01T00:00:00Z"},
+            {"sender": "ai", "message": "hello", "timestamp": "2024-01-01T00:00:01Z"},
+            {"sender": "user", "message": "bye", "timestamp": "2024-01-01T00:00:02Z"},
+        ]}, format="json")
+        conversation = Conversation.objects.get(id=response.data["id"])
+        self.assertEqual((conversation.message_count, conversation.user_message_count, conversation.ai_message_count), (3, 2, 1))
+        self.assertEqual(conversation.last_message_at, Message.objects.filter(conversation=conversation).latest("timestamp").timestamp)
+
+        # messages written outside the ingest paths are picked up by a refresh
+        Message.objects.create(conversation=conversation, sender="ai", message="anything else?")
+        refresh_conversation_counters(Conversation.objects.filter(id=conversation.id))
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.message_count, conversation.ai_message_count), (4, 2))
+
+    def test_ingest_stores_the_content_hash(self):
+        response = APIClient().post("/api/conversation/", {"title": "t", "messages": [
+            {"sender": "user", "message": "hi", "timestamp": "2024-01-01T02:00:00+02:00"},
+            {"sender": "ai", "message": "hello", "timestamp": "2024-01-01T02:00:01+02:00"},
+        ]}, format="json")
+        conversation = Conversation.objects.get(id=response.data["id"])
+        # hashed from the posted (non-UTC) values, it matches a hash of the stored rows
+        self.assertEqual(conversation.content_hash, conversation_fingerprint(conversation.id))
+
+    @skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN output is SQLite's")
+    def test_message_reads_use_the_conversation_index(self):
+        index = Message._meta.indexes[0].name
+        plan = Message.objects.filter(conversation_id=1).order_by("timestamp").explain()
+        self.assertIn(index, plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+        # the analysis reads in id order, which the conversation indexes serve without a sort as well
+        plan = Message.objects.filter(conversation_id=1).order_by("id").values("id", "sender", "message", "timestamp").explain()
+        self.assertIn("USING INDEX", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class AnalysesListingTests(TestCase):
+    def setUp(self):
+        for i, (score, escalation, sentiment) in enumerate([(0.2, True, "negative"), (0.6, False, "neutral"), (0.9, False, "positive")]):
+            conversation = Conversation.objects.create(title=f"conversation {i}")
+            ConversationAnalysis.objects.create(
+                conversation=conversation, overall_score=score, escalation=escalation, sentiment=sentiment
+            )
+        self.client = APIClient()
+
+    def test_filters(self):
+        response = self.client.get("/api/analyses/?min_overall_score=0.5&escalation=false")
+        self.assertEqual([r["overall_score"] for r in response.data["results"]], [0.6, 0.9])
+        response = self.client.get("/api/analyses/?sentiment=negative")
+        self.assertEqual([r["conversation_title"] for r in response.data["results"]], ["conversation 0"])
+
+    def test_invalid_filter_is_rejected(self):
+        self.assertEqual(self.client.get("/api/analyses/?min_clarity=high").status_code, 400)
+
+    def test_keyset_pagination(self):
+        response = self.client.get("/api/analyses/?page_size=2")
+        self.assertEqual(len(response.data["results"]), 2)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIsNone(response.data["next"])
+
+    def test_streaming_exports(self):
+        response = self.client.get("/api/analyses/?export=ndjson&max_overall_score=0.7")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line["overall_score"] for line in lines], [0.2, 0.6])
+
+        response = self.client.get("/api/analyses/?export=csv")
+        rows = b"".join(response.streaming_content).decode().splitlines()
+        self.assertTrue(rows[0].startswith("id,conversation_id,conversation_title"))
+        self.assertEqual(len(rows), 4)
+
+
+def async_urlconf():
+    """a copy of the app's URLconf as an ASGI deployment (ASYNC_VIEWS on) builds it"""
+    spec = importlib.util.find_spec("analysis_app.urls")
+    module = importlib.util.module_from_spec(spec)
+    with override_settings(ASYNC_VIEWS=True):
+        spec.loader.exec_module(module)
+    return module
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        for i in range(3):
+            conversation = Conversation.objects.create(title=f"conversation {i}")
+            Message.objects.bulk_create([
+                Message(conversation=conversation, sender="user", message=f"question {i}"),
+                Message(conversation=conversation, sender="ai", message=f"answer {i}"),
+            ])
+            ConversationAnalysis.objects.create(conversation=conversation, overall_score=i / 2, sentiment="neutral")
+
+    async def test_listing_matches_sync_view_and_walks_every_page(self):
+        response = await async_views.upload_json(self.factory.get("/api/conversation/?page_size=2"))
+        first = json.loads(response.content)
+        sync_first = (await sync_to_async(APIClient().get)("/api/conversation/?page_size=2")).json()
+        self.assertEqual(first["results"], sync_first["results"])
+
+        seen = [item["id"] for item in first["results"]]
+        while first["next"]:
+            response = await async_views.upload_json(self.factory.get(first["next"]))
+            first = json.loads(response.content)
+            seen.extend(item["id"] for item in first["results"])
+        self.assertEqual(seen, [c.id async for c in Conversation.objects.order_by("id")])
+
+    async def test_malformed_cursor_is_a_404_like_the_sync_views(self):
+        urlconf = async_urlconf()
+        self.assertIs(urlconf.upload_json, async_views.upload_json)
+        with self.settings(ROOT_URLCONF=urlconf):
+            for path in ("/conversation/?cursor=garbage", "/analyses/?cursor=garbage"):
+                response = await AsyncClient().get(path)
+                self.assertEqual(response.status_code, 404, path)
+                self.assertIn("detail", response.json())
+
+    async def test_upload_and_filtered_export(self):
+        body = {"title": "new", "messages": [{"sender": "user", "message": "hi", "timestamp": "2024-01-01T00:00:00Z"}]}
+        response = await async_views.upload_json(
+            self.factory.post("/api/conversation/", data=body, content_type="application/json")
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)["message_count"], 1)
+
+        response = await async_views.get_all_analyses(self.factory.get("/api/analyses/?export=ndjson&min_overall_score=0.5"))
+        lines = b"".join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual([json.loads(line)["overall_score"] for line in lines], [0.5, 1.0])
+
+    async def test_analysis_runs_in_the_bounded_executor(self):
+        conversation = await Conversation.objects.afirst()
+        threads = []
+
+        def fake_analyse(conversation, trace=None):
+            threads.append(threading.current_thread().name)
+            return {"overall_score": 0.5}, {"user_satisfaction_score": np.float32(0.5)}
+
+        with mock.patch("analysis_app.async_views.analyse_and_store", side_effect=fake_analyse):
+            response = await async_views.analyse_chat(self.factory.get(f"/api/analysis/{conversation.id}/"), conversation.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {"user_satisfaction_score": 0.5})
+        self.assertTrue(threads[0].startswith("analysis"))
+        self.assertIn("Server-Timing", response.headers)
+
+
+class RollupTests(TestCase):
+    def _analytics(self, score, escalation=False, fallback=0.0):
+        return {
+            "clarity": score, "relevance": score, "empathy": score, "overall_score": score,
+            "escalation": escalation, "fallback_count": fallback,
+        }
+
+    def test_rollups_follow_creates_and_updates(self):
+        billing = Conversation.objects.create(title="billing")
+        other = Conversation.objects.create(title="other")
+        store_analysis(billing.id, self._analytics(0.4, escalation=True))
+        store_analysis(other.id, self._analytics(0.8, fallback=0.5))
+        # re-analysis replaces the previous contribution instead of adding a second one
+        store_analysis(billing.id, self._analytics(0.6))
+
+        overall = AnalysisRollup.objects.get(title="")
+        self.assertEqual(overall.count, 2)
+        self.assertAlmostEqual(overall.sum_overall_score, 1.4)
+        self.assertEqual(overall.escalations, 0)
+        self.assertEqual(overall.fallbacks, 1)
+        self.assertEqual(AnalysisRollup.objects.get(title="billing").count, 1)
+
+        response = APIClient().get("/api/analyses/summary/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["totals"]["count"], 2)
+        self.assertEqual(response.data["totals"]["avg_overall_score"], 0.7)
+        self.assertEqual(response.data["totals"]["fallback_rate"], 0.5)
+        self.assertEqual(len(response.data["days"]), 1)
+
+        by_title = APIClient().get("/api/analyses/summary/?title=billing")
+        self.assertEqual(by_title.data["totals"]["avg_clarity"], 0.6)
+
+    def test_writer_upserts_batches_with_constant_queries(self):
+        from django.test.utils import CaptureQueriesContext
+
+        conversations = [Conversation.objects.create(title="billing") for _ in range(5)]
+        store_analysis(conversations[0].id, self._analytics(0.2, escalation=True))
+
+        def write(batch):
+            with CaptureQueriesContext(connection) as queries, AnalysisWriter(batch_size=len(batch)) as writer:
+                for conversation in batch:
+                    writer.add(conversation.id, self._analytics(0.5))
+            return len(queries), writer.written
+
+        self.assertEqual(write(conversations[:2]), (write(conversations)[0], 2))
+        self.assertEqual(ConversationAnalysis.objects.filter(overall_score=0.5).count(), 5)
+        overall = AnalysisRollup.objects.get(title="")
+        self.assertEqual(overall.count, 5)
+        self.assertAlmostEqual(overall.sum_overall_score, 2.5)
+        self.assertEqual(overall.escalations, 0)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        conversation = Conversation.objects.create(title="billing")
+        other = Conversation.objects.create(title="other")
+        store_analysis(conversation.id, self._analytics(0.5, escalation=True, fallback=0.333))
+        store_analysis(other.id, self._analytics(0.7, fallback=0.25))
+        # the update removes the contribution read back from the database, which must be the one it added
+        store_analysis(other.id, self._analytics(0.7, fallback=0.0))
+        fields = ("title", "count", "sum_clarity", "escalations", "fallbacks")
+        before = list(AnalysisRollup.objects.order_by("title").values(*fields))
+        rebuild_rollups()
+        after = list(AnalysisRollup.objects.order_by("title").values(*fields))
+        self.assertEqual(before, after)
+        self.assertEqual(AnalysisRollup.objects.get(title="").fallbacks, 1)
+        self.assertEqual(ConversationAnalysis.objects.get(conversation=conversation).fallback_count, 0.333)
+
+
+class MessageFeatureStoreTests(TestCase):
+    def _fake_compute(self, texts, emotion_engine=None, n_process=None):
+        self.computed.extend(texts)
+        return {
+            text: MessageFeatureRow(
+                np.full(4, len(text), dtype=np.float32), np.full(7, 1 / 7, dtype=np.float32),
+                0.5, 0.1, 60.0, frozenset(text.lower().split()), 1,
+            )
+            for text in texts
+        }
+
+    def setUp(self):
+        self.computed = []
+        conversation = Conversation.objects.create(title="features")
+        Message.objects.bulk_create([
+            Message(conversation=conversation, sender="user", message="Where is my order"),
+            Message(conversation=conversation, sender="ai", message="It ships today"),
+        ])
+        self.messages = list(Message.objects.order_by("id").values("id", "message"))
+
+    def test_models_only_run_for_messages_without_features(self):
+        with mock.patch("analysis_app.features.compute_features", side_effect=self._fake_compute):
+            first = ensure_message_features(self.messages)
+            second = ensure_message_features(self.messages)
+
+        self.assertEqual(self.computed, ["Where is my order", "It ships today"])
+        self.assertEqual(MessageFeatures.objects.count(), 2)
+        for message in self.messages:
+            np.testing.assert_array_equal(first[message["id"]].embedding, second[message["id"]].embedding)
+            self.assertEqual(second[message["id"]].keyphrases, frozenset(message["message"].lower().split()))
+
+    def test_edited_message_is_recomputed(self):
+        with mock.patch("analysis_app.features.compute_features", side_effect=self._fake_compute):
+            ensure_message_features(self.messages)
+            Message.objects.filter(id=self.messages[1]["id"]).update(message="It shipped yesterday")
+            ensure_message_features(list(Message.objects.order_by("id").values("id", "message")))
+
+        self.assertEqual(self.computed[-1], "It shipped yesterday")
+        self.assertEqual(len(self.computed), 3)
+
+    def test_backend_and_quantization_switches_recompute_features_and_results(self):
+        versions = set()
+        with mock.patch("analysis_app.features.compute_features", side_effect=self._fake_compute):
+            for backend, quantized in (("torch", True), ("onnx", True), ("onnx", False)):
+                with self.settings(INFERENCE_BACKEND=backend, ONNX_QUANTIZED=quantized):
+                    ensure_message_features(self.messages)
+                    ensure_message_features(self.messages)
+                    versions.add(analysis_version())
+
+        # each configuration computed its own vectors once and got its own result cache version
+        self.assertEqual(len(self.computed), 3 * 2)
+        self.assertEqual(len(versions), 3)
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def _traced(self, **settings):
+        def stage():
+            count_model_call("sentence")
+            count_model_call("emotion", 2)
+            return 42
+
+        with self.settings(**settings), AnalysisTrace(conversation_id=7) as trace:
+            self.assertEqual(trace.call("empathy", stage), 42)
+            trace.call("clarity", lambda: None)
+        return trace
+
+    def test_stage_timings_and_model_calls(self):
+        trace = self._traced()
+        self.assertEqual(trace.stages["empathy"]["model_calls"], {"sentence": 1, "emotion": 2})
+        self.assertEqual(trace.stages["clarity"]["model_calls"], {})
+        self.assertGreaterEqual(trace.wall_seconds, trace.stages["empathy"]["wall_seconds"])
+        self.assertIn('empathy;dur=', trace.server_timing())
+        self.assertIn('total;dur=', trace.server_timing())
+        # calls outside a trace are ignored
+        count_model_call("sentence")
+
+    def test_peak_rss_is_sampled_without_resetting_the_process_counter(self):
+        samples = iter([100, 300, 200, 120, 110, 150])
+        with mock.patch("analysis_app.instrumentation._rss_bytes", side_effect=lambda: next(samples)), \
+                mock.patch("analysis_app.instrumentation.reset_peak_rss") as reset:
+            trace = self._traced()
+        self.assertEqual(trace.peak_rss_bytes, 300)
+        reset.assert_not_called()
+
+    def test_stage_cpu_time_excludes_concurrent_stages(self):
+        def burn():
+            deadline = time.thread_time() + 0.2
+            while time.thread_time() < deadline:
+                pass
+
+        with AnalysisTrace() as trace:
+            waiting = threading.Thread(target=trace.call, args=("accuracy", time.sleep, 0.3))
+            waiting.start()
+            trace.call("clarity", burn)
+            waiting.join()
+
+        self.assertGreaterEqual(trace.stages["clarity"]["cpu_seconds"], 0.2)
+        self.assertLess(trace.stages["accuracy"]["cpu_seconds"], 0.05)
+        self.assertGreaterEqual(trace.cpu_seconds, 0.2)
+
+    def test_slow_analysis_is_logged_as_json(self):
+        with self.assertLogs("analysis_app.instrumentation", level="WARNING") as logs:
+            self._traced(ANALYSIS_SLOW_THRESHOLD_SECONDS=0)
+        entry = json.loads(logs.output[0].split(":", 2)[2])
+        self.assertEqual(entry["event"], "slow_analysis")
+        self.assertEqual(entry["conversation_id"], 7)
+        self.assertEqual(entry["stages"]["empathy"]["model_calls"]["emotion"], 2)
+
+    def test_metrics_endpoint(self):
+        self._traced()
+        response = APIClient().get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn("analysis_total 1\n", body)
+        self.assertIn('analysis_model_calls_total{model="emotion"} 2\n', body)
+        self.assertIn('analysis_stage_seconds_count{stage="empathy"} 1\n', body)
+
+
+class BenchAnalysisTests(TestCase):
+    def test_synthetic_conversations_are_ingestable(self):
+        from .management.commands.bench_analysis import StubGeminiClient, synthetic_conversations
+
+        lines = list(synthetic_conversations(3, turns=4, min_words=2, max_words=5))
+        report = list(ingest_jsonl(lines))
+        self.assertEqual([entry["status"] for entry in report], ["ok"] * 3)
+        self.assertEqual(Message.objects.count(), 3 * 4 * 2)
+        self.assertEqual(lines, list(synthetic_conversations(3, turns=4, min_words=2, max_words=5)))
+        self.assertEqual(StubGeminiClient().score_many([[("hi", "hello")], []]), [(0.8, "accurate"), (0.0, "inaccurate")])
+
+    def test_daily_run_can_be_narrowed_to_a_queryset(self):
+        kept = Conversation.objects.create(title="kept")
+        other = Conversation.objects.create(title="other")
+        with mock.patch("analysis_app.cron.analyse_chunk", return_value=[]) as analyse:
+            summary = run_daily_analysis(conversations=Conversation.objects.filter(id=kept.id), full=True)
+        self.assertEqual(summary["conversations"], 1)
+        self.assertEqual(analyse.call_args[0][0], [kept.id])
+        self.assertNotIn(other.id, analyse.call_args[0][0])
+
+
+class ParallelAnalysisTests(TestCase):
+    """the worker fan-out, with an in-process pool standing in for the spawned analysis processes"""
+
+    def setUp(self):
+        self.ids = [Conversation.objects.create(title=f"conversation {i}").id for i in range(7)]
+        self.chunks = []
+        self.failing = None
+        self.addCleanup(mock.patch.stopall)
+        mock.patch(
+            "analysis_app.cron.ProcessPoolExecutor",
+            lambda max_workers, mp_context, initializer, initargs: ThreadPoolExecutor(max_workers),
+        ).start()
+
+    def _fake_chunk(self, chunk_ids, full=False):
+        # no database access here, the pool's threads cannot see the test transaction
+        self.chunks.append(chunk_ids)
+        if self.failing in chunk_ids:
+            raise RuntimeError("worker failed")
+        time.sleep(0.01)
+        return [(cid, {"overall_score": cid / 10, "sentiment": "neutral"}) for cid in chunk_ids]
+
+    def test_every_conversation_is_written_once_by_the_parent(self):
+        with mock.patch("analysis_app.workers.analyse_chunk", side_effect=self._fake_chunk), \
+                mock.patch("analysis_app.cron.AnalysisWriter.add", autospec=True, side_effect=AnalysisWriter.add) as add:
+            summary = run_daily_analysis(workers=2, chunk_size=2)
+
+        self.assertEqual(summary, {"conversations": 7, "analysed": 7, "skipped": 0})
+        self.assertEqual(sorted(cid for chunk in self.chunks for cid in chunk), self.ids)
+        self.assertEqual(sorted(call.args[1] for call in add.call_args_list), self.ids)
+        self.assertEqual(
+            dict(ConversationAnalysis.objects.values_list("conversation_id", "overall_score")),
+            {cid: cid / 10 for cid in self.ids},
+        )
+
+    def test_worker_errors_reach_the_caller(self):
+        self.failing = self.ids[3]
+        with mock.patch("analysis_app.workers.analyse_chunk", side_effect=self._fake_chunk):
+            with self.assertRaisesMessage(RuntimeError, "worker failed"):
+                run_daily_analysis(workers=2, chunk_size=2)
+
+
+class StreamingAnalysisTests(TestCase):
+    @staticmethod
+    def _fake_compute(texts, emotion_engine=None, n_process=None):
+        rows = {}
+        for text in texts:
+            rng = np.random.default_rng(len(text) * 31 + sum(map(ord, text)))
+            emotion = rng.random(7).astype(np.float32)
+            rows[text] = MessageFeatureRow(
+                rng.random(8).astype(np.float32), emotion / emotion.sum(), float(rng.uniform(-1, 1)),
+                float(rng.uniform(-1, 1)), float(rng.uniform(-20, 110)), frozenset(text.lower().split()[:3]),
+                1 + len(text) % 3,
+            )
+        return rows
+
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title="long")
+        texts = [
+            ("user", "My order never arrived"), ("ai", "Sorry, let me check the order"),
+            ("user", "It was order 42"), ("user", "   "), ("ai", "Order 42 ships tomorrow"),
+            ("user", "Can I get a refund"), ("ai", "Maybe, refunds take five days"),
+            ("ai", "Anything else?"), ("user", "No thanks"), ("user", "Bye"),
+        ]
+        Message.objects.bulk_create([Message(conversation=self.conversation, sender=s, message=m) for s, m in texts])
+
+    def test_streaming_matches_full_analysis(self):
+        from .management.commands.bench_analysis import StubGeminiClient
+        from .model_registry import registry
+
+        with mock.patch("analysis_app.features.compute_features", side_effect=self._fake_compute), \
+                registry.override("gemini", StubGeminiClient()), self.settings(ANALYSIS_STREAM_CHUNK_SIZE=3):
+            full_data, full = get_conversation_analysis(self.conversation, streaming=False, use_cache=False)
+            streamed_data, streamed = get_conversation_analysis(self.conversation, streaming=True, use_cache=False)
+
+        self.assertEqual(full_data["content_hash"], streamed_data["content_hash"])
+        self.assertEqual(full.keys(), streamed.keys())
+        for key, value in full.items():
+            if isinstance(value, float):
+                self.assertAlmostEqual(value, streamed[key], places=6, msg=key)
+            elif key != "analytics":
+                self.assertEqual(value, streamed[key], msg=key)
+
+    def test_nightly_chunk_only_sends_the_window_of_a_streamed_conversation(self):
+        from .cron import analyse_chunk
+        from .empathy_utils import EmotionEngine
+        from .management.commands.bench_analysis import StubGeminiClient
+        from .model_registry import registry
+
+        short = Conversation.objects.create(title="short")
+        Message.objects.bulk_create([
+            Message(conversation=short, sender="user", message="Hi"), Message(conversation=short, sender="ai", message="Hello"),
+        ])
+        seen = []
+
+        class RecordingGemini(StubGeminiClient):
+            def score_many(self, pairs_lists):
+                pairs_lists = [list(pairs) for pairs in pairs_lists]
+                seen.extend(pairs_lists)
+                return super().score_many(pairs_lists)
+
+        with mock.patch("analysis_app.features.compute_features", side_effect=self._fake_compute) as compute, \
+                registry.override("gemini", RecordingGemini()), \
+                self.settings(ANALYSIS_STREAMING_THRESHOLD=5, GEMINI_MAX_TRANSCRIPT_PAIRS=2):
+            results = analyse_chunk([self.conversation.id, short.id], EmotionEngine(), full=True)
+
+        self.assertEqual(sorted(cid for cid, _ in results), sorted([self.conversation.id, short.id]))
+        # the short conversation's whole transcript (prefetch and analysis, the stub has no response cache),
+        # the long one only as its 2-pair window
+        self.assertEqual(sorted(len(pairs) for pairs in seen), [1, 1, 2])
+        self.assertNotIn("My order never arrived", compute.call_args_list[0][0][0])
+
+    def test_transcript_window_keeps_first_and_last_turns(self):
+        pairs = [(f"u{i}", f"a{i}") for i in range(9)]
+        window = TranscriptWindow.of(pairs, limit=4)
+        self.assertEqual(list(window), pairs[:2] + pairs[-2:])
+        self.assertEqual(window.omitted, 5)
+        self.assertEqual(list(TranscriptWindow.of(pairs[:3], limit=4)), pairs[:3])
+        self.assertEqual(list(TranscriptWindow.of(pairs, limit=0)), pairs)
+
+    def test_only_streamed_analyses_truncate_the_transcript(self):
+        pairs = [(f"question {i}", f"answer {i}") for i in range(5)]
+        client = GeminiAccuracyClient(api_base="http://127.0.0.1:9")
+        with self.settings(GEMINI_MAX_TRANSCRIPT_PAIRS=2), \
+                mock.patch.object(client, "agenerate_many", return_value=["0.5"]) as generate:
+            client.score(pairs)
+        self.assertNotIn("omitted", generate.call_args[0][0][0])
+        self.assertIn("question 2", generate.call_args[0][0][0])
+
+
+class MetricRegistryTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title="subset")
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender="user", message="Where is my order"),
+            Message(conversation=self.conversation, sender="ai", message="It ships today, sorry for the wait"),
+        ])
+        with mock.patch("analysis_app.features.compute_features", side_effect=StreamingAnalysisTests._fake_compute):
+            ensure_message_features(list(Message.objects.values("id", "message")))
+
+    def test_subset_only_computes_declared_inputs(self):
+        unused = mock.Mock(side_effect=AssertionError("input not declared by the selected metrics"))
+        with mock.patch("analysis_app.features.ConversationFeatures.similarities", unused), \
+                mock.patch("analysis_app.features.ConversationFeatures.parsed", unused), \
+                mock.patch("analysis_app.features.ConversationFeatures.emotion_engine", unused):
+            analytics_data, api_response = get_conversation_analysis(
+                self.conversation, streaming=False, metrics=["sentiment", "clarity"]
+            )
+
+        self.assertEqual(set(api_response), {"analytics", "sentiment_score", "sentiment_label", "clarity_score", "clarity_label"})
+        self.assertEqual(set(analytics_data), {"sentiment", "clarity", "content_hash", "analysis_version"})
+
+    def test_accuracy_overlaps_local_metrics(self):
+        from .management.commands.bench_analysis import StubGeminiClient
+        from .model_registry import registry
+
+        threads = []
+
+        class RecordingGemini(StubGeminiClient):
+            def score_many(self, pairs_lists):
+                threads.append(threading.get_ident())
+                return super().score_many(pairs_lists)
+
+        with registry.override("gemini", RecordingGemini()):
+            _, api_response = get_conversation_analysis(
+                self.conversation, streaming=False, metrics=["escalation"]
+            )
+
+        self.assertNotEqual(threads, [threading.get_ident()])
+        # escalation pulls in the five metrics it is computed from
+        self.assertEqual(api_response["accuracy_score"], 0.8)
+        self.assertIn("resolution_rate", api_response)
+        self.assertNotIn("empathy_score", api_response)
+
+    def test_unknown_metric_is_rejected(self):
+        response = APIClient().get(f"/api/analysis/{self.conversation.id}/?metrics=sentiment,tone")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("tone", response.json()["metrics"][0])
+
+
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        from .management.commands.bench_analysis import StubGeminiClient
+        from .model_registry import registry
+
+        self.conversation = Conversation.objects.create(title="cached")
+        Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender="user", message="Where is my order"),
+            Message(conversation=self.conversation, sender="ai", message="It ships today, sorry for the wait"),
+        ])
+        with mock.patch("analysis_app.features.compute_features", side_effect=StreamingAnalysisTests._fake_compute):
+            ensure_message_features(list(Message.objects.values("id", "message")))
+        self.client = APIClient()
+        self.gemini = StubGeminiClient()
+        override = registry.override("gemini", self.gemini)
+        override.__enter__()
+        self.addCleanup(override.__exit__, None, None, None)
+
+    def test_unchanged_conversation_is_answered_from_cache(self):
+        url = f"/api/analysis/{self.conversation.id}/"
+        first = self.client.get(url)
+        stored = ConversationAnalysis.objects.get(conversation=self.conversation)
+
+        with mock.patch("analysis_app.metric_registry.run_metrics", side_effect=AssertionError("models ran")):
+            second = self.client.get(url)
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(ConversationAnalysis.objects.get(conversation=self.conversation).created_at, stored.created_at)
+
+        Message.objects.create(conversation=self.conversation, sender="user", message="Thanks!")
+        with mock.patch("analysis_app.features.compute_features", side_effect=StreamingAnalysisTests._fake_compute):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 200)
+
+    def test_full_daily_run_recomputes_despite_a_fresh_cache_entry(self):
+        self.client.get(f"/api/analysis/{self.conversation.id}/")
+        self.assertEqual(AnalysisResult.objects.count(), 1)
+
+        from . import metric_registry
+        with mock.patch("analysis_app.metric_registry.run_metrics", wraps=metric_registry.run_metrics) as run:
+            self.assertEqual(run_daily_analysis(full=True)["analysed"], 1)
+            self.assertEqual(run.call_count, 1)
+            # an incremental run over a conversation that lost its analysis is answered from the cache
+            ConversationAnalysis.objects.all().delete()
+            self.assertEqual(run_daily_analysis()["analysed"], 1)
+            self.assertEqual(run.call_count, 1)
+
+    def test_result_with_a_failed_stage_is_not_cached(self):
+        def failing_score_many(pairs_lists):
+            record_failure("gemini")
+            return [(0.0, "inaccurate") for _ in pairs_lists]
+
+        with mock.patch.object(self.gemini, "score_many", side_effect=failing_score_many):
+            response = self.client.get(f"/api/analysis/{self.conversation.id}/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(AnalysisResult.objects.exists())
+        self.assertTrue(get_conversation_analysis(self.conversation)[0] is not None)
+        self.assertEqual(AnalysisResult.objects.count(), 1)
+
+    def test_summary_supports_conditional_get(self):
+        response = self.client.get("/api/analyses/summary/")
+        self.assertEqual(self.client.get("/api/analyses/summary/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+
+class _FakeSession:
+    """stands in for an onnxruntime session whose graph returns the input ids as hidden states"""
+
+    class _Node:
+        def __init__(self, name, shape=None):
+            self.name, self.shape = name, shape
+
+    def get_inputs(self):
+        return [self._Node("input_ids"), self._Node("attention_mask")]
+
+    def get_outputs(self):
+        return [self._Node("last_hidden_state", ["batch", "sequence", 2])]
+
+    def run(self, output_names, feed):
+        ids = feed["input_ids"].astype(np.float32)
+        return [np.stack([ids, np.ones_like(ids)], axis=-1)]
+
+
+class OnnxBackendTests(SimpleTestCase):
+    def test_sentence_encoder_mean_pools_and_normalises_in_input_order(self):
+        from .onnx_backend import OnnxSentenceEncoder
+
+        def tokenizer(texts, **kwargs):
+            width = max(len(text.split()) for text in texts)
+            ids = np.array([[len(w) for w in text.split()] + [0] * (width - len(text.split())) for text in texts])
+            return {"input_ids": ids, "attention_mask": (ids > 0).astype(np.int64), "token_type_ids": ids * 0}
+
+        encoder = object.__new__(OnnxSentenceEncoder)
+        encoder.tokenizer, encoder.session = tokenizer, _FakeSession()
+        embeddings = encoder.encode(["abc defgh", "a"], batch_size=1)
+
+        # mean of (3, 1) and (5, 1) is (4, 1), padding is ignored
+        np.testing.assert_allclose(embeddings[0], np.array([4, 1]) / np.sqrt(17), rtol=1e-6)
+        np.testing.assert_allclose(embeddings[1], np.array([1, 1]) / np.sqrt(2), rtol=1e-6)
+
+    @skipUnless(
+        all(importlib.util.find_spec(name) for name in ("onnxruntime", "torch", "sentence_transformers")),
+        "needs onnxruntime, torch and sentence-transformers",
+    )
+    def test_onnx_backend_matches_torch(self):
+        from django.conf import settings
+        from .onnx_backend import INT8_FILENAME, compare_backends, model_dir
+
+        if not all((model_dir(name) / INT8_FILENAME).exists() for name in ("sentence", "emotion")):
+            self.skipTest(f"no exported models in {settings.ONNX_MODEL_DIR}, run export_onnx_models")
+        parity = compare_backends([
+            "Where is my refund?", "Thanks so much, that solved it!",
+            "I am really frustrated that nobody has replied to my ticket for a week.",
+        ])
+        self.assertGreaterEqual(parity["sentence_min_cosine"], 0.98)
+        self.assertLessEqual(parity["emotion_max_abs_diff"], 0.08)
+
+
+class InferenceDaemonTests(SimpleTestCase):
+    def setUp(self):
+        import tempfile
+        from .inference_server import InferenceServer
+
+        def embed(texts):
+            time.sleep(0.02)
+            return np.array([[len(text), 1.0] for text in texts], dtype=np.float32).reshape(-1, 2)
+
+        def parse(texts):
+            return [(sorted(text.lower().split()), 1) for text in texts]
+
+        self.path = f"{tempfile.mkdtemp()}/inference.sock"
+        self.server = InferenceServer(self.path, ops={"embed": embed, "parse": parse}, max_wait=0.05)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_concurrent_requests_are_merged_into_batches(self):
+        from .inference_client import InferenceClient
+
+        client = InferenceClient(self.path)
+        results = {}
+        texts = [[f"text {i}", "x" * i] for i in range(8)]
+        threads = [
+            threading.Thread(target=lambda i=i: results.__setitem__(i, client.embed(texts[i]))) for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i in range(8):
+            np.testing.assert_array_equal(results[i][:, 0], [len(text) for text in texts[i]])
+        stats = client.stats()["embed"]
+        self.assertEqual(stats["requests"], 8)
+        self.assertLess(stats["batches"], 8)
+
+    def test_metric_helpers_use_the_daemon_when_configured(self):
+        from .utils import encode_messages, parse_texts
+
+        with self.settings(INFERENCE_SOCKET=self.path), \
+                mock.patch("analysis_app.utils.get_sentence_model", side_effect=AssertionError("loaded locally")):
+            embeddings = encode_messages(["hello", "hi", "hello"])
+            parsed = parse_texts(["Where is my Order"])
+        np.testing.assert_array_equal(embeddings[:, 0], [5, 2, 5])
+        self.assertEqual(parsed, {"Where is my Order": ({"where", "is", "my", "order"}, 1)})
@@ -1,9 +1,21 @@
 
+from django.conf import settings
 from django.urls import path
-from .views import upload_json, analyse_chat, get_all_analyses
+from .views import (
+    upload_json, bulk_upload_jsonl, analyse_chat, get_all_analyses, get_analyses_summary, analysis_job_status,
+    analysis_metrics,
+)
+
+if settings.ASYNC_VIEWS:
+    # ASGI deployments: the read, ingest and analysis endpoints as coroutines
+    from .async_views import upload_json, analyse_chat, get_all_analyses
 
 urlpatterns = [
     path('conversation/', upload_json),
+    path('conversation/bulk/', bulk_upload_jsonl, name='bulk_upload_jsonl'),
     path("analysis/<int:conversation_id>/", analyse_chat, name="Gives a Conversation Analysis"),
+    path("analysis/jobs/<int:job_id>/", analysis_job_status, name="analysis_job_status"),
     path('analyses/', get_all_analyses, name='get_all_analyses'),
+    path('analyses/summary/', get_analyses_summary, name='get_analyses_summary'),
+    path('metrics/', analysis_metrics, name='analysis_metrics'),
 ]
\ No newline at end of file
@@ -1,15 +1,13 @@
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from textblob import TextBlob
-from transformers import pipeline
-from sentence_transformers import SentenceTransformer
-import textstat
-from datetime import datetime
-from scipy.spatial.distance import cosine
+# lexical and ML libraries are imported inside the metrics that need them so that importing
+# this module (views, admin, manage.py commands) stays cheap
+from datetime import datetime, timezone as dt_timezone
+import hashlib
 import numpy as np
-import spacy
-
-nlp = spacy.load("en_core_web_sm")
-model = SentenceTransformer('all-MiniLM-L6-v2')
+from django.conf import settings
+from .model_registry import get_sentence_model, get_nlp
+from .lexical_utils import lexical_features_for
+from .inference_client import get_inference_client
+from .instrumentation import count_model_call
 
 def _normalize(value: float, min_val: float = 0, max_val: float = 1) -> float:
     """
@@ -21,145 +19,226 @@ def _normalize(value: float, min_val: float = 0, max_val: float = 1) -> float:
     norm = (val - min_val) / (max_val - min_val)
     return round(norm, 3)
 
-def compute_relavance_score(pairs):
-    similarities = []
-    for umsg , aimsg in pairs:
-        umsg_emb = model.encode(umsg)
-        aimsg_emb = model.encode(aimsg)
-        similarity = 1 - cosine(umsg_emb , aimsg_emb)
-        similarities.append(similarity)
-    if not similarities:
-        return 0.0, "low"
-    avg_similarity = sum(similarities) / len(similarities)
+def content_fingerprint(rows):
+    """
+    sha256 over (sender, message, timestamp) rows in id order, changes whenever a message is added, edited or removed
+    """
+    digest = hashlib.sha256()
+    for sender, message, timestamp in rows:
+        if getattr(timestamp, "tzinfo", None) is not None:
+            # as the database returns it, so that hashes of just-written messages match later reads
+            timestamp = timestamp.astimezone(dt_timezone.utc)
+        stamp = timestamp.isoformat() if hasattr(timestamp, "isoformat") else str(timestamp or "")
+        digest.update(f"{sender}\x1f{message}\x1f{stamp}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+def encode_messages(texts):
+    """
+    embeds every text with a single batched encode call, duplicate texts are embedded once
+    """
+    texts = list(texts)
+    client = get_inference_client()
+    if client is None:
+        model = get_sentence_model()
+        if not texts:
+            return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    unique_texts = list(dict.fromkeys(texts))
+    if client is not None:
+        embeddings = client.embed(unique_texts)
+    else:
+        embeddings = model.encode(unique_texts, batch_size=64, convert_to_numpy=True)
+    count_model_call("sentence")
+    index = {text: i for i, text in enumerate(unique_texts)}
+    return embeddings[[index[text] for text in texts]]
+
+def pair_similarities(user_embs, ai_embs):
+    """
+    row-wise cosine similarity between two equally sized embedding matrices
+    """
+    user_embs = np.asarray(user_embs, dtype=np.float32)
+    ai_embs = np.asarray(ai_embs, dtype=np.float32)
+    if user_embs.size == 0 or ai_embs.size == 0:
+        return np.zeros(0, dtype=np.float32)
+    dots = np.einsum("ij,ij->i", user_embs, ai_embs)
+    norms = np.linalg.norm(user_embs, axis=1) * np.linalg.norm(ai_embs, axis=1)
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+def compute_pair_similarities(pairs):
+    """
+    embeds all user and ai messages of the pairs in one pass and returns their cosine similarities
+    """
+    pairs_list = list(pairs) if not isinstance(pairs, list) else pairs
+    if not pairs_list:
+        return np.zeros(0, dtype=np.float32)
+    embeddings = encode_messages([u for u, _ in pairs_list] + [a for _, a in pairs_list])
+    return pair_similarities(embeddings[:len(pairs_list)], embeddings[len(pairs_list):])
+
+def _relevance_label(avg_similarity):
     label = "low"
     if avg_similarity > 0.7:
         label = "high"
     elif avg_similarity > 0.4:
         label = "medium"
-    return avg_similarity , label
-
-def analyze_sentiment(messages):
-    def get_sentiment_score(message):
-        if not message or message.strip() == "":
-            return 0
-        vader_score = SentimentIntensityAnalyzer().polarity_scores(message)['compound']
-        textblob_score = TextBlob(message).sentiment.polarity
-        final = (0.7 * vader_score) + (0.3 * textblob_score)
-        return final
-    sentiments = [get_sentiment_score(message["message"]) for message in messages]
-    if not sentiments:
-        return 0, "neutral"
-    avg_sentiment = sum(sentiments) / len(sentiments)
+    return label
 
+def compute_relavance_score(pairs, similarities=None):
+    if similarities is None:
+        similarities = compute_pair_similarities(pairs)
+    if len(similarities) == 0:
+        return 0.0, "low"
+    avg_similarity = float(np.mean(similarities))
+    return avg_similarity , _relevance_label(avg_similarity)
+
+def sentiment_values(texts, lexical=None):
+    """per-message sentiment, 0.7 * VADER compound + 0.3 * TextBlob polarity"""
+    lexical = lexical_features_for(texts, lexical)
+    return (0.7 * lexical.column("vader", texts)) + (0.3 * lexical.column("polarity", texts))
+
+def _sentiment_label(avg_sentiment):
     label = "neutral"
     if avg_sentiment > 0.2:
         label = "positive"
     elif avg_sentiment < -0.2:
         label = "negative"
-    return avg_sentiment , label
-    
-def compute_clarity(aimessages):
-    claritites = []
-    for message in aimessages:
-        text = message["message"]
-        if not text or text.strip() == "":
-            continue
-        clarity_score = textstat.flesch_reading_ease(text)
-        claritites.append(_normalize(clarity_score,-100,121))
-    avg_clarity = sum(claritites) / len(claritites) if claritites else 0
+    return label
+
+def analyze_sentiment(messages, lexical=None):
+    texts = [message["message"] for message in messages]
+    if not texts:
+        return 0, "neutral"
+    avg_sentiment = float(sentiment_values(texts, lexical).mean())
+    return avg_sentiment , _sentiment_label(avg_sentiment)
+
+def clarity_values(texts, lexical=None):
+    """per-message clarity, Flesch reading ease scaled like _normalize(score, -100, 121)"""
+    if not texts:
+        return np.zeros(0)
+    flesch = lexical_features_for(texts, lexical).column("flesch", texts)
+    return np.round(np.clip((flesch + 100) / 221, 0, 1), 3)
+
+def _clarity_label(avg_clarity):
     label = "difficult"
     if avg_clarity >= 60:
         label = "clear"
     elif avg_clarity >= 30:
         label = "average"
-    
-    return avg_clarity , label
-
-def compute_completeness(pairs):
-
-    def extract_keyphrases(text):
-        '''Extract nouns and verbs as key phrases'''
-        doc = nlp(text)
-        keyphrases = set()
-        for chunk in doc.noun_chunks:
-            keyphrases.add(chunk.root.text.lower())
-        for token in doc:
-            if token.pos_ in ['VERB', 'NOUN'] and not token.is_stop:
-                keyphrases.add(token.text.lower())
-        return keyphrases
+    return label
+
+def compute_clarity(aimessages, lexical=None):
+    texts = [message["message"] for message in aimessages if message["message"] and message["message"].strip()]
+    claritites = clarity_values(texts, lexical)
+    avg_clarity = float(claritites.mean()) if len(claritites) else 0
+    return avg_clarity , _clarity_label(avg_clarity)
+
+def _extract_keyphrases(doc):
+    '''Extract nouns and verbs as key phrases'''
+    keyphrases = set()
+    for chunk in doc.noun_chunks:
+        keyphrases.add(chunk.root.text.lower())
+    for token in doc:
+        if token.pos_ in ['VERB', 'NOUN'] and not token.is_stop:
+            keyphrases.add(token.text.lower())
+    return keyphrases
+
+def parse_texts(texts, n_process=1, batch_size=64):
+    """
+    parses every unique text exactly once through nlp.pipe and returns {text: (keyphrases, sentence_count)},
+    n_process > 1 starts a spaCy process pool, which only the nightly run asks for
+    """
+    unique_texts = list(dict.fromkeys(texts))
+    client = get_inference_client()
+    if client is not None:
+        parsed = client.parse(unique_texts)
+        count_model_call("spacy")
+        return parsed
+    nlp = get_nlp()
+    parsed = {}
+    for text, doc in zip(unique_texts, nlp.pipe(unique_texts, batch_size=batch_size, n_process=n_process)):
+        parsed[text] = (_extract_keyphrases(doc), len(list(doc.sents)))
+    if unique_texts:
+        count_model_call("spacy")
+    return parsed
+
+def completeness_values(pairs, similarities, parsed):
+    """per-pair completeness from keyphrase coverage, semantic relevance and answer depth"""
+
     def keypoint_coverage(user_text, ai_text):
-        user_keyphrases = extract_keyphrases(user_text)
-        ai_keyphrases = extract_keyphrases(ai_text)
+        user_keyphrases = parsed[user_text][0]
+        ai_keyphrases = parsed[ai_text][0]
         if not user_keyphrases:
             return 0.0
         covered = user_keyphrases.intersection(ai_keyphrases)
         coverage = len(covered) / len(user_keyphrases)
         return coverage
-    def semantic_relavance(user_text, ai_text):
-        user_emb = model.encode(user_text)
-        ai_emb = model.encode(ai_text)
-        similarity = 1 - cosine(user_emb , ai_emb)
-        return similarity
     def deapth_ratio(user_text, ai_text):
-        user_sentences = len(list(nlp(user_text).sents))
-        ai_sentences = len(list(nlp(ai_text).sents))
+        user_sentences = parsed[user_text][1]
+        ai_sentences = parsed[ai_text][1]
         if user_sentences == 0:
             return 0.0
         ratio = ai_sentences / user_sentences
         return min(ratio, 1.0)
-    
-    pairs_list = list(pairs) if not isinstance(pairs, list) else pairs
-    
-    if not pairs_list:
-        return 0.0 , "incomplete"
-    
+
     completeness_scores = []
-    for umsg , aimsg in pairs_list:
+    for (umsg , aimsg), sem_relavance in zip(pairs, similarities):
         kp_coverage = keypoint_coverage(umsg, aimsg)
-        sem_relavance = semantic_relavance(umsg, aimsg)
         depth_rat = deapth_ratio(umsg, aimsg)
         combined_score = (0.4 * kp_coverage) + (0.4 * sem_relavance) + (0.2 * depth_rat)
         completeness_scores.append(combined_score)
-    
-    if not completeness_scores:
-        return 0.0, "incomplete"
-    
-    avg_completeness = sum(completeness_scores) / len(completeness_scores)
+    return np.asarray(completeness_scores, dtype=np.float64)
+
+def _completeness_label(avg_completeness):
     label = "incomplete"
     if avg_completeness >= 0.7:
         label = "complete"
     elif avg_completeness >= 0.4:
         label = "partial"
-    return avg_completeness , label
+    return label
+
+def compute_completeness(pairs, similarities=None, parsed=None):
+    pairs_list = list(pairs) if not isinstance(pairs, list) else pairs
+    
+    if not pairs_list:
+        return 0.0 , "incomplete"
+    
+    if similarities is None:
+        similarities = compute_pair_similarities(pairs_list)
+    missing = [text for pair in pairs_list for text in pair if parsed is None or text not in parsed]
+    if missing:
+        parsed = {**(parsed or {}), **parse_texts(missing)}
+    
+    completeness_scores = completeness_values(pairs_list, similarities, parsed)
+    if not len(completeness_scores):
+        return 0.0, "incomplete"
+    
+    avg_completeness = float(completeness_scores.mean())
+    return avg_completeness , _completeness_label(avg_completeness)
+
+FALLBACK_KEYWORDS = ['sorry', 'apologize', 'not sure', 'don\'t know', 'unclear', 'uncertain', 'maybe', 'perhaps', 'might']
+
+def is_fallback(text):
+    text = text.lower()
+    return any(keyword in text for keyword in FALLBACK_KEYWORDS)
+
+def _fallback_label(freq):
+    return "low" if freq <= 0.1 else "medium" if freq <= 0.3 else "high"
 
 def compute_fallback_frequency(ai_msgs):
     if not ai_msgs: 
         return 0.0, "low"
     
-    fallback_keywords = ['sorry', 'apologize', 'not sure', 'don\'t know', 'unclear', 'uncertain', 'maybe', 'perhaps', 'might']
-    
-    fallback_count = 0
-    for msg in ai_msgs:
-        text = msg.get('message', '').lower()
-        if any(keyword in text for keyword in fallback_keywords):
-            fallback_count += 1
+    fallback_count = sum(1 for msg in ai_msgs if is_fallback(msg.get('message', '')))
     
     freq = fallback_count / len(ai_msgs) if ai_msgs else 0.0
-    lbl = "low" if freq <= 0.1 else "medium" if freq <= 0.3 else "high"
-    return round(freq, 3), lbl
+    return round(freq, 3), _fallback_label(freq)
 
-def compute_resolution_rate(pairs):
+def compute_resolution_rate(pairs, similarities=None):
     if not pairs:
         return 0.0
     
-    embed = SentenceTransformer("all-MiniLM-L6-v2")
-    scores = []
-    for u, a in pairs:
-        u_vec, a_vec = embed.encode(u), embed.encode(a)
-        similarity = 1 - cosine(u_vec, a_vec)
-        scores.append(similarity)
+    if similarities is None:
+        similarities = compute_pair_similarities(pairs)
     
-    avg_score = sum(scores) / len(scores)
+    avg_score = float(np.mean(similarities))
     return round(avg_score, 3)
 
 def compute_escalation_need(sentiment_score, completeness_score, accuracy_score, fallback_freq, resolution_score):
@@ -171,102 +250,123 @@ def compute_escalation_need(sentiment_score, completeness_score, accuracy_score,
     lbl = "low" if score <= 0.3 else "medium" if score <= 0.6 else "high"
     return round(score, 3), lbl
 
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+def response_seconds(user_msg, ai_msg):
+    """seconds between a user message and its reply, None when a timestamp is missing or malformed"""
+    try:
+        return (_as_datetime(ai_msg["timestamp"]) - _as_datetime(user_msg["timestamp"])).total_seconds()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _response_label(avg):
+    return "fast" if avg <= 2 else "moderate" if avg <= 5 else "slow"
+
 def compute_response_time(pairs):
     if not pairs: return 0.0, "no data"
-    diffs = []
-    for u, a in pairs:
-        try:
-            t1, t2 = datetime.fromisoformat(u["timestamp"]), datetime.fromisoformat(a["timestamp"])
-            diffs.append((t2 - t1).total_seconds())
-        except: continue
+    diffs = [diff for diff in (response_seconds(u, a) for u, a in pairs) if diff is not None]
     avg = sum(diffs) / len(diffs) if diffs else 0.0
-    lbl = "fast" if avg <= 2 else "moderate" if avg <= 5 else "slow"
-    return round(avg, 2), lbl
+    return round(avg, 2), _response_label(avg)
+
+def satisfaction_values(pairs, lexical=None):
+    """per-pair satisfaction from the AI reply's sentiment and how closely it matches the user's"""
+    user_texts = [user_msg for user_msg, _ in pairs]
+    ai_texts = [ai_msg for _, ai_msg in pairs]
+    lexical = lexical_features_for(user_texts + ai_texts, lexical)
+    user_sentiment = lexical.column("vader", user_texts)
+    ai_sentiment = lexical.column("vader", ai_texts)
+    
+    response_quality = (ai_sentiment + 1) / 2  # Normalize to 0-1
+    conversation_flow = 1 - np.abs(user_sentiment - ai_sentiment)
+    return (0.6 * response_quality) + (0.4 * conversation_flow)
 
-def compute_user_satisfaction(pairs):
+def _satisfaction_label(score):
+    return "high" if score >= 0.75 else "medium" if score >= 0.45 else "low"
+
+def compute_user_satisfaction(pairs, lexical=None):
     if not pairs: 
         return 0.0, "low"
     
-    analyzer = SentimentIntensityAnalyzer()
-    satisfaction_scores = []
-    
-    for user_msg, ai_msg in pairs:
-        user_sentiment = analyzer.polarity_scores(user_msg)['compound']
-        ai_sentiment = analyzer.polarity_scores(ai_msg)['compound']
-        
-        response_quality = (ai_sentiment + 1) / 2  # Normalize to 0-1
-        conversation_flow = 1 - abs(user_sentiment - ai_sentiment)
-        
-        satisfaction = (0.6 * response_quality) + (0.4 * conversation_flow)
-        satisfaction_scores.append(satisfaction)
-    
-    score = sum(satisfaction_scores) / len(satisfaction_scores)
-    lbl = "high" if score >= 0.75 else "medium" if score >= 0.45 else "low"
-    return round(score, 3), lbl
+    score = float(satisfaction_values(pairs, lexical).mean())
+    return round(score, 3), _satisfaction_label(score)
 
-def get_conversation_analysis(conversation):
-    from .models import Message
-    from .gemini_utils import compute_accuracy_score
-    from .empathy_utils import compute_empathy_score
-    
-    messages = Message.objects.filter(conversation=conversation).values("sender", "message", "timestamp")
+def split_messages(messages):
+    """
+    drops empty messages and returns (user_messages, ai_messages, pairs) where pairs zips user and ai texts in order
+    """
     messages_list = [message for message in messages if message['message'].strip() != ""]
     user_messages = [msg for msg in messages_list if msg['sender'] == 'user']
     ai_messages = [msg for msg in messages_list if msg['sender'] == 'ai']
+    pairs = list(zip([msg["message"] for msg in user_messages], [msg["message"] for msg in ai_messages]))
+    return user_messages, ai_messages, pairs
+
+def get_conversation_analysis(conversation, emotion_engine=None, progress=None, trace=None, streaming=None, metrics=None,
+                              use_cache=None):
+    """
+    progress, when given, is called as progress(stage, fraction) before each expensive stage,
+    trace is the AnalysisTrace that records per-stage timings, a new one is used when omitted.
+    streaming selects stream_conversation_analysis, by default for conversations with more than
+    ANALYSIS_STREAMING_THRESHOLD messages. metrics limits the analysis to those metric_registry
+    names (plus the metrics they require), both results then only hold their fields.
+    use_cache (default: ANALYSIS_RESULT_CACHE) answers from the result cache when the messages and
+    the analysis version are unchanged, and stores complete results that had no failures
+    """
+    from .instrumentation import AnalysisTrace
+    from .metric_registry import select
+    from .models import Message
+    from .result_cache import analysis_version, cached_result, conversation_fingerprint, store_result
+    from .streaming import stream_conversation_analysis
+
+    if use_cache is None:
+        use_cache = getattr(settings, "ANALYSIS_RESULT_CACHE", True)
+    trace = trace or AnalysisTrace(conversation.id)
+    with trace:
+        if use_cache:
+            content_hash = trace.call("load", conversation_fingerprint, conversation.id)
+            cached = trace.call("cache", cached_result, content_hash)
+            if cached is not None:
+                if metrics is not None:
+                    cached = select(cached, metrics)
+                return cached["analytics"], cached
+
+        if streaming is None:
+            threshold = getattr(settings, "ANALYSIS_STREAMING_THRESHOLD", 0)
+            streaming = bool(threshold) and Message.objects.filter(conversation=conversation).count() > threshold
+        if streaming:
+            analytics_data, api_response = stream_conversation_analysis(
+                conversation, trace, emotion_engine=emotion_engine, progress=progress
+            )
+            if metrics is not None and analytics_data is not None:
+                api_response = select(api_response, metrics)
+                analytics_data = api_response["analytics"]
+        else:
+            analytics_data, api_response = _conversation_analysis(conversation, emotion_engine, progress, trace, metrics)
+        if analytics_data is None:
+            return analytics_data, api_response
+
+        analytics_data["analysis_version"] = analysis_version()
+        if use_cache and metrics is None and not trace.failures:
+            trace.call("cache", store_result, analytics_data["content_hash"], api_response)
+        return analytics_data, api_response
+
+def _conversation_analysis(conversation, emotion_engine, progress, trace, metrics=None):
+    from .models import Message
+    from .metric_registry import assemble, run_metrics
+    
+    messages = trace.call("load", lambda: list(
+        Message.objects.filter(conversation=conversation).order_by("id").values("id", "sender", "message", "timestamp")
+    ))
+    content_hash = content_fingerprint((m["sender"], m["message"], m["timestamp"]) for m in messages)
+    user_messages, ai_messages, pairs = split_messages(messages)
     
     if not user_messages or not ai_messages:
         return None, {"error": "Insufficient data for analysis"}
     
-    pairs = list(zip([msg["message"] for msg in user_messages], [msg["message"] for msg in ai_messages]))
-    sentement_count, sentiment = analyze_sentiment(user_messages)
-    relevance_score, relevance_label = compute_relavance_score(pairs)
-    clarity_score, clarity_label = compute_clarity(ai_messages)
-    completeness_score, completeness_label = compute_completeness(pairs)
-    accuracy_score, accuracy_label = compute_accuracy_score(pairs)
-    empathy_score, empathy_label = compute_empathy_score(pairs)
-    fallback_freq, fallback_label = compute_fallback_frequency(ai_messages)
-    resolution_rate = compute_resolution_rate(pairs)
-    _, escalation_need = compute_escalation_need(sentement_count, completeness_score, accuracy_score, fallback_freq, resolution_rate)
-    response_time, response_label = compute_response_time(zip(user_messages, ai_messages))
-    user_satisfaction_score, user_satisfaction_label = compute_user_satisfaction(pairs)
-
-    analytics_data = {
-        "clarity": clarity_score,
-        "relevance": relevance_score,
-        "accuracy": accuracy_score,
-        "completeness": completeness_score,
-        "sentiment": sentiment,
-        "empathy": empathy_score,
-        "fallback_count": fallback_freq,
-        "resolution": bool(resolution_rate),
-        "escalation": bool(escalation_need),
-        "response_time": response_time,
-        "overall_score": user_satisfaction_score,
-    }
-    
-    api_response = {
-        "analytics": analytics_data,
-        "sentiment_score": sentement_count,
-        "sentiment_label": sentiment,
-        "relevance_score": relevance_score,
-        "relevance_label": relevance_label,
-        "clarity_score": clarity_score,
-        "clarity_label": clarity_label,
-        "completeness_score": completeness_score,
-        "completeness_label": completeness_label,
-        "accuracy_score": accuracy_score,
-        "accuracy_label": accuracy_label,
-        "empathy_score": empathy_score,
-        "empathy_label": empathy_label,
-        "fallback_frequency": fallback_freq,
-        "fallback_label": fallback_label,
-        "resolution_rate": resolution_rate,
-        "escalation_need": escalation_need,
-        "response_time": response_time,
-        "response_label": response_label,
-        "user_satisfaction_score": user_satisfaction_score,
-        "user_satisfaction_label": user_satisfaction_label
-    }
-    
-    return analytics_data, api_response
-
+    # embeddings, emotion vectors, lexical scores and parses come from the feature store,
+    # the models only run for messages that have no stored features yet
+    results = run_metrics(
+        messages, user_messages, ai_messages, pairs, trace,
+        names=metrics, emotion_engine=emotion_engine, progress=progress,
+    )
+    return assemble(results, content_hash)
@@ -1,55 +1,166 @@
 from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseNotModified
+from datetime import timedelta
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from rest_framework import status
+from .jobs import analyse_and_store, enqueue_analysis
+from .ingest import ingest_jsonl
+from .exports import EXPORT_FORMATS, stream_analyses
+from .result_cache import analysis_etag, conversation_fingerprint, etag_matches
+from .rollups import rollup_summary
 from .utils import get_conversation_analysis
-from .models import Conversation, Message, ConversationAnalysis
-from .serializers import ConversationUploadSerializer, ConversationSerializer, ConversationAnalysisSerializer
+from .instrumentation import AnalysisTrace, metrics
+from .models import AnalysisJob, Conversation, Message, ConversationAnalysis
+from .serializers import (
+    ConversationUploadSerializer, ConversationSerializer, ConversationAnalysisSerializer, AnalysisJobSerializer,
+    ConversationListSerializer, AnalysisFilterSerializer, RollupSummaryQuerySerializer, MetricSelectionSerializer,
+)
+
+class AnalysisCursorPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    ordering = "id"
+
 
 @api_view(['GET'])
 def get_all_analyses(request):
-    analyses = ConversationAnalysis.objects.select_related('conversation').all()
-    serializer = ConversationAnalysisSerializer(analyses, many=True)
-    return Response(serializer.data, status=200)
+    filters = AnalysisFilterSerializer(data=request.query_params)
+    if not filters.is_valid():
+        return Response(filters.errors, status=400)
+    analyses = filters.filter_queryset(ConversationAnalysis.objects.select_related('conversation'))
+
+    # ?export=ndjson|csv streams every matching row instead of returning one page
+    export = request.query_params.get("export")
+    if export:
+        if export not in EXPORT_FORMATS:
+            return Response({"error": f"export must be one of {', '.join(EXPORT_FORMATS)}"}, status=400)
+        return stream_analyses(analyses, export)
+
+    paginator = AnalysisCursorPagination()
+    page = paginator.paginate_queryset(analyses, request)
+    serializer = ConversationAnalysisSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+def get_analyses_summary(request):
+    query = RollupSummaryQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=400)
+    # defaults to the last 30 days
+    end = query.validated_data.get("end") or timezone.localdate()
+    start = query.validated_data.get("start") or end - timedelta(days=29)
+    title = query.validated_data["title"]
+    res_data = {"start": start, "end": end, "title": title, **rollup_summary(start, end, title)}
+    return Response(res_data, status=200)
+
+
+class ConversationCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    ordering = "id"
 
 
 # we will get the json in the req.body
 @api_view(['POST','GET'])
 def upload_json(req):
     if req.method == 'GET':
+        # one query for the page (message counts are stored on it), plus one prefetch query for its messages
         conversations = Conversation.objects.all()
-        res_data = []
-        for conversation in conversations:
-            serialized = ConversationSerializer(conversation).data
-            serialized["message_count"] = conversation.messages.count()
-            serialized["messages"] = conversation.messages.all().values("sender", "message", "timestamp")
-            res_data.append(serialized)
-        return Response(res_data, status=200)
+        include_messages = req.query_params.get("include_messages", "1") not in ("0", "false")
+        if include_messages:
+            conversations = conversations.prefetch_related(
+                Prefetch("messages", queryset=Message.objects.order_by("id").only("conversation_id", "sender", "message", "timestamp"))
+            )
+        paginator = ConversationCursorPagination()
+        page = paginator.paginate_queryset(conversations, req)
+        serializer = ConversationListSerializer(page, many=True, context={"include_messages": include_messages})
+        return paginator.get_paginated_response(serializer.data)
     elif req.method == 'POST':
         serializer = ConversationUploadSerializer(data=req.data)
         if serializer.is_valid():
             conversation = serializer.save()
             res_data = ConversationSerializer(conversation).data
-            res_data["message_count"] = conversation.messages.count()
+            res_data["message_count"] = conversation.message_count
             res_data["messages"] = conversation.messages.all().values("sender","message","timestamp")
             return Response(res_data , status=201)
         return Response(serializer.errors , status=400)
     return Response({"error":"Invalid request method"} , status=405)
     
+@api_view(['POST'])
+def bulk_upload_jsonl(req):
+    # the body is read line by line from the raw stream, never parsed as a whole
+    stream = req.stream
+    if stream is None:
+        return Response({"error": "Empty request body"}, status=400)
+    try:
+        batch_size = int(req.query_params.get("batch_size", 500))
+    except ValueError:
+        return Response({"error": "batch_size must be an integer"}, status=400)
+    report = list(ingest_jsonl(iter(stream.readline, b""), batch_size=max(1, batch_size)))
+    created = sum(1 for entry in report if entry["status"] == "ok")
+    res_data = {"created": created, "failed": len(report) - created, "lines": report}
+    return Response(res_data, status=201 if created else 400)
+
+def _analysis_headers(trace, etag=None):
+    headers = {"Server-Timing": trace.server_timing()}
+    # a result with a failed stage is not cached, so it must not be revalidated either
+    if etag and not trace.failures:
+        headers["ETag"] = etag
+    return headers
+
 @api_view(['GET' , 'POST'])
 def analyse_chat(request, conversation_id):
     try:
         conversation = Conversation.objects.get(id=conversation_id)
-        analytics_data, api_response = get_conversation_analysis(conversation)
+        # POST queues a background job unless ?sync=1 (or a ?metrics= subset) asks for the analysis inside the request
+        if request.method == 'POST' and request.query_params.get("sync") != "1" and "metrics" not in request.query_params:
+            job = enqueue_analysis(conversation)
+            return Response(
+                {"job_id": job.id, "status": job.status, "status_url": reverse("analysis_job_status", args=[job.id])},
+                status=status.HTTP_202_ACCEPTED,
+            )
+        selection = MetricSelectionSerializer(data=request.query_params)
+        if not selection.is_valid():
+            return Response(selection.errors, status=status.HTTP_400_BAD_REQUEST)
+        selected = selection.validated_data.get("metrics")
+        etag = None
+        if request.method == 'GET':
+            # the ETag only depends on the messages and the analysis version, so polling an unchanged
+            # conversation is answered before anything is analysed
+            etag = analysis_etag(conversation_fingerprint(conversation.id), selected)
+            if etag_matches(request.headers.get("If-None-Match"), etag):
+                return HttpResponseNotModified(headers={"ETag": etag})
+        trace = AnalysisTrace(conversation.id)
+        if selected:
+            # ?metrics= runs only those metrics and their inputs inside the request, a partial
+            # result is not stored as the conversation's analysis
+            analytics_data, api_response = get_conversation_analysis(conversation, trace=trace, metrics=selected)
+        else:
+            analytics_data, api_response = analyse_and_store(conversation, trace=trace)
         if analytics_data is None:
             return Response(api_response, status=status.HTTP_400_BAD_REQUEST)
-        ConversationAnalysis.objects.update_or_create(
-            conversation=conversation,
-            defaults=analytics_data
-        )
-        return Response(api_response, status=status.HTTP_200_OK)
+        return Response(api_response, status=status.HTTP_200_OK, headers=_analysis_headers(trace, etag))
     except Conversation.DoesNotExist:
         return Response({"error": "Conversation not found"}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+def analysis_job_status(request, job_id):
+    try:
+        job = AnalysisJob.objects.get(id=job_id)
+    except AnalysisJob.DoesNotExist:
+        return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(AnalysisJobSerializer(job).data, status=status.HTTP_200_OK)
+
+def analysis_metrics(request):
+    """per-stage timings, model calls and memory of the analyses run by this process, in the Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,50 @@
+# Entry points for analysis worker processes. Workers are spawned, so Django is set up in
+# init_worker and nothing in this module may import models at module level.
+import os
+
+_engine = None
+
+
+def share_gemini_limits(processes):
+    """
+    the Gemini limits are per process: with N workers each one gets 1/N of the rate, burst and concurrency
+    """
+    from .gemini_utils import GeminiAccuracyClient
+    from .model_registry import registry
+    registry.register("gemini", lambda: GeminiAccuracyClient.from_settings(processes=processes))
+
+
+def init_worker(torch_threads, processes=1):
+    global _engine
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "post_analysis_main.settings")
+    import django
+    django.setup()
+    share_gemini_limits(processes)
+
+    from .empathy_utils import EmotionEngine
+    from .inference_client import get_inference_client
+    _engine = EmotionEngine()
+    # with an inference daemon the models live there, this process never loads them
+    if get_inference_client() is not None:
+        return
+
+    # bounded intra-op threads so that N workers do not oversubscribe the cores
+    import torch
+    torch.set_num_threads(torch_threads)
+    torch.set_num_interop_threads(1)
+
+    from .model_registry import registry
+    for name in ("sentence", "spacy", "emotion"):
+        registry.get(name)
+
+
+def analyse_chunk(chunk_ids, full=False):
+    from .cron import analyse_chunk
+    # nested spaCy process pools inside a pool worker would oversubscribe as well
+    return analyse_chunk(chunk_ids, _engine, n_process=1, full=full)
+
+
+def job_worker(torch_threads, poll_interval, processes=1):
+    init_worker(torch_threads, processes)
+    from .jobs import work
+    work(poll_interval=poll_interval)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'post_analysis_main.settings')
+# route the async versions of the API views, set ASYNC_VIEWS=0 to compare with the sync ones
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -50,6 +50,8 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    # ETag / If-None-Match for GET responses that do not set their own ETag, 304 for polling clients
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -83,6 +85,19 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL lets the API read while the nightly run writes, synchronous=NORMAL syncs at checkpoints
+            # instead of every commit (safe under WAL), writers wait on each other instead of failing
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA mmap_size=268435456;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -135,3 +150,67 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CRONJOBS = [
     ('0 0 * * *', 'analysis_app.cron.run_daily_analysis') 
 ]
+
+
+# Serve the conversation, analysis and analyses endpoints from analysis_app.async_views. asgi.py turns
+# this on, WSGI deployments keep the synchronous DRF views. Async analyses run in a pool of
+# ASYNC_ANALYSIS_WORKERS threads so that the event loop never blocks on the models.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "False").lower() in ("1", "true", "yes")
+ASYNC_ANALYSIS_WORKERS = int(os.getenv("ASYNC_ANALYSIS_WORKERS", 2))
+
+# Analysis
+# Batch size of the DistilRoBERTa emotion model; messages are sorted by token length before batching
+EMOTION_BATCH_SIZE = int(os.getenv("EMOTION_BATCH_SIZE", 32))
+# Worker processes used by spaCy's nlp.pipe when the nightly run parses a chunk of conversations
+SPACY_N_PROCESS = int(os.getenv("SPACY_N_PROCESS", 1))
+# Nightly run: worker processes (1 = serial), conversations per chunk and torch threads per worker
+# (0 = cores divided by workers)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 1))
+ANALYSIS_CHUNK_SIZE = int(os.getenv("ANALYSIS_CHUNK_SIZE", 50))
+ANALYSIS_TORCH_THREADS = int(os.getenv("ANALYSIS_TORCH_THREADS", 0))
+# Analysis jobs: a running job whose worker sent no heartbeat (progress report) for this many seconds
+# is requeued, or failed once it was claimed ANALYSIS_JOB_MAX_ATTEMPTS times
+ANALYSIS_JOB_TIMEOUT_SECONDS = int(os.getenv("ANALYSIS_JOB_TIMEOUT_SECONDS", 900))
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_JOB_MAX_ATTEMPTS", 3))
+
+# Gemini accuracy client: concurrent requests, token-bucket rate (requests/second and burst),
+# per-request timeout in seconds and retries with exponential backoff
+GEMINI_API_KEY = os.getenv("GOOGLE_GEMINI_API_KEY", "")
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 4))
+GEMINI_RATE_PER_SECOND = float(os.getenv("GEMINI_RATE_PER_SECOND", 2))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", 4))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 30))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 3))
+
+# Analyses written per bulk upsert by the nightly run (rollups.AnalysisWriter)
+ANALYSIS_WRITE_BATCH_SIZE = int(os.getenv("ANALYSIS_WRITE_BATCH_SIZE", 500))
+# Answer repeat analyses of unchanged conversations from the AnalysisResult cache, keyed by the
+# message fingerprint and the metric/feature/model version
+ANALYSIS_RESULT_CACHE = os.getenv("ANALYSIS_RESULT_CACHE", "True").lower() in ("1", "true", "yes")
+# Analyses slower than this many seconds are logged as one JSON line by analysis_app.instrumentation
+ANALYSIS_SLOW_THRESHOLD_SECONDS = float(os.getenv("ANALYSIS_SLOW_THRESHOLD_SECONDS", 5))
+# Conversations with more messages than this are analysed by streaming them from the database,
+# ANALYSIS_STREAM_CHUNK_SIZE messages at a time (0 disables streaming)
+ANALYSIS_STREAMING_THRESHOLD = int(os.getenv("ANALYSIS_STREAMING_THRESHOLD", 2000))
+ANALYSIS_STREAM_CHUNK_SIZE = int(os.getenv("ANALYSIS_STREAM_CHUNK_SIZE", 500))
+# Longest transcript a streamed analysis sends to Gemini in user/AI pairs, longer conversations send
+# the first and last half of this many pairs (0 sends everything). Other analyses send every pair.
+GEMINI_MAX_TRANSCRIPT_PAIRS = int(os.getenv("GEMINI_MAX_TRANSCRIPT_PAIRS", 50))
+
+# Inference backend of the sentence and emotion models: "torch" or "onnx" (ONNX Runtime on the models
+# written by `manage.py export_onnx_models`, int8-quantized unless ONNX_QUANTIZED is off)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", BASE_DIR / "onnx_models"))
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "True").lower() in ("1", "true", "yes")
+# ONNX Runtime intra-op threads per process (0 = one per core)
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", 0))
+
+# Unix socket of the local inference daemon (`manage.py inference_server`). When set, web and cron
+# processes send embedding, emotion and spaCy work to the daemon instead of loading the models.
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", 60))
+# Daemon batching: texts per merged batch and how long a batch waits for more requests
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", 256))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", 5))
@@ -1,4 +1,4 @@
-import schedule, time, django, os
+import schedule, time, django, os, argparse
 from datetime import datetime
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'post_analysis_main.settings')
@@ -6,12 +6,21 @@ django.setup()
 
 from analysis_app.cron import run_daily_analysis 
 
-def job():
+def job(workers=None, chunk_size=None, full=False):
     print(f"Running analysis at {datetime.now()}")
-    run_daily_analysis()
+    summary = run_daily_analysis(workers=workers, chunk_size=chunk_size, full=full)
+    print(f"Analysed {summary['analysed']} of {summary['conversations']} conversations, skipped {summary['skipped']} unchanged")
 
-schedule.every().day.at("00:00").do(job)
+# parallel workers are spawned and re-import this module, so only the parent schedules jobs
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the conversation analysis every day at midnight")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for the nightly run")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Conversations per worker chunk")
+    parser.add_argument("--full", action="store_true", help="Re-analyse unchanged conversations as well")
+    args = parser.parse_args()
 
-while True:
-    schedule.run_pending()
-    time.sleep(60)
+    schedule.every().day.at("00:00").do(job, workers=args.workers, chunk_size=args.chunk_size, full=args.full)
+
+    while True:
+        schedule.run_pending()
+        time.sleep(60)